@@ -1,11 +1,20 @@
-import socket
+import sys
 import threading
 import tkinter as tk
 from tkinter import ttk, messagebox
-from cube_viewer import CubeViewer  # Import CubeViewer class
+from cube_viewer import CubeViewer  # Import CubeViewer class (also sets up sys.path)
+from transport import open_link, TransportError
+import metrics
+from sample import parse_pwm
+from replay import open_recorder
+import mesh
 
 ESP32_HOST = "esp32.local"  # Use IP like "192.168.x.x" if mDNS fails
 ESP32_PORT = 12345
+ESP32_URL = f"tcp:{ESP32_HOST}:{ESP32_PORT}"  # or "emulator:" / "replay:session.log?speed=10"
+CUBE_URL = None  # None = same as ESP32_URL, or "tcp:relayhost:12346" to watch through relay.py
+RECORD_FILE = None  # Set to a file name to record the control/servo session (.tlm for a store)
+CUBE_MODEL = None  # mesh.Model for the cube window, from --model <file.stl|file.obj>
 
 class FilterGUI:
     def __init__(self, root):
@@ -26,7 +35,10 @@ class FilterGUI:
         self.build_servo_tab(self.servo_tab)
 
         self.client = None
+        self.recorder = None  # one recording per session, kept across reconnects
         self.pwm_stream_thread_started = False
+        self.pwm_sample = None  # newest PWM sample, shown by show_pwm_sample
+        self.pwm_scheduled = False
         
         self.visualizer_tab = ttk.Frame(self.tabs)
         self.tabs.add(self.visualizer_tab, text="3D Visualizer")
@@ -35,6 +47,11 @@ class FilterGUI:
         self.viewer = None
         self.viewer_thread = None
 
+        self.pwm_samples = metrics.counter('samples_total', 'PWM samples applied', client='servo')
+        self.parse_errors = metrics.counter('parse_errors_total', 'Lines that failed to parse', client='servo')
+        metrics.start_http_server()  # http://127.0.0.1:9108/metrics
+        root.protocol("WM_DELETE_WINDOW", self.on_close)
+
     def build_control_tab(self, tab):
         connection_frame = ttk.LabelFrame(tab, text="Connection", padding=10)
         connection_frame.pack(fill="x", padx=10, pady=5)
@@ -112,9 +129,10 @@ class FilterGUI:
 
     def connect(self):
         try:
-            self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client.settimeout(3)
-            self.client.connect((ESP32_HOST, ESP32_PORT))
+            # Reconnects keep writing to the same recording instead of truncating it
+            if RECORD_FILE and not self.recorder:
+                self.recorder = open_recorder(RECORD_FILE, parse_pwm)
+            self.client = open_link(ESP32_URL, record=self.recorder, name='control')
             self.status_label.config(text="Status: Connected", foreground="green")
             self.read_values()
         except Exception as e:
@@ -128,15 +146,27 @@ class FilterGUI:
                 self.connect()
                 if not self.client:
                     return ""
-            self.client.sendall((command + "\n").encode())
-            response = self.client.recv(1024).decode().strip()
+            response = self.client.request(command, timeout=3)
+            if response is None:
+                raise TransportError(f"No response to '{command}'")
             return response
         except Exception as e:
             self.status_label.config(text="Status: Error", foreground="red")
             messagebox.showerror("Communication Error", str(e))
+            if self.client:
+                self.client.close()
             self.client = None
             return ""
 
+    def on_close(self):
+        if self.viewer:
+            self.viewer.stop()
+        if self.client:
+            self.client.close()
+        if self.recorder:
+            self.recorder.close()  # .tlm stores write their index on close
+        self.root.destroy()
+
     def on_slider_change(self, name, value):
         val = float(value)
         self.sliders[name]['label'].config(text=f"{val:.3f}")
@@ -183,45 +213,49 @@ class FilterGUI:
             if not self.client:
                 return
 
+        client = self.client
+
         def stream_pwm():
             try:
-                self.client.sendall(b"startPWMStream\n")
-                while True:
-                    data = self.client.recv(64)
-                    if not data:
-                        break
-                    lines = data.decode().strip().split('\n')
-                    for line in lines:
-                        if "No signal" in line:
-                            percentages = [0, 0, 0, 0]
-                        else:
-                            try:
-                                percentages = list(map(int, line.strip().split(',')))
-                                percentages = [max(0, min(100, p)) for p in percentages]
-                                if len(percentages) < 4:
-                                    percentages += [0] * (4 - len(percentages))
-                            except:
-                                continue
-                        self.root.after(0, self.update_pwm_bar_display, percentages)
+                client.send("startPWMStream")
+                while client.alive:
+                    line = client.get_line(timeout=1.0)
+                    if line is None:
+                        continue
+                    try:
+                        sample = parse_pwm(line)  # 'No signal' gives all zeros
+                    except ValueError:
+                        self.parse_errors.inc()
+                        continue
+                    self.pwm_samples.inc()
+                    # At most one display callback queued, showing the newest sample,
+                    # so Tk's after() queue cannot grow when the stream outpaces it
+                    self.pwm_sample = sample
+                    if not self.pwm_scheduled:
+                        self.pwm_scheduled = True
+                        self.root.after(0, self.show_pwm_sample)
             except Exception as e:
                 error_msg = str(e)
                 self.root.after(0, lambda: messagebox.showerror("PWM Stream Error", error_msg))
 
         threading.Thread(target=stream_pwm, daemon=True).start()
 
-    def update_pwm_bar_display(self, percentages):
-        for i, percent in enumerate(percentages[:3]):
+    def show_pwm_sample(self):
+        self.pwm_scheduled = False
+        self.update_pwm_bar_display(self.pwm_sample)
+
+    def update_pwm_bar_display(self, sample):
+        for i, percent in enumerate(sample.pwm):
             self.pwm_canvases[i].coords(self.pwm_bars[i], 0, 0, 3 * percent, 30)
             self.pwm_labels[i].config(text=f"PWM {i+1}: {percent}%")
 
-        if len(percentages) >= 4:
-            autopilot_percent = percentages[3]
-            if 0 <= autopilot_percent <= 10:
-                self.ap_label.config(text="Auto Pilot: OFF", foreground="red")
-            elif 90 <= autopilot_percent <= 100:
-                self.ap_label.config(text="Auto Pilot: ON", foreground="green")
-            else:
-                self.ap_label.config(text="Auto Pilot: Unknown", foreground="gray")
+        autopilot_percent = sample.autopilot
+        if 0 <= autopilot_percent <= 10:
+            self.ap_label.config(text="Auto Pilot: OFF", foreground="red")
+        elif 90 <= autopilot_percent <= 100:
+            self.ap_label.config(text="Auto Pilot: ON", foreground="green")
+        else:
+            self.ap_label.config(text="Auto Pilot: Unknown", foreground="gray")
 
     def build_visualizer_tab(self, tab):
         vis_frame = ttk.LabelFrame(tab, text="3D Cube Visualizer", padding=10)
@@ -229,7 +263,7 @@ class FilterGUI:
 
         def start_cube():
             if not self.viewer or not self.viewer_thread or not self.viewer_thread.is_alive():
-                self.viewer = CubeViewer(host=ESP32_HOST, port=ESP32_PORT)
+                self.viewer = CubeViewer(url=CUBE_URL or ESP32_URL, model=CUBE_MODEL)
                 self.viewer_thread = threading.Thread(target=self.viewer.run, daemon=True)
                 self.viewer_thread.start()
 
@@ -242,6 +276,12 @@ class FilterGUI:
         ttk.Button(vis_frame, text="Stop Cube", command=stop_cube).pack(pady=10)
 
 if __name__ == "__main__":
+    # Usage: python GUI.py [transport URL] [record to session file] [--model airframe.stl]
+    CUBE_MODEL = mesh.model_from_args(sys.argv)
+    if len(sys.argv) > 1:
+        ESP32_URL = sys.argv[1]
+    if len(sys.argv) > 2:
+        RECORD_FILE = sys.argv[2]
     root = tk.Tk()
     style = ttk.Style()
     style.theme_use('clam')
@@ -1,22 +1,35 @@
-import serial
+import os
+import sys
 import pygame
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from pygame.locals import *
-import threading
 
-import socket
-import pygame
-from OpenGL.GL import *
-from OpenGL.GLU import *
-from pygame.locals import *
+# Shared host modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from transport import open_link, TransportError
+import metrics
+import profiling
+from render_loop import FramePacer, set_mode_vsync, REDRAW_EVENTS
+from telemetry import TelemetryMonitor, DUPLICATE, REORDERED
+from sample import Sample, parse_angles
+import mesh
+from trail import Trail
 
 class CubeViewer:
-    def __init__(self, host='esp32.local', port=12345):
+    def __init__(self, host='esp32.local', port=12345, url=None, model=None):
         self.host = host
         self.port = port
+        self.url = url or f"tcp:{host}:{port}"
         self.running = False
         self.sock = None
+        self.model = model  # mesh.Model drawn instead of the box
+        self.trail = Trail()  # orientation history, shown with 't'
+        self.show_trail = False
+        self.samples = metrics.counter('samples_total', 'Orientation samples applied', client='cube_viewer')
+        self.parse_errors = metrics.counter('parse_errors_total', 'Lines that failed to parse', client='cube_viewer')
+        self.frame_timer = metrics.FrameTimer(client='cube_viewer')
+        self.telemetry = TelemetryMonitor(name='cube_viewer')  # gap detection and stale data policy
 
     def init_gl(self):
         glViewport(0, 0, 640, 480)
@@ -29,13 +42,24 @@ class CubeViewer:
         glEnable(GL_DEPTH_TEST)
         glDepthFunc(GL_LEQUAL)
 
-    def draw_cube(self, gx, gy):
+    def draw_cube(self, sample):
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         glLoadIdentity()
         glTranslatef(0.0, 0.0, -7.0)
-        glRotatef(gy, 1.0, 0.0, 0.0)  # Pitch
-        glRotatef(-gx, 0.0, 0.0, 1.0) # Roll
+        glPushMatrix()
+        glRotatef(sample.gy, 1.0, 0.0, 0.0)  # Pitch
+        glRotatef(-sample.gx, 0.0, 0.0, 1.0) # Roll
+
+        if self.model:
+            self.model.draw(self.model.lod_for(mesh.TRIANGLE_BUDGET))
+        else:
+            self.draw_box()
+        glPopMatrix()
 
+        if self.show_trail:
+            self.trail.draw()
+
+    def draw_box(self):
         glBegin(GL_QUADS)
         glColor3f(0, 1, 0)
         glVertex3f(1, 1, -1)
@@ -76,47 +100,65 @@ class CubeViewer:
 
     def run(self):
         try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.settimeout(3)
-            self.sock.connect((self.host, self.port))
-            self.sock.sendall(b"startCubeStream\n")
-        except Exception as e:
+            self.sock = open_link(self.url, name='cube_viewer')
+            self.sock.send("startCubeStream")
+        except (TransportError, ValueError) as e:
             print(f"Socket error: {e}")
             return
 
         pygame.init()
-        screen = pygame.display.set_mode((640, 480), DOUBLEBUF | OPENGL)
+        screen, vsync = set_mode_vsync((640, 480), DOUBLEBUF | OPENGL)
         pygame.display.set_caption("Cube Visualizer")
         self.init_gl()
-
+        if self.model:
+            self.model.reset()  # Buffers of an earlier window are gone with its context
+        self.trail.reset()
+        pacer = FramePacer(vsync=vsync)
+        metrics.start_http_server()
+
+        sample = Sample()
+        stale = False
         self.running = True
         while self.running:
             for event in pygame.event.get():
                 if event.type == QUIT:
                     self.running = False
-
-            try:
-                data = self.sock.recv(64).decode().strip()
-                lines = data.split('\n')
-                gx, gy = 0.0, 0.0
-                for line in lines:
-                    if line:
-                        parts = list(map(float, line.strip().split(',')))
-                        if len(parts) >= 2:
-                            gx, gy = parts[0], parts[1]
-                            break
-            except:
-                gx, gy = 0.0, 0.0
-
-            self.draw_cube(gx, gy)
-            pygame.display.flip()
-            pygame.time.wait(16)
-
-        try:
-            self.sock.sendall(b"stopCubeStream\n")
-            self.sock.close()
-        except:
-            pass
+                elif event.type == KEYDOWN and event.key == K_t:
+                    self.show_trail = not self.show_trail
+                elif event.type == KEYDOWN and event.key == K_F9:
+                    profiling.toggle()
+                elif event.type in REDRAW_EVENTS:
+                    pacer.invalidate()
+
+            # Use the newest good sample received since the last frame
+            for line in self.sock.read_lines():
+                try:
+                    new_sample = parse_angles(line, count=2)
+                except ValueError:
+                    self.parse_errors.inc()
+                    continue
+                if self.telemetry.update(new_sample) not in (DUPLICATE, REORDERED):
+                    sample = new_sample
+                    self.trail.append(sample)
+                    self.samples.inc()
+
+            # No data: hold the last good orientation and say so in the title
+            if self.telemetry.is_stale() != stale:
+                stale = not stale
+                pygame.display.set_caption("Cube Visualizer" + (" [STALE - no data]" if stale else ""))
+
+            if pacer.update(sample.gx, sample.gy, self.show_trail):
+                self.frame_timer.begin()
+                self.draw_cube(sample)
+                pygame.display.flip()
+                self.frame_timer.end()
+                if self.model:
+                    self.model.adapt(self.frame_timer.frame_time.value)
+            pacer.sleep()
+
+        self.sock.send("stopCubeStream")
+        self.sock.close()
+        print("Telemetry:", self.telemetry.summary())
         pygame.quit()
 
     def stop(self):
@@ -125,5 +167,5 @@ class CubeViewer:
 
 # Optional: for standalone testing
 if __name__ == '__main__':
-    viewer = CubeViewer()
+    viewer = CubeViewer(model=mesh.model_from_args(sys.argv))
     viewer.run()
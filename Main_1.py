@@ -1,13 +1,25 @@
 import sys
-import serial
+import numpy as np
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QHBoxLayout, QLabel, QSlider, QPushButton, 
-                            QDoubleSpinBox, QGroupBox, QMessageBox)
-from PyQt5.QtCore import Qt, QTimer
+                            QDoubleSpinBox, QGroupBox, QMessageBox, QComboBox)
+from PyQt5.QtCore import Qt, QTimer, QPointF, QRectF
+from PyQt5.QtGui import QPainter, QPen, QColor, QPolygonF
 from OpenGL.GL import *
 from OpenGL.GLU import *
 import pygame
 from pygame.locals import *
+from sensor_fusion import FusionEngine, parse_raw_line, parse_raw_batch, RAW_BATCH_PREFIX
+from transport import open_link, Poll, TransportError, ReplayTransport, DEFAULT_SERIAL_URL
+import metrics
+import profiling
+from render_loop import FramePacer, set_mode_vsync, REDRAW_EVENTS
+from telemetry import TelemetryMonitor, DEFAULT_STALE_AFTER, DUPLICATE, REORDERED
+from sample import Sample, parse_angles, parse_batch, to_array, BATCH_PREFIX
+from decimation import DisplayDecimator, Strip
+from trail import Trail
+import mesh
+from filter_response import ResponseCache, PARAM_NAMES
 
 """
 MPU6050 Stabilizer GUI Application
@@ -18,26 +30,135 @@ This application:
 3. Sends updated parameters to ESP32
 4. Visualizes the 3D orientation of the MPU6050 sensor in real-time
 5. Allows saving parameters to ESP32's EEPROM
+6. Optionally fuses raw IMU data on the host (Madgwick / Mahony / Kalman), fed with
+   the board's batched raw stream at its full sample rate
+7. Serves link and render health metrics on http://127.0.0.1:9108/metrics
+8. Tracks telemetry sequence numbers and flags stale data
+9. Records sessions and replays them (replay:session.log?speed=10) with seeking
+10. Sends board commands with ids and only reports success on the firmware's ack
+11. Profiles itself on demand (Profile button or F9, see profiling.py)
+12. Plots the last 10 s of angles as display-rate min/max bars, whatever the sensor rate
+13. Sets the board's sample rate (50-1000 Hz) and receives its batched angle stream.
+    The rate is not saved to EEPROM, the board boots at 50 Hz for the polling clients
+14. Draws an airframe STL/OBJ model (--model) instead of the box, see mesh.py
+15. Previews the frequency and step response of the slider values before they
+    are sent (on slider release), next to the values on the board
+16. Shows the last 10 s of orientation as a fading trail on an attitude sphere
+    (Show Trail button or T), see trail.py
 """
 
-class StabilizerGUI(QMainWindow):
+SAMPLE_RATES = (50, 100, 200, 250, 500, 1000)  # Hz, snapped by the firmware to 1000 / (1 + divider)
+STREAM_FRAME_RATE = 50  # batched frames per second, about one per data tick
+
+def format_seconds(value, limit=2.0):
+    """'85 ms' style text, '> 2 s' for a step that has not got there yet"""
+    return f"> {limit:g} s" if np.isnan(value) else f"{value * 1000:.0f} ms"
+
+class ResponsePlot(QWidget):
+    """Magnitude, phase and step response of the filter chain (see filter_response.py)"""
+
+    PANELS = (
+        ("Magnitude (dB)", -30.0, 6.0),
+        ("Phase (deg)", -120.0, 30.0),
+        ("Step response", 0.0, 1.2),
+    )
+
     def __init__(self):
         super().__init__()
+        self.preview = None  # Response of the slider values (yellow)
+        self.board = None    # Response of the values on the board (grey)
+        self.setMinimumSize(320, 420)
+
+    def set_responses(self, preview, board):
+        self.preview = preview
+        self.board = board
+        self.update()  # Repainted on the next event loop pass
+
+    def series(self, response, panel):
+        if panel == 0:
+            return np.log10(response.freqs), response.mag_db
+        if panel == 1:
+            return np.log10(response.freqs), response.phase
+        return response.t, response.step
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.fillRect(self.rect(), Qt.black)
+        if self.preview is None:
+            return
+        height = self.height() / len(self.PANELS)
+        for panel, (title, lo, hi) in enumerate(self.PANELS):
+            rect = QRectF(10, panel * height + 20, self.width() - 20, height - 30)
+            painter.setPen(QPen(QColor(80, 80, 80)))
+            painter.drawRect(rect)
+            # Reference line: 0 dB, 0 degrees, final value of the step
+            ref = 1.0 if panel == 2 else 0.0
+            y = rect.bottom() - (ref - lo) / (hi - lo) * rect.height()
+            painter.drawLine(QPointF(rect.left(), y), QPointF(rect.right(), y))
+            painter.setPen(QPen(Qt.white))
+            painter.drawText(QPointF(rect.left(), rect.top() - 4), f"{title}  {lo:g} to {hi:g}")
+            span = (f"{self.preview.freqs[0]:g} - {self.preview.freqs[-1]:g} Hz (log)" if panel < 2
+                    else f"0 - {self.preview.t[-1]:.1f} s")
+            painter.drawText(QRectF(rect.left(), rect.top() - 20, rect.width(), 18), Qt.AlignRight, span)
+            for response, color in ((self.board, QColor(150, 150, 150)), (self.preview, QColor(255, 220, 0))):
+                if response is None:
+                    continue
+                x, y = self.series(response, panel)
+                every = max(1, len(x) // max(1, int(rect.width())))  # about one point per pixel
+                x, y = x[::every], y[::every]
+                px = rect.left() + (x - x[0]) / (x[-1] - x[0]) * rect.width()
+                py = rect.bottom() - (np.clip(y, lo, hi) - lo) / (hi - lo) * rect.height()
+                painter.setPen(QPen(color, 1.5))
+                painter.drawPolyline(QPolygonF([QPointF(a, b) for a, b in zip(px.tolist(), py.tolist())]))
+        painter.end()
+
+class StabilizerGUI(QMainWindow):
+    def __init__(self, url=DEFAULT_SERIAL_URL, stale_after=DEFAULT_STALE_AFTER, record=None, model=None):
+        super().__init__()
         
-        # Serial connection setup
-        self.ser = None  # Will hold the serial connection
+        # Connection setup (serial port, TCP, replay file or emulator URL)
+        self.url = url
+        self.record = record  # Optional session file to record received data
+        self.link = None  # Will hold the transport link
+        self.model = model  # Optional mesh.Model drawn instead of the box
         self.init_serial()  # Initialize serial connection
+
+        # Health metrics (see metrics.py)
+        self.samples = metrics.counter('samples_total', 'Orientation samples applied', client='stabilizer')
+        self.parse_errors = metrics.counter('parse_errors_total', 'Lines that failed to parse', client='stabilizer')
+        self.poll = Poll(self.link) if self.link else None  # one data request in flight at a time
+        self.link_opens = self.link.opens if self.link else 0  # a change means the link reconnected
+        self.frame_timer = metrics.FrameTimer(client='stabilizer')
+        # Gap / duplicate detection and stale data policy (see telemetry.py)
+        self.telemetry = TelemetryMonitor(stale_after, name='stabilizer')
+        self.stale_text = None
+        metrics.start_http_server()
         
         # Initialize pygame for 3D visualization
         pygame.init()
-        # Set up OpenGL display with 640x480 resolution
-        self.screen = pygame.display.set_mode((640, 480), OPENGL | DOUBLEBUF)
+        # Set up OpenGL display with 640x480 resolution (vsync when available)
+        self.screen, vsync = set_mode_vsync((640, 480), OPENGL | DOUBLEBUF)
         pygame.display.set_caption("MPU6050 Stabilizer Visualization")
         self.init_gl()  # Initialize OpenGL settings
+        self.font = None  # Overlay font, created on first use
+        # Redraw only on change, slow down the render timer when idle
+        self.pacer = FramePacer(vsync=vsync)
         
         # Current orientation angles (pitch, roll, yaw)
-        self.ax = self.ay = self.az = 0.0
+        self.sample = Sample()  # Last good telemetry sample (see sample.py)
         self.yaw_mode = False  # Toggle for yaw visualization
+        self.fusion = None  # Host fusion engine, None = use firmware angles
+        self.commands = []  # (future, description, on_ack) awaiting the board's ack
+        self.streaming = False  # board streams the frames in use ('b:', or 'rb:' for host fusion), no polling needed
+        self.stream_batch = None  # samples per streamed frame, None until the board reports its rate
+        # Angle history: samples of one tick are batched into the display stage,
+        # which reduces them to 30 min/max bins per second (see decimation.py)
+        self.pending = []
+        self.stage = DisplayDecimator(rate=30.0, window=10.0)
+        self.strip = Strip(self.stage, (10, 40, 620, 90))
+        self.trail = Trail()  # every sample, uploaded to the GPU as it arrives
+        self.show_trail = False
         
         # Default filter parameters
         self.params = {
@@ -47,8 +168,13 @@ class StabilizerGUI(QMainWindow):
             'sample_rate': 50.0      # Sample rate in Hz
         }
         
+        # Response preview of the filter chain, cached per parameter set (see filter_response.py)
+        self.responses = ResponseCache()
+        self.board_params = None  # Last values acked or reported by the board
+
         # Initialize the user interface
         self.init_ui()
+        self.update_preview()
         
         # Setup timers for periodic updates
         self.timer = QTimer(self)  # For data updates
@@ -65,17 +191,46 @@ class StabilizerGUI(QMainWindow):
     def init_serial(self):
         """Initialize serial connection to ESP32"""
         try:
-            # Attempt to open serial port COM8 at 38400 baud
-            self.ser = serial.Serial('COM8', 38400, timeout=1)
-        except serial.SerialException as e:
+            # Open the transport (serial port COM8 at 921600 baud by default)
+            self.link = open_link(self.url, record=self.record, name='stabilizer')
+        except (TransportError, ValueError) as e:
             # Show error message if connection fails
             QMessageBox.critical(self, "Serial Error", f"Failed to open serial port: {str(e)}")
-            self.ser = None
+            self.link = None
     
     def request_current_parameters(self):
         """Request current filter parameters from ESP32"""
-        if self.ser:
-            self.ser.write(b"?\n")  # Send query command
+        self.run_command("?", "Read parameters", on_ack=self.apply_params)
+        # Firmware that knows sample rates also streams batched frames
+        self.run_command("s", "Read sample rate", on_ack=self.sample_rate_applied)
+
+    def run_command(self, command, description, on_ack=None, timeout=1.0):
+        """Send an acknowledged command, the result is handled in check_commands"""
+        if self.link:
+            self.commands.append((self.link.command(command, timeout), description, on_ack))
+
+    def check_commands(self):
+        """Report commands the board has acked or rejected"""
+        pending = []
+        for future, description, on_ack in self.commands:
+            if not future.done():
+                pending.append((future, description, on_ack))
+                continue
+            error = future.exception()
+            if error:
+                self.command_status.setText(f"Board: {description} failed ({error})")
+                self.command_status.setStyleSheet("color: red")
+                if description.startswith("Save to EEPROM"):
+                    QMessageBox.warning(self, "Error", f"Parameters were not saved:\n{error}")
+                continue
+            self.command_status.setText(f"Board: {description} OK")
+            self.command_status.setStyleSheet("color: green")
+            if on_ack:
+                try:
+                    on_ack(future.result())
+                except ValueError:
+                    self.parse_errors.inc()
+        self.commands = pending
     
     def init_ui(self):
         """Initialize the main user interface"""
@@ -88,6 +243,13 @@ class StabilizerGUI(QMainWindow):
         # Control panel setup
         control_panel = QGroupBox("Filter Controls")
         control_layout = QVBoxLayout()
+
+        # Data link status (live / stale)
+        self.data_status = QLabel("Data: waiting")
+        self.data_status.setStyleSheet("color: gray")
+        # Result of the last board command (ack / err)
+        self.command_status = QLabel("Board: -")
+        self.command_status.setStyleSheet("color: gray")
         
         # Accelerometer Filter Control Group
         accel_group = QGroupBox("Accelerometer Filter (0.01-1.0)")
@@ -97,6 +259,9 @@ class StabilizerGUI(QMainWindow):
         self.accel_slider.setRange(1, 100)  # Maps to 0.01-1.0
         self.accel_slider.setValue(int(self.params['accel_filter'] * 100))
         self.accel_slider.valueChanged.connect(self.update_accel_filter)
+        # While dragging only the preview follows, the board gets the value on release
+        self.accel_slider.sliderPressed.connect(lambda: self.sweep_preview('accel_filter'))
+        self.accel_slider.sliderReleased.connect(self.send_params)
         # Spinbox for precise value entry
         self.accel_spinbox = QDoubleSpinBox()
         self.accel_spinbox.setRange(0.01, 1.0)
@@ -114,6 +279,9 @@ class StabilizerGUI(QMainWindow):
         self.gyro_slider.setRange(1, 100)
         self.gyro_slider.setValue(int(self.params['gyro_filter'] * 100))
         self.gyro_slider.valueChanged.connect(self.update_gyro_filter)
+        # While dragging only the preview follows, the board gets the value on release
+        self.gyro_slider.sliderPressed.connect(lambda: self.sweep_preview('gyro_filter'))
+        self.gyro_slider.sliderReleased.connect(self.send_params)
         self.gyro_spinbox = QDoubleSpinBox()
         self.gyro_spinbox.setRange(0.01, 1.0)
         self.gyro_spinbox.setSingleStep(0.01)
@@ -130,6 +298,9 @@ class StabilizerGUI(QMainWindow):
         self.comp_slider.setRange(1, 100)
         self.comp_slider.setValue(int(self.params['comp_filter'] * 100))
         self.comp_slider.valueChanged.connect(self.update_comp_filter)
+        # While dragging only the preview follows, the board gets the value on release
+        self.comp_slider.sliderPressed.connect(lambda: self.sweep_preview('comp_filter'))
+        self.comp_slider.sliderReleased.connect(self.send_params)
         self.comp_spinbox = QDoubleSpinBox()
         self.comp_spinbox.setRange(0.01, 1.0)
         self.comp_spinbox.setSingleStep(0.01)
@@ -139,6 +310,42 @@ class StabilizerGUI(QMainWindow):
         comp_layout.addWidget(self.comp_spinbox)
         comp_group.setLayout(comp_layout)
         
+        # Sample Rate Group (board loop rate and MPU6050 sample divider)
+        rate_group = QGroupBox("Sample Rate")
+        rate_layout = QVBoxLayout()
+        self.rate_combo = QComboBox()
+        for hz in SAMPLE_RATES:
+            self.rate_combo.addItem(f"{hz} Hz", hz)
+        self.rate_combo.setCurrentIndex(SAMPLE_RATES.index(int(self.params['sample_rate'])))
+        self.rate_combo.currentIndexChanged.connect(self.select_sample_rate)
+        rate_layout.addWidget(self.rate_combo)
+        rate_group.setLayout(rate_layout)
+
+        # Sensor Fusion Selection Group
+        fusion_group = QGroupBox("Sensor Fusion")
+        fusion_layout = QVBoxLayout()
+        self.fusion_combo = QComboBox()
+        self.fusion_combo.addItem("Firmware (on ESP32)", None)
+        self.fusion_combo.addItem("Madgwick (host)", 'madgwick')
+        self.fusion_combo.addItem("Mahony (host)", 'mahony')
+        self.fusion_combo.addItem("Kalman (host)", 'kalman')
+        self.fusion_combo.currentIndexChanged.connect(self.select_fusion)
+        fusion_layout.addWidget(self.fusion_combo)
+        fusion_group.setLayout(fusion_layout)
+
+        # Replay position control, only when playing back a recorded session
+        self.replay_slider = None
+        if self.link and isinstance(self.link.transport, ReplayTransport):
+            replay_group = QGroupBox("Replay")
+            replay_layout = QVBoxLayout()
+            self.replay_slider = QSlider(Qt.Horizontal)
+            self.replay_slider.setRange(0, int(self.link.transport.reader.duration))
+            self.replay_slider.sliderReleased.connect(self.seek_replay)
+            self.replay_label = QLabel("0 s")
+            replay_layout.addWidget(self.replay_slider)
+            replay_layout.addWidget(self.replay_label)
+            replay_group.setLayout(replay_layout)
+
         # Action Buttons Group
         action_group = QGroupBox("Actions")
         action_layout = QVBoxLayout()
@@ -155,21 +362,48 @@ class StabilizerGUI(QMainWindow):
         self.flash_btn = QPushButton("Save to ESP32 (Permanent)")
         self.flash_btn.clicked.connect(self.flash_values)
         
+        # Orientation history on an attitude sphere around the board
+        self.trail_btn = QPushButton("Show Trail")
+        self.trail_btn.setCheckable(True)
+        self.trail_btn.toggled.connect(self.set_trail)
+        
+        # Sampling profiler, writes flamegraph/speedscope files
+        self.profile_btn = QPushButton("Profile (10 s)")
+        self.profile_btn.clicked.connect(self.toggle_profiler)
+        
         action_layout.addWidget(self.calibrate_btn)
         action_layout.addWidget(self.yaw_btn)
+        action_layout.addWidget(self.trail_btn)
         action_layout.addWidget(self.flash_btn)
+        action_layout.addWidget(self.profile_btn)
         action_group.setLayout(action_layout)
         
         # Add all control groups to main control layout
+        control_layout.addWidget(self.data_status)
+        control_layout.addWidget(self.command_status)
         control_layout.addWidget(accel_group)
         control_layout.addWidget(gyro_group)
         control_layout.addWidget(comp_group)
+        control_layout.addWidget(rate_group)
+        control_layout.addWidget(fusion_group)
         control_layout.addWidget(action_group)
+        if self.replay_slider:
+            control_layout.addWidget(replay_group)
         control_layout.addStretch()
         control_panel.setLayout(control_layout)
 
+        # Response preview of the slider values (yellow) and the board's (grey)
+        preview_panel = QGroupBox("Response Preview")
+        preview_layout = QVBoxLayout()
+        self.response_plot = ResponsePlot()
+        self.response_text = QLabel("")
+        preview_layout.addWidget(self.response_plot, stretch=1)
+        preview_layout.addWidget(self.response_text)
+        preview_panel.setLayout(preview_layout)
+
         # Add control panel to main window
         main_layout.addWidget(control_panel, stretch=1)
+        main_layout.addWidget(preview_panel, stretch=1)
         
         # Window settings
         self.setWindowTitle("MPU6050 Stabilizer Tuner")
@@ -184,7 +418,7 @@ class StabilizerGUI(QMainWindow):
         self.accel_spinbox.setValue(value)
         if isinstance(value, float):
             self.accel_slider.setValue(int(value * 100))
-        self.send_params()  # Send updated value to ESP32
+        self.params_changed(self.accel_slider)  # Preview, then send to ESP32
         
     def update_gyro_filter(self, value):
         """Update gyroscope filter value from UI control"""
@@ -194,7 +428,7 @@ class StabilizerGUI(QMainWindow):
         self.gyro_spinbox.setValue(value)
         if isinstance(value, float):
             self.gyro_slider.setValue(int(value * 100))
-        self.send_params()
+        self.params_changed(self.gyro_slider)
         
     def update_comp_filter(self, value):
         """Update complementary filter value from UI control"""
@@ -204,103 +438,328 @@ class StabilizerGUI(QMainWindow):
         self.comp_spinbox.setValue(value)
         if isinstance(value, float):
             self.comp_slider.setValue(int(value * 100))
-        self.send_params()
+        self.params_changed(self.comp_slider)
         
-    def send_params(self):
+    def params_changed(self, slider):
+        """Update the preview, and send the values unless the slider is still being dragged"""
+        self.update_preview()
+        if not slider.isSliderDown():
+            self.send_params()
+
+    def filter_params(self):
+        return tuple(self.params[name] for name in PARAM_NAMES)
+
+    def sweep_preview(self, name):
+        """Compute every position of the pressed slider at once, so dragging only looks them up"""
+        self.responses.sweep(name, self.filter_params(), self.params['sample_rate'])
+
+    def update_preview(self):
+        """Show the response of the current slider values against the board's"""
+        rate = self.params['sample_rate']
+        preview = self.responses.get(self.filter_params(), rate)
+        board = self.responses.get(self.board_params, rate) if self.board_params else None
+        self.response_plot.set_responses(preview, board)
+        text = (f"Preview at {rate:.0f} Hz: rise {format_seconds(preview.rise)}, "
+                f"delay {format_seconds(preview.delay)}, overshoot {preview.overshoot:.1f} %, "
+                f"-3 dB at {preview.bandwidth:.2f} Hz\n"
+                f"Noise: accel x{preview.accel_noise:.3f}, gyro {preview.gyro_noise * 1000:.2f} mdeg per deg/s")
+        if board and board is not preview:
+            text += (f"\nBoard: rise {format_seconds(board.rise)}, delay {format_seconds(board.delay)}, "
+                     f"accel noise x{board.accel_noise:.3f}")
+        self.response_text.setText(text)
+
+    def send_params(self, description="Parameters", on_ack=None):
         """Send current parameters to ESP32 in format 'p0.3000,0.0800,0.7000'"""
-        if self.ser:
-            param_str = f"p{self.params['accel_filter']:.4f},{self.params['gyro_filter']:.4f},{self.params['comp_filter']:.4f}\n"
-            self.ser.write(param_str.encode())
+        values = self.filter_params()
+        param_str = "p{:.4f},{:.4f},{:.4f}".format(*values)
+
+        def applied(text):
+            # The board only runs the values once it has acked them
+            self.board_params = values
+            self.update_preview()
+            if on_ack:
+                on_ack(text)
+
+        self.run_command(param_str, description, on_ack=applied)
         
     def send_calibrate(self):
         """Send gyroscope calibration command to ESP32"""
-        if self.ser:
-            self.ser.write(b"c\n")  # Calibration command
+        self.run_command("c", "Calibration", timeout=5.0)  # Acked when the calibration ends, about a second
         
+    def seek_replay(self):
+        """Jump to the slider position in the recorded session"""
+        self.link.transport.seek(float(self.replay_slider.value()))
+
+    def update_replay_position(self):
+        """Follow the replay position unless the user is dragging the slider"""
+        if self.replay_slider.isSliderDown() or not self.link.transport.reader:
+            return
+        position = int(self.link.transport.position)
+        if position != self.replay_slider.value():
+            self.replay_slider.setValue(position)
+            self.replay_label.setText(f"{position} s / {self.replay_slider.maximum()} s")
+
+    def select_sample_rate(self, index):
+        """Send the selected sample rate to the board"""
+        hz = self.rate_combo.itemData(index)
+        self.run_command(f"s{hz}", f"Sample rate {hz} Hz", on_ack=self.sample_rate_applied)
+
+    def sample_rate_applied(self, text):
+        """Show the rate the board runs at and (re)start its batched stream"""
+        rate = float(text)
+        self.params['sample_rate'] = rate
+        self.update_preview()
+        nearest = min(range(len(SAMPLE_RATES)), key=lambda i: abs(SAMPLE_RATES[i] - rate))
+        self.rate_combo.blockSignals(True)
+        self.rate_combo.setCurrentIndex(nearest)
+        self.rate_combo.blockSignals(False)
+        # Several samples per line, so the line rate stays at STREAM_FRAME_RATE
+        self.stream_batch = max(1, round(rate / STREAM_FRAME_RATE))
+        self.start_stream()
+
+    def start_stream(self):
+        """
+        Switch the board to the stream the display needs: raw samples while
+        fusing on the host, angles otherwise. Data is polled until it is acked.
+        """
+        self.streaming = False
+        raw = self.fusion is not None
+        if raw:
+            self.run_command("b0", "Stop telemetry stream")
+            self.run_command(f"R{self.stream_batch}", "Start raw stream",
+                             on_ack=lambda _: self.stream_started(raw))
+        else:
+            self.run_command("R0", "Stop raw stream")
+            self.run_command(f"b{self.stream_batch}", "Start telemetry stream",
+                             on_ack=lambda _: self.stream_started(raw))
+
+    def stream_started(self, raw):
+        # An ack for the other mode's stream (switched again meanwhile) is ignored
+        if raw == (self.fusion is not None):
+            self.streaming = True
+
+    def select_fusion(self, index):
+        """Switch between firmware angles and a host fusion algorithm"""
+        algorithm = self.fusion_combo.itemData(index)
+        was_fusing = self.fusion is not None
+        self.fusion = FusionEngine(algorithm) if algorithm else None
+        if self.stream_batch and was_fusing != (self.fusion is not None):
+            self.start_stream()
+
     def toggle_yaw_mode(self):
         """Toggle yaw visualization mode and reset yaw angle"""
         self.yaw_mode = not self.yaw_mode
-        if self.ser:
-            self.ser.write(b"z\n")  # Zero yaw command
+        self.trail.set_yaw(self.yaw_mode)
+        if self.fusion:
+            self.fusion.zero_yaw()
+        self.run_command("z", "Zero yaw")
+
+    def set_trail(self, shown):
+        """Show or hide the orientation trail (samples are kept either way)"""
+        self.show_trail = shown
+        self.pacer.invalidate()
+
+    def toggle_profiler(self):
+        """Start a 10 s profiling window, or stop the running one early"""
+        if profiling.toggle():
+            self.command_status.setText("Profiling for 10 s...")
+        else:
+            self.command_status.setText("Profile written to the working directory")
     
     def flash_values(self):
         """Save current parameters to ESP32's EEPROM"""
-        if not self.ser:
+        if not self.link:
             QMessageBox.warning(self, "Error", "Not connected to ESP32")
             return
             
-        # First send current parameters
-        self.send_params()
-        
-        # Then send flash command after small delay
-        QTimer.singleShot(100, lambda: self.ser.write(b"f\n") if self.ser else None)
-        
-        QMessageBox.information(self, "Success", 
-                              "Parameters saved to ESP32's EEPROM.\n"
-                              "They will persist after reset.")
+        # Send current parameters, and flash them only once the board took them.
+        # Success is shown on the flash command's ack.
+        self.send_params("Save to EEPROM: parameters", on_ack=lambda _: self.run_command(
+            "f", "Save to EEPROM", on_ack=lambda _: QMessageBox.information(
+                self, "Success", "Parameters saved to ESP32's EEPROM.\n"
+                                 "They will persist after reset (the sample rate does not).")))
         
     def update_data(self):
         """Read and process data from ESP32 via serial"""
-        if not self.ser:
+        if not self.link:
+            return
+
+        # After a reconnect the board may have reset: stop waiting for the
+        # batched stream and ask for the rate again, which restarts it
+        if self.link.opens != self.link_opens:
+            self.link_opens = self.link.opens
+            self.streaming = False
+            self.request_current_parameters()
+
+        # Request new angle data, or raw sensor data for host fusion. While the
+        # batched stream runs, frames arrive without polling.
+        # Replies arrive asynchronously and are handled on the next tick.
+        if not self.streaming:
+            self.poll.send("r" if self.fusion else ".")
+        for line in self.link.read_lines():
+            self.handle_line(line)
+        self.flush_pending()
+        self.update_data_status()
+        self.check_commands()
+        if self.replay_slider:
+            self.update_replay_position()
+
+    def update_data_status(self):
+        """Show whether the displayed orientation is live or stale"""
+        age = self.telemetry.age()
+        if age == float('inf'):
+            text = None
+        elif age > self.telemetry.stale_after:
+            text = f"STALE {age:.0f} s"
+        else:
+            text = ""
+        if text == self.stale_text:
+            return
+        self.stale_text = text
+        if text is None:
+            self.data_status.setText("Data: waiting")
+            self.data_status.setStyleSheet("color: gray")
+        elif text:
+            self.data_status.setText(f"Data: {text}")
+            self.data_status.setStyleSheet("color: red")
+        else:
+            self.data_status.setText("Data: live")
+            self.data_status.setStyleSheet("color: green")
+
+    def sample_received(self, sample):
+        """
+        Check a polled sample's sequence number and close the poll round trip.
+        Returns False for duplicate or late frames, which must not be applied.
+        """
+        self.poll.answered()
+        if self.telemetry.update(sample, polled=True) in (DUPLICATE, REORDERED):
+            return False
+        self.samples.inc()
+        return True
+
+    def batch_received(self, batch):
+        """Apply a batched frame: every sample goes to the display stage, the newest is shown"""
+        if self.telemetry.update_batch(batch) in (DUPLICATE, REORDERED):
             return
+        self.apply_batch(batch)
 
+    def raw_batch_received(self, rows, batch):
+        """Fuse a batched raw frame on the host in one call, then apply its angles"""
+        if self.telemetry.update_batch(batch) in (DUPLICATE, REORDERED):
+            return
+        angles = self.fusion.process(rows)
+        batch['gx'], batch['gy'], batch['gz'] = angles[:, 0], angles[:, 1], angles[:, 2]
+        self.apply_batch(batch)
+
+    def apply_batch(self, batch):
+        self.samples.inc(len(batch))
+        self.flush_pending()  # keep time order with single-sample frames
+        self.stage.push(batch)
+        self.trail.push(batch)
+        self.sample = Sample.from_record(batch[-1])
+
+    def flush_pending(self):
+        """Push the single-sample frames received so far to the display stage"""
+        if self.pending:
+            batch = to_array(self.pending)
+            self.stage.push(batch)
+            self.trail.push(batch)
+            self.pending = []
+
+    def handle_line(self, line):
+        """Process one line received from the ESP32"""
         try:
-            # Request new angle data
-            self.ser.write(b".\n")  # Data request command
-            line = self.ser.readline().decode().strip()
+            if line.startswith("raw:"):
+                # Received raw IMU sample, fuse it on the host
+                if self.fusion:
+                    try:
+                        row, sample = parse_raw_line(line)
+                        if self.sample_received(sample):
+                            sample.gx, sample.gy, sample.gz = self.fusion.process(row)[-1].tolist()
+                            self.sample = sample
+                            self.pending.append(sample)
+                    except ValueError:
+                        self.parse_errors.inc()
+
+            elif line.startswith(RAW_BATCH_PREFIX):
+                # Batched raw frame, fused on the host a whole frame at a time
+                if self.fusion:
+                    try:
+                        self.raw_batch_received(*parse_raw_batch(line))
+                    except ValueError:
+                        self.parse_errors.inc()
 
-            if line.startswith("params:"):
-                # Received parameter update from ESP32
+            elif line.startswith(BATCH_PREFIX):
+                # Batched angle frame from the stream, ignored while fusing on the host
+                if not self.fusion:
+                    try:
+                        self.batch_received(parse_batch(line))
+                    except ValueError:
+                        self.parse_errors.inc()
+
+            elif line.startswith("params:"):
+                # Received parameter update from ESP32 (legacy '?' reply)
                 try:
-                    params = line[7:].split(',')
-                    if len(params) == 3:
-                        accel = float(params[0])
-                        gyro = float(params[1])
-                        comp = float(params[2])
-
-                        # Block signals to prevent recursive updates
-                        self.accel_slider.blockSignals(True)
-                        self.gyro_slider.blockSignals(True)
-                        self.comp_slider.blockSignals(True)
-                        self.accel_spinbox.blockSignals(True)
-                        self.gyro_spinbox.blockSignals(True)
-                        self.comp_spinbox.blockSignals(True)
-
-                        # Update UI controls
-                        self.accel_slider.setValue(int(accel * 100))
-                        self.gyro_slider.setValue(int(gyro * 100))
-                        self.comp_slider.setValue(int(comp * 100))
-                        self.accel_spinbox.setValue(accel)
-                        self.gyro_spinbox.setValue(gyro)
-                        self.comp_spinbox.setValue(comp)
-
-                        # Re-enable signals
-                        self.accel_slider.blockSignals(False)
-                        self.gyro_slider.blockSignals(False)
-                        self.comp_slider.blockSignals(False)
-                        self.accel_spinbox.blockSignals(False)
-                        self.gyro_spinbox.blockSignals(False)
-                        self.comp_spinbox.blockSignals(False)
-
-                        # Update local parameters
-                        self.params['accel_filter'] = accel
-                        self.params['gyro_filter'] = gyro
-                        self.params['comp_filter'] = comp
+                    self.apply_params(line[7:])
                 except ValueError:
-                    pass
+                    self.parse_errors.inc()
 
             elif line and (line[0].isdigit() or line[0] == '-' or line[0] == '0'):
-                # Received angle data (pitch, roll, yaw)
+                # Received angle data (pitch, roll, yaw[, seq, ms])
                 try:
-                    angles = [float(x) for x in line.split(',')]
-                    if len(angles) == 3:
-                        self.ax, self.ay, self.az = angles
+                    sample = parse_angles(line)
+                    if self.sample_received(sample):
+                        self.sample = sample
+                        self.pending.append(sample)
                 except ValueError:
-                    pass
+                    self.parse_errors.inc()
+
+            else:
+                self.parse_errors.inc()
 
         except Exception as e:
             print("Serial read error:", e)
 
+    def apply_params(self, text):
+        """Show parameters reported by the ESP32 ('accel,gyro,comp')"""
+        params = text.split(',')
+        if len(params) != 3:
+            raise ValueError(f"Expected 3 parameters: {text}")
+        accel = float(params[0])
+        gyro = float(params[1])
+        comp = float(params[2])
+
+        # Block signals to prevent recursive updates
+        self.accel_slider.blockSignals(True)
+        self.gyro_slider.blockSignals(True)
+        self.comp_slider.blockSignals(True)
+        self.accel_spinbox.blockSignals(True)
+        self.gyro_spinbox.blockSignals(True)
+        self.comp_spinbox.blockSignals(True)
+
+        # Update UI controls
+        self.accel_slider.setValue(int(accel * 100))
+        self.gyro_slider.setValue(int(gyro * 100))
+        self.comp_slider.setValue(int(comp * 100))
+        self.accel_spinbox.setValue(accel)
+        self.gyro_spinbox.setValue(gyro)
+        self.comp_spinbox.setValue(comp)
+
+        # Re-enable signals
+        self.accel_slider.blockSignals(False)
+        self.gyro_slider.blockSignals(False)
+        self.comp_slider.blockSignals(False)
+        self.accel_spinbox.blockSignals(False)
+        self.gyro_spinbox.blockSignals(False)
+        self.comp_spinbox.blockSignals(False)
+
+        # Update local parameters
+        self.params['accel_filter'] = accel
+        self.params['gyro_filter'] = gyro
+        self.params['comp_filter'] = comp
+        self.board_params = (accel, gyro, comp)
+        self.update_preview()
+
     def init_gl(self):
         """Initialize OpenGL settings for 3D visualization"""
         glViewport(0, 0, 640, 480)
@@ -316,10 +775,11 @@ class StabilizerGUI(QMainWindow):
         glDepthFunc(GL_LEQUAL)  # Depth testing function
         glHint(GL_PERSPECTIVE_CORRECTION_HINT, GL_NICEST)  # Best quality rendering
         
-    def draw_text(self, position, text_string):     
+    def draw_text(self, position, text_string, color=(255,255,255,255)):     
         """Render text in the 3D scene"""
-        font = pygame.font.SysFont("Courier", 18, True)
-        text_surface = font.render(text_string, True, (255,255,255,255), (0,0,0,255))     
+        if self.font is None:
+            self.font = pygame.font.SysFont("Courier", 18, True)  # once, not every frame
+        text_surface = self.font.render(text_string, True, color, (0,0,0,255))     
         text_data = pygame.image.tostring(text_surface, "RGBA", True)     
         glRasterPos3d(*position)     
         glDrawPixels(text_surface.get_width(), text_surface.get_height(), 
@@ -334,16 +794,33 @@ class StabilizerGUI(QMainWindow):
         # Display current parameters as text overlay
         param_text = (f"Accel: {self.params['accel_filter']:.2f} | "
                      f"Gyro: {self.params['gyro_filter']:.2f} | "
-                     f"Comp: {self.params['comp_filter']:.2f}")
+                     f"Comp: {self.params['comp_filter']:.2f} | "
+                     f"{self.params['sample_rate']:.0f} Hz")
         self.draw_text((-2, -2, 2), param_text)
+        if self.stale_text:
+            # Last good orientation is being held, make that obvious
+            self.draw_text((-2, 2, 2), self.stale_text, (255,0,0,255))
         
         # Apply rotations based on current angles
+        glPushMatrix()
         if self.yaw_mode:
-            glRotatef(self.az, 0.0, 1.0, 0.0)  # Yaw rotation
-        glRotatef(self.ay, 1.0, 0.0, 0.0)      # Pitch rotation
-        glRotatef(-self.ax, 0.0, 0.0, 1.0)     # Roll rotation
-        
-        # Draw cube faces
+            glRotatef(self.sample.gz, 0.0, 1.0, 0.0)  # Yaw rotation
+        glRotatef(self.sample.gy, 1.0, 0.0, 0.0)      # Pitch rotation
+        glRotatef(-self.sample.gx, 0.0, 0.0, 1.0)     # Roll rotation
+        
+        # Airframe mesh from --model, or the sensor box
+        if self.model:
+            self.model.draw(self.model.lod_for(mesh.TRIANGLE_BUDGET))
+        else:
+            self.draw_box()
+        glPopMatrix()
+
+        if self.show_trail:
+            self.trail.draw()  # after the body, which hides the part behind it
+        self.draw_history()
+
+    def draw_box(self):
+        """Draw the sensor board as a colored box"""
         glBegin(GL_QUADS)
         # Front face (green)
         glColor3f(0.0, 1.0, 0.0)
@@ -387,29 +864,85 @@ class StabilizerGUI(QMainWindow):
         glVertex3f(1.0, -0.2, 1.0)
         glVertex3f(1.0, -0.2, -1.0)
         glEnd()
+
+    def draw_history(self):
+        """Overlay the angle history strip chart in window coordinates"""
+        if not self.strip.update():
+            return
+        glMatrixMode(GL_PROJECTION)
+        glPushMatrix()
+        glLoadIdentity()
+        glOrtho(0, 640, 0, 480, -1, 1)
+        glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
+        glLoadIdentity()
+        glDisable(GL_DEPTH_TEST)
+        # Vertex count is fixed by the bin count, not the sample rate
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(2, GL_FLOAT, 0, self.strip.vertices)
+        glColorPointer(3, GL_FLOAT, 0, self.strip.colors)
+        glDrawArrays(GL_LINES, 0, self.strip.size)
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glEnable(GL_DEPTH_TEST)
+        glPopMatrix()
+        glMatrixMode(GL_PROJECTION)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
         
     def update_visualization(self):
-        """Update the 3D visualization"""
-        self.draw_cube()
-        pygame.display.flip()  # Update the display
-        
+        """Update the 3D visualization if anything visible changed"""
         # Process pygame events to keep window responsive
         for event in pygame.event.get():
             if event.type == QUIT:
                 self.close()
+                return
+            elif event.type == KEYDOWN and event.key == K_F9:
+                self.toggle_profiler()
+            elif event.type == KEYDOWN and event.key == K_t:
+                self.trail_btn.toggle()
+            elif event.type in REDRAW_EVENTS:
+                self.pacer.invalidate()
+
+        if self.pacer.update(self.sample.gx, self.sample.gy, self.sample.gz, self.yaw_mode,
+                             self.stale_text, tuple(self.params.values()), self.stage.version,
+                             self.show_trail):
+            self.frame_timer.begin()
+            self.draw_cube()
+            pygame.display.flip()  # Update the display
+            self.frame_timer.end()
+            if self.model:
+                self.model.adapt(self.frame_timer.frame_time.value)  # Coarser level if too slow
+
+        # Fast timer while the cube moves, slow when idle
+        interval = int(self.pacer.interval() * 1000)
+        if interval != self.viz_timer.interval():
+            self.viz_timer.setInterval(interval)
                 
     def closeEvent(self, event):
         """Cleanup when window is closed"""
         self.timer.stop()
         self.viz_timer.stop()
-        if self.ser:
-            self.ser.close()
+        if self.link:
+            if self.streaming:
+                # Leave the board quiet for polling clients
+                try:
+                    self.link.command("R0" if self.fusion else "b0", timeout=0.5).result(1.0)
+                except Exception:
+                    pass
+            self.link.close()
+        print("Telemetry:", self.telemetry.summary())
         pygame.quit()
         event.accept()
 
 if __name__ == '__main__':
     # Create and run the application
     app = QApplication(sys.argv)
-    gui = StabilizerGUI()
+    # Usage: python Main_1.py [transport URL] [record to session file] [--model airframe.stl]
+    # e.g. "tcp:esp32.local:12345", "emulator:" or "replay:session.log?speed=10"
+    model = mesh.model_from_args(sys.argv)
+    gui = StabilizerGUI(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SERIAL_URL,
+                        record=sys.argv[2] if len(sys.argv) > 2 else None, model=model)
     gui.show()
     sys.exit(app.exec_())
\ No newline at end of file
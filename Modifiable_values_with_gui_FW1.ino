@@ -9,11 +9,20 @@
 #define GYRO_FILTER_ADDR 4
 #define COMP_FILTER_ADDR 8
 
+// Sample rate limits (Hz) and the largest batched stream frame. The rate is
+// not saved to EEPROM: the board always boots at 50 Hz, the rate the
+// polling clients (one '.' per frame) are made for. Clients that raise it
+// use the batched streams and read it back ('s') after every connect.
+#define MIN_FREQ 50
+#define MAX_FREQ 1000
+#define MAX_BATCH 50
+
 // Default filter parameters
 float ACCEL_FILTER = 0.3;
 float GYRO_FILTER = 0.08;
 float COMP_FILTER = 0.7;
 float FREQ = 50.0;
+unsigned long period_us = 20000;  // loop period, 1 / FREQ
 
 // ESP32 I2C pins
 const int ledPin = 2;
@@ -24,13 +33,45 @@ double gx = 0, gy = 0, gz = 0;
 double gyrX = 0, gyrY = 0, gyrZ = 0;
 double gyrXoffs = 0, gyrYoffs = 0, gyrZoffs = 0;
 int16_t accX = 0, accY = 0, accZ = 0;
+long gyrXraw = 0, gyrYraw = 0, gyrZraw = 0;
 
 // Filtered values
 double filtered_ax = 0, filtered_ay = 0, filtered_az = 0;
 double filtered_gx = 0, filtered_gy = 0, filtered_gz = 0;
 
+// Telemetry frame info: sample counter and time of the last sensor read
+unsigned long sample_seq = 0;
+unsigned long sample_ms = 0;
+
+// Batched angle stream: stream_batch samples per 'b:' line, 0 = off
+int stream_batch = 0;
+int batch_count = 0;
+unsigned long batch_seq = 0, batch_ms = 0;
+char batch_buf[MAX_BATCH * 36 + 1];
+int batch_len = 0;
+
+// Batched raw stream for host-side fusion: raw_batch samples per 'rb:' line, 0 = off
+int raw_batch = 0;
+int raw_count = 0;
+unsigned long raw_seq = 0, raw_ms = 0;
+char raw_buf[MAX_BATCH * 46 + 1];
+int raw_len = 0;
+
+// Gyro calibration, one sample per loop so telemetry and commands keep
+// flowing: calib_total samples (about a second), acked to calib_id when done
+int calib_total = 0;  // 0 = not calibrating
+int calib_count = 0;
+long calib_id = 0;    // tagged command to answer, 0 = untagged 'c' or boot
+long calib_sum[3];
+
+// Non-blocking LED blink (flash confirmation) so telemetry keeps flowing
+int blink_remaining = 0;
+unsigned long blink_next = 0;
+
 void setup() {
-  Serial.begin(38400);
+  // 1000 Hz batched telemetry needs ~20 kB/s, far more than 38400 baud
+  Serial.setTxBufferSize(4096);
+  Serial.begin(921600);
   pinMode(ledPin, OUTPUT);
   
   Wire.begin(21, 22);
@@ -47,26 +88,39 @@ void setup() {
   i2c_write_reg(MPU6050_I2C_ADDRESS, 0x1b, 0x08);
   i2c_write_reg(MPU6050_I2C_ADDRESS, 0x1c, 0x08);
   
-  uint8_t sample_div = (1000 / FREQ) - 1;
-  i2c_write_reg(MPU6050_I2C_ADDRESS, 0x19, sample_div);
+  setSampleRate(FREQ);
   
-  digitalWrite(ledPin, HIGH);
-  calibrate();
-  digitalWrite(ledPin, LOW);
+  startCalibration(0);  // runs during the first second of loop()
 }
 
 void loop() {
-  static unsigned long last_time = millis();
+  static unsigned long last_time = micros();
   
-  // Check for incoming serial commands
-  if (Serial.available()) {
+  // Handle every command received since the last loop. Reading one byte per
+  // loop would fall behind the host's requests ('.' plus newline is already
+  // two bytes) until the receive buffer overflows.
+  while (Serial.available()) {
     char cmd = Serial.read();
     
     if (cmd == '.') {
-      // Send current angles
+      // Send current angles: gx, gy, gz, seq, ms
       Serial.print(gx, 2); Serial.print(", ");
       Serial.print(gy, 2); Serial.print(", ");
-      Serial.println(gz, 2);
+      Serial.print(gz, 2); Serial.print(", ");
+      Serial.print(sample_seq); Serial.print(", ");
+      Serial.println(sample_ms);
+    }
+    else if (cmd == 'r') {
+      // Send raw sensor data for host-side fusion: raw:ms,ax,ay,az,gx,gy,gz,seq
+      Serial.print("raw:");
+      Serial.print(sample_ms); Serial.print(",");
+      Serial.print(accX); Serial.print(",");
+      Serial.print(accY); Serial.print(",");
+      Serial.print(accZ); Serial.print(",");
+      Serial.print(gyrX, 3); Serial.print(",");
+      Serial.print(gyrY, 3); Serial.print(",");
+      Serial.print(gyrZ, 3); Serial.print(",");
+      Serial.println(sample_seq);
     }
     else if (cmd == 'z') {
       // Reset yaw angle
@@ -74,32 +128,26 @@ void loop() {
     }
     else if (cmd == 'c') {
       // Recalibrate
-      digitalWrite(ledPin, HIGH);
-      calibrate();
-      digitalWrite(ledPin, LOW);
+      startCalibration(0);
     }
     else if (cmd == 'p') {
       // Parameter update: p0.30,0.08,0.70
       String params = Serial.readStringUntil('\n');
-      int comma1 = params.indexOf(',');
-      int comma2 = params.indexOf(',', comma1+1);
-      
-      if (comma1 != -1 && comma2 != -1) {
-        ACCEL_FILTER = params.substring(0, comma1).toFloat();
-        GYRO_FILTER = params.substring(comma1+1, comma2).toFloat();
-        COMP_FILTER = params.substring(comma2+1).toFloat();
+      float a, g, c;
+      if (parseParams(params, a, g, c)) {
+        ACCEL_FILTER = a;
+        GYRO_FILTER = g;
+        COMP_FILTER = c;
       }
     }
     else if (cmd == 'f') {
       // Flash parameters to EEPROM
       saveParameters();
-      // Visual confirmation
-      for (int i = 0; i < 3; i++) {
-        digitalWrite(ledPin, HIGH);
-        delay(100);
-        digitalWrite(ledPin, LOW);
-        delay(100);
-      }
+      startBlink(3);  // Visual confirmation
+    }
+    else if (cmd == '#') {
+      // Tagged command, answered with ack:<id>[:data] or err:<id>:<reason>
+      handleTaggedCommand(Serial.readStringUntil('\n'));
     }
     else if (cmd == '?') {
       // Send current parameters
@@ -112,8 +160,14 @@ void loop() {
     }
   }
   
+  updateBlink();
+
   // Read and process sensor data
-  read_sensor_data();
+  bool sensor_ok = read_sensor_data();
+  sample_ms = millis();
+  if (calib_total > 0) {
+    updateCalibration(sensor_ok);
+  }
   
   // Apply filters
   filtered_ax = filtered_ax * (1.0 - ACCEL_FILTER) + accX * ACCEL_FILTER;
@@ -136,12 +190,188 @@ void loop() {
   // Apply complementary filter
   gx = gx * (1.0 - COMP_FILTER) + ax * COMP_FILTER;
   gy = gy * (1.0 - COMP_FILTER) + ay * COMP_FILTER;
+  sample_seq++;
+
+  if (stream_batch > 0) {
+    appendBatchSample();
+  }
+  if (raw_batch > 0) {
+    appendRawBatchSample();
+  }
   
-  // Maintain consistent loop timing
-  while (millis() - last_time < (1000 / FREQ)) {
-    delay(1);
+  // Maintain consistent loop timing: sleep while more than 2 ms are left,
+  // then spin, so 1000 Hz loops stay on time
+  while (micros() - last_time < period_us) {
+    if (period_us - (micros() - last_time) > 2000) delay(1);
+  }
+  last_time += period_us;
+  if (micros() - last_time > period_us) {
+    last_time = micros();  // fell behind (EEPROM write), don't catch up
+  }
+}
+
+// Set the loop rate and the MPU6050 sample divider (register 0x19).
+// With the DLPF on the gyro runs at 1 kHz, so the rate is snapped to
+// 1000 / (1 + divider). False if hz is out of range.
+bool setSampleRate(float hz) {
+  if (isnan(hz) || hz < MIN_FREQ || hz > MAX_FREQ) return false;
+  uint8_t sample_div = (uint8_t)(1000.0 / hz + 0.5) - 1;
+  FREQ = 1000.0 / (sample_div + 1);
+  period_us = (unsigned long)(1000000.0 / FREQ);
+  i2c_write_reg(MPU6050_I2C_ADDRESS, 0x19, sample_div);
+  return true;
+}
+
+// Batched angle stream frame: b:<seq>,<first ms>,<last ms>;<gx>,<gy>,<gz>;...
+// with angles in hundredths of a degree. Sending stream_batch samples per
+// line keeps the per-line cost off the fast loop and the host.
+void appendBatchSample() {
+  if (batch_count == 0) {
+    batch_seq = sample_seq;
+    batch_ms = sample_ms;
+    batch_len = 0;
+  }
+  batch_len += snprintf(batch_buf + batch_len, sizeof(batch_buf) - batch_len, ";%ld,%ld,%ld",
+                        lround(gx * 100), lround(gy * 100), lround(gz * 100));
+  if (++batch_count >= stream_batch) {
+    Serial.print("b:");
+    Serial.print(batch_seq); Serial.print(",");
+    Serial.print(batch_ms); Serial.print(",");
+    Serial.print(sample_ms);
+    Serial.write((const uint8_t *)batch_buf, batch_len);
+    Serial.println();
+    batch_count = 0;
+  }
+}
+
+// Batched raw stream frame: rb:<seq>,<first ms>,<last ms>;<ax>,<ay>,<az>,<gx>,<gy>,<gz>;...
+// with accel in raw counts and gyro rates in thousandths of a deg/s. Every
+// sample the loop takes reaches the host, unlike polling 'r'.
+void appendRawBatchSample() {
+  if (raw_count == 0) {
+    raw_seq = sample_seq;
+    raw_ms = sample_ms;
+    raw_len = 0;
+  }
+  raw_len += snprintf(raw_buf + raw_len, sizeof(raw_buf) - raw_len, ";%d,%d,%d,%ld,%ld,%ld",
+                      accX, accY, accZ, lround(gyrX * 1000), lround(gyrY * 1000), lround(gyrZ * 1000));
+  if (++raw_count >= raw_batch) {
+    Serial.print("rb:");
+    Serial.print(raw_seq); Serial.print(",");
+    Serial.print(raw_ms); Serial.print(",");
+    Serial.print(sample_ms);
+    Serial.write((const uint8_t *)raw_buf, raw_len);
+    Serial.println();
+    raw_count = 0;
+  }
+}
+
+// Parse "a,g,c" filter parameters, false if malformed
+bool parseParams(String params, float &a, float &g, float &c) {
+  int comma1 = params.indexOf(',');
+  int comma2 = params.indexOf(',', comma1+1);
+  if (comma1 == -1 || comma2 == -1) return false;
+  a = params.substring(0, comma1).toFloat();
+  g = params.substring(comma1+1, comma2).toFloat();
+  c = params.substring(comma2+1).toFloat();
+  return true;
+}
+
+// Tagged command "#<id> <command>" from the host. Every command gets exactly
+// one ack or err line with the same id, so the host can pipeline commands
+// and only report success when the board confirmed it.
+void handleTaggedCommand(String frame) {
+  frame.trim();
+  int space = frame.indexOf(' ');
+  long id = frame.substring(0, space).toInt();
+  if (space <= 0 || id <= 0) {
+    Serial.println("err:0:bad frame");
+    return;
+  }
+  String command = frame.substring(space + 1);
+  char c = command.charAt(0);
+
+  if (c == 'p') {
+    float a, g, comp;
+    if (!parseParams(command.substring(1), a, g, comp)) {
+      Serial.print("err:"); Serial.print(id); Serial.println(":bad params");
+      return;
+    }
+    if (a <= 0 || a > 1.0 || g <= 0 || g > 1.0 || comp <= 0 || comp > 1.0) {
+      Serial.print("err:"); Serial.print(id); Serial.println(":out of range");
+      return;
+    }
+    ACCEL_FILTER = a;
+    GYRO_FILTER = g;
+    COMP_FILTER = comp;
+  }
+  else if (c == 'f') {
+    saveParameters();
+    startBlink(3);
+  }
+  else if (c == 'c') {
+    // Acked by finishCalibration() about a second from now
+    startCalibration(id);
+    return;
+  }
+  else if (c == 'z') {
+    gz = 0;
+  }
+  else if (c == 's') {
+    // Sample rate: "s<hz>" sets it, "s" alone reports it; the ack has the applied rate
+    if (command.length() > 1 && !setSampleRate(command.substring(1).toFloat())) {
+      Serial.print("err:"); Serial.print(id); Serial.println(":out of range");
+      return;
+    }
+    Serial.print("ack:"); Serial.print(id); Serial.print(":");
+    Serial.println(FREQ, 1);
+    return;
+  }
+  else if (c == 'b') {
+    // Batched angle stream: "b<n>" samples per frame, "b0" stops it
+    long n = command.substring(1).toInt();
+    if (n < 0 || n > MAX_BATCH) {
+      Serial.print("err:"); Serial.print(id); Serial.println(":out of range");
+      return;
+    }
+    stream_batch = n;
+    batch_count = 0;
+  }
+  else if (c == 'R') {
+    // Batched raw stream: "R<n>" samples per frame, "R0" stops it
+    long n = command.substring(1).toInt();
+    if (n < 0 || n > MAX_BATCH) {
+      Serial.print("err:"); Serial.print(id); Serial.println(":out of range");
+      return;
+    }
+    raw_batch = n;
+    raw_count = 0;
+  }
+  else if (c == '?') {
+    Serial.print("ack:"); Serial.print(id); Serial.print(":");
+    Serial.print(ACCEL_FILTER, 4); Serial.print(",");
+    Serial.print(GYRO_FILTER, 4); Serial.print(",");
+    Serial.println(COMP_FILTER, 4);
+    return;
+  }
+  else {
+    Serial.print("err:"); Serial.print(id); Serial.println(":unknown command");
+    return;
+  }
+  Serial.print("ack:"); Serial.println(id);
+}
+
+void startBlink(int times) {
+  blink_remaining = times * 2;
+  blink_next = millis();
+}
+
+void updateBlink() {
+  if (blink_remaining > 0 && millis() >= blink_next) {
+    digitalWrite(ledPin, blink_remaining % 2 ? LOW : HIGH);
+    blink_remaining--;
+    blink_next = millis() + 100;
   }
-  last_time = millis();
 }
 
 void loadParameters() {
@@ -164,36 +394,65 @@ void saveParameters() {
   EEPROM.commit();
 }
 
-// Calibration function
-void calibrate() {
-  int num = 500;
-  long xSum = 0, ySum = 0, zSum = 0;
-  uint8_t i2cData[6];
-  
-  for (int x = 0; x < num; x++) {
-    if (i2c_read(MPU6050_I2C_ADDRESS, 0x43, i2cData, 6) != 0) return;
-    xSum += ((i2cData[0] << 8) | i2cData[1]);
-    ySum += ((i2cData[2] << 8) | i2cData[3]);
-    zSum += ((i2cData[4] << 8) | i2cData[5]);
-    delay(2);
+// Start a gyro calibration over the next second of loops. A tagged request
+// (id > 0) is answered when it finishes; one still running is superseded.
+void startCalibration(long id) {
+  if (calib_total > 0 && calib_id > 0) {
+    Serial.print("err:"); Serial.print(calib_id); Serial.println(":superseded");
+  }
+  calib_total = max(MIN_FREQ, (int)FREQ);
+  calib_count = 0;
+  calib_id = id;
+  calib_sum[0] = calib_sum[1] = calib_sum[2] = 0;
+  digitalWrite(ledPin, HIGH);
+}
+
+// Add this loop's gyro reading, set the offsets after the last one
+void updateCalibration(bool sensor_ok) {
+  if (!sensor_ok) {
+    finishCalibration("sensor read failed");
+    return;
+  }
+  calib_sum[0] += gyrXraw;
+  calib_sum[1] += gyrYraw;
+  calib_sum[2] += gyrZraw;
+  if (++calib_count < calib_total) return;
+  gyrXoffs = calib_sum[0] / calib_count;
+  gyrYoffs = calib_sum[1] / calib_count;
+  gyrZoffs = calib_sum[2] / calib_count;
+  finishCalibration(NULL);
+}
+
+// End the calibration, acking or rejecting the tagged command that started it
+void finishCalibration(const char *error) {
+  calib_total = 0;
+  digitalWrite(ledPin, LOW);
+  if (calib_id > 0) {
+    if (error) {
+      Serial.print("err:"); Serial.print(calib_id); Serial.print(":"); Serial.println(error);
+    } else {
+      Serial.print("ack:"); Serial.println(calib_id);
+    }
   }
-  gyrXoffs = xSum / num;
-  gyrYoffs = ySum / num;
-  gyrZoffs = zSum / num;
+  calib_id = 0;
 }
 
-// Sensor reading function
-void read_sensor_data() {
+// Sensor reading function, false if the sensor could not be read
+bool read_sensor_data() {
   uint8_t i2cData[14];
-  if (i2c_read(MPU6050_I2C_ADDRESS, 0x3b, i2cData, 14) != 0) return;
+  if (i2c_read(MPU6050_I2C_ADDRESS, 0x3b, i2cData, 14) != 0) return false;
   
   accX = ((i2cData[0] << 8) | i2cData[1]);
   accY = ((i2cData[2] << 8) | i2cData[3]);
   accZ = ((i2cData[4] << 8) | i2cData[5]);
   
-  gyrX = (((i2cData[8] << 8) | i2cData[9]) - gyrXoffs) / gSensitivity;
-  gyrY = (((i2cData[10] << 8) | i2cData[11]) - gyrYoffs) / gSensitivity;
-  gyrZ = (((i2cData[12] << 8) | i2cData[13]) - gyrZoffs) / gSensitivity;
+  gyrXraw = (i2cData[8] << 8) | i2cData[9];
+  gyrYraw = (i2cData[10] << 8) | i2cData[11];
+  gyrZraw = (i2cData[12] << 8) | i2cData[13];
+  gyrX = (gyrXraw - gyrXoffs) / gSensitivity;
+  gyrY = (gyrYraw - gyrYoffs) / gSensitivity;
+  gyrZ = (gyrZraw - gyrZoffs) / gSensitivity;
+  return true;
 }
 
 // I2C helper functions
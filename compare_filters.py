@@ -0,0 +1,393 @@
+import math
+import sys
+import numpy as np
+import pygame
+from pygame.locals import *
+from OpenGL.GL import *
+from OpenGL.GLU import *
+from transport import open_link, Poll, TransportError, DEFAULT_SERIAL_URL
+import metrics
+import profiling
+from render_loop import FramePacer, set_mode_vsync, REDRAW_EVENTS
+from telemetry import TelemetryMonitor, DUPLICATE, REORDERED
+from sensor_fusion import (FilterBank, divergence, linear_recurrence, parse_raw_line, parse_raw_batch,
+                           row_periods, RAW_BATCH_PREFIX)
+import mesh
+
+"""
+Filter parameter A/B comparison
+
+Runs several accel_filter / gyro_filter / comp_filter settings through the
+host replica of the firmware filter chain (sensor_fusion.FilterBank) on the
+same raw IMU stream and draws one board per setting side by side. Under each
+board: its settings, the current roll/pitch difference to the reference set
+and the RMS difference over the last couple of seconds.
+
+The bank is fed every sample the board takes, from its batched raw stream
+('R<n>', 'rb:' frames) at the sample rate it reports. Firmware without the
+stream and replays without 'rb:' frames are polled with 'r' instead, one
+sample per round trip, integrated over the time between them.
+
+Works on live hardware, the emulator or a replayed session:
+    python compare_filters.py [url] [a,g,c a,g,c ...]
+    python compare_filters.py replay:bench.log?speed=1 0.3,0.08,0.7 0.5,0.08,0.9
+    python compare_filters.py emulator: --model quad.stl   (airframe instead of the box)
+
+Keys: 1-9 pick the reference set, z toggles yaw and zeroes it, r resets all
+filters, F9 profiles for 10 s (profiling.py). Until the device reports its parameters set 1 uses the defaults,
+afterwards it mirrors what is flashed on the board.
+"""
+
+WIDTH, HEIGHT = 960, 720
+FREQ = 50.0  # firmware loop rate until the board reports its own
+FRAME_RATE = 50  # raw stream frames per second
+RMS_WINDOW = 2.0  # seconds
+SPACING = 2.8  # distance between boards
+
+DEFAULT_SETS = [
+    (0.30, 0.08, 0.70),  # firmware defaults
+    (0.30, 0.08, 0.90),
+    (0.30, 0.08, 0.50),
+    (0.10, 0.08, 0.70),
+    (0.60, 0.08, 0.70),
+    (0.30, 0.02, 0.70),
+    (0.30, 0.30, 0.70),
+    (0.10, 0.02, 0.95),
+]
+
+# Board geometry as GL_QUADS, same faces and colors as the other visualizers
+CUBE_VERTICES = np.array([
+    (1.0, 0.2, -1.0), (-1.0, 0.2, -1.0), (-1.0, 0.2, 1.0), (1.0, 0.2, 1.0),      # front (green)
+    (1.0, -0.2, 1.0), (-1.0, -0.2, 1.0), (-1.0, -0.2, -1.0), (1.0, -0.2, -1.0),  # back (orange)
+    (1.0, 0.2, 1.0), (-1.0, 0.2, 1.0), (-1.0, -0.2, 1.0), (1.0, -0.2, 1.0),      # top (red)
+    (1.0, -0.2, -1.0), (-1.0, -0.2, -1.0), (-1.0, 0.2, -1.0), (1.0, 0.2, -1.0),  # bottom (yellow)
+    (-1.0, 0.2, 1.0), (-1.0, 0.2, -1.0), (-1.0, -0.2, -1.0), (-1.0, -0.2, 1.0),  # left (blue)
+    (1.0, 0.2, -1.0), (1.0, 0.2, 1.0), (1.0, -0.2, 1.0), (1.0, -0.2, -1.0),      # right (purple)
+], dtype=np.float32)
+CUBE_COLORS = np.repeat(np.array([
+    (0.0, 1.0, 0.0), (1.0, 0.5, 0.0), (1.0, 0.0, 0.0),
+    (1.0, 1.0, 0.0), (0.0, 0.0, 1.0), (1.0, 0.0, 1.0),
+], dtype=np.float32), 4, axis=0)
+
+
+def parse_param_sets(args):
+    """'a,g,c' strings -> list of (accel, gyro, comp) tuples"""
+    sets = []
+    for arg in args:
+        values = tuple(float(v) for v in arg.split(','))
+        if len(values) != 3:
+            raise ValueError(f"Expected accel,gyro,comp: {arg}")
+        sets.append(values)
+    return sets
+
+
+def grid_offsets(count):
+    """Board centres on a grid that is as square as possible"""
+    cols = math.ceil(math.sqrt(count * WIDTH / HEIGHT))
+    rows = math.ceil(count / cols)
+    offsets = np.zeros((count, 3), dtype=np.float32)
+    for k in range(count):
+        row, col = divmod(k, cols)
+        offsets[k, 0] = (col - (cols - 1) / 2.0) * SPACING
+        offsets[k, 1] = ((rows - 1) / 2.0 - row) * SPACING
+    # Camera distance that fits the whole grid in the 45 degree view
+    half_fov = math.tan(math.radians(22.5))
+    distance = max(rows * SPACING / 2.0 / half_fov,
+                   cols * SPACING / 2.0 / (half_fov * WIDTH / HEIGHT)) + 1.5
+    return offsets, distance
+
+
+def rotation_matrices(angles, yaw_mode):
+    """
+    (K, 3, 3) rotations for (K, 3) angles, the same as
+    glRotatef(gz, y) * glRotatef(gy, x) * glRotatef(-gx, z) in the other visualizers
+    """
+    gx, gy, gz = np.radians(angles).T
+    if not yaw_mode:
+        gz = np.zeros_like(gz)
+    k = len(angles)
+    rz = np.zeros((k, 3, 3))
+    rz[:, 0, 0] = rz[:, 1, 1] = np.cos(-gx)
+    rz[:, 0, 1] = -np.sin(-gx)
+    rz[:, 1, 0] = np.sin(-gx)
+    rz[:, 2, 2] = 1.0
+    rx = np.zeros((k, 3, 3))
+    rx[:, 0, 0] = 1.0
+    rx[:, 1, 1] = rx[:, 2, 2] = np.cos(gy)
+    rx[:, 1, 2] = -np.sin(gy)
+    rx[:, 2, 1] = np.sin(gy)
+    ry = np.zeros((k, 3, 3))
+    ry[:, 0, 0] = ry[:, 2, 2] = np.cos(gz)
+    ry[:, 0, 2] = np.sin(gz)
+    ry[:, 2, 0] = -np.sin(gz)
+    ry[:, 1, 1] = 1.0
+    return ry @ rx @ rz
+
+
+class BoardBatch:
+    """
+    All boards in one vertex array: the cube is transformed per board with
+    NumPy and the whole set is drawn with a single glDrawArrays call.
+    With an airframe model each board is one draw of the model's vertex
+    buffer under its own matrix, at a level sized to a share of the
+    triangle budget.
+    """
+
+    def __init__(self, count, model=None):
+        self.offsets, self.distance = grid_offsets(count)
+        self.colors = np.ascontiguousarray(np.tile(CUBE_COLORS, (count, 1)))
+        self.vertices = np.zeros((count * len(CUBE_VERTICES), 3), dtype=np.float32)
+        self.model = model
+        # Column-major model matrices, rotation plus grid offset per board
+        self.matrices = np.tile(np.eye(4, dtype=np.float32), (count, 1, 1))
+        self.matrices[:, 3, :3] = self.offsets
+
+    def update(self, angles, yaw_mode):
+        rot = rotation_matrices(angles, yaw_mode).astype(np.float32)
+        if self.model:
+            self.matrices[:, :3, :3] = rot.transpose(0, 2, 1)
+            return
+        placed = np.einsum('kij,vj->kvi', rot, CUBE_VERTICES) + self.offsets[:, None, :]
+        self.vertices[:] = placed.reshape(-1, 3)
+
+    def draw(self):
+        if self.model:
+            lod = self.model.lod_for(mesh.TRIANGLE_BUDGET // len(self.matrices))
+            for matrix in self.matrices:
+                glPushMatrix()
+                glMultMatrixf(matrix)
+                self.model.draw(lod)
+                glPopMatrix()
+            return
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, self.vertices)
+        glColorPointer(3, GL_FLOAT, 0, self.colors)
+        glDrawArrays(GL_QUADS, 0, len(self.vertices))
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+
+
+def init_gl():
+    """Perspective view and depth test, as in just_cube.py"""
+    glViewport(0, 0, WIDTH, HEIGHT)
+    glMatrixMode(GL_PROJECTION)
+    glLoadIdentity()
+    gluPerspective(45, WIDTH / HEIGHT, 0.1, 200.0)
+    glMatrixMode(GL_MODELVIEW)
+    glLoadIdentity()
+    glShadeModel(GL_SMOOTH)
+    glClearColor(0.0, 0.0, 0.0, 0.0)
+    glClearDepth(1.0)
+    glEnable(GL_DEPTH_TEST)
+    glDepthFunc(GL_LEQUAL)
+    glHint(GL_PERSPECTIVE_CORRECTION_HINT, GL_NICEST)
+
+
+def draw_text(font, position, text_string, color=(255, 255, 255, 255)):
+    """Render text at a 3D position"""
+    text_surface = font.render(text_string, True, color, (0, 0, 0, 255))
+    text_data = pygame.image.tostring(text_surface, "RGBA", True)
+    glRasterPos3d(*position)
+    glDrawPixels(text_surface.get_width(), text_surface.get_height(),
+                 GL_RGBA, GL_UNSIGNED_BYTE, text_data)
+
+
+class Comparison:
+    """Filter bank state plus the divergence statistics shown on screen"""
+
+    def __init__(self, param_sets, freq=FREQ):
+        self.bank = FilterBank(param_sets, freq)
+        self.reference = 0
+        self.yaw_mode = False
+        self.reset()
+
+    def reset(self):
+        k = len(self.bank)
+        self.bank.reset()
+        self.angles = np.zeros((k, 3))
+        self.diff = np.zeros((k, 3))
+        self.mean_square = np.zeros(k)
+
+    def set_rate(self, freq):
+        """Sample rate reported by the board"""
+        self.bank.freq = freq
+
+    def process(self, rows):
+        """Run a batch of raw rows through every parameter set"""
+        rows = np.asarray(rows, dtype=np.float64)
+        # Average row period, for an RMS window in seconds whether streamed or polled
+        period = row_periods(rows[:, 0], self.bank.last_t, self.bank.freq).mean()
+        out = self.bank.update_batch(rows)
+        diff = divergence(out, self.reference)
+        axes = 3 if self.yaw_mode else 2  # yaw drifts freely unless it is shown
+        square = np.mean(diff[..., :axes] ** 2, axis=2)
+        alpha = 1.0 - math.exp(-period / RMS_WINDOW)
+        self.mean_square = linear_recurrence(alpha * square, 1.0 - alpha, self.mean_square)[-1]
+        self.angles = out[-1]
+        self.diff = diff[-1]
+
+    def set_reference(self, k):
+        if 0 <= k < len(self.bank):
+            self.reference = k
+            self.mean_square[:] = 0.0
+
+    def labels(self, k):
+        a, g, c = self.bank.param_sets[k]
+        title = f"{k + 1}: A {a:.2f} G {g:.2f} C {c:.2f}" + (" [ref]" if k == self.reference else "")
+        d = self.diff[k]
+        detail = f"dR {d[0]:+5.1f} dP {d[1]:+5.1f} rms {math.sqrt(self.mean_square[k]):4.1f}"
+        return title, detail
+
+
+class RawFeed:
+    """
+    Asks the board for its sample rate, then starts the batched raw stream
+    with about FRAME_RATE frames per second. Until the first 'rb:' frame
+    arrives (or for good, on firmware without it) samples are polled.
+    Both are done again after a reconnect.
+    """
+
+    def __init__(self, link, comparison):
+        self.link = link
+        self.comparison = comparison
+        self.poll = Poll(link)  # one raw request in flight at a time
+        self.streaming = False
+        self.opens = link.opens
+        self.rate_query = link.command('s')
+
+    def request(self):
+        """Call once per frame"""
+        if self.link.opens != self.opens:
+            self.opens = self.link.opens
+            self.streaming = False
+            self.rate_query = self.link.command('s')
+        if self.rate_query and self.rate_query.done():
+            query, self.rate_query = self.rate_query, None
+            try:
+                rate = float(query.result())
+            except (TransportError, ValueError):
+                rate = None  # no rate command (older firmware, replay): keep polling
+            if rate:
+                self.comparison.set_rate(rate)
+                self.link.command(f"R{max(1, round(rate / FRAME_RATE))}")
+        if not self.streaming:
+            self.poll.send('r')
+
+    def stop(self):
+        """Leave the board quiet for polling clients"""
+        if self.streaming:
+            try:
+                self.link.command("R0", timeout=0.5).result(1.0)
+            except Exception:
+                pass
+
+
+def main():
+    """Open the link, then fuse and draw every parameter set each frame"""
+    model = mesh.model_from_args(sys.argv)
+    url = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SERIAL_URL
+    try:
+        param_sets = parse_param_sets(sys.argv[2:]) or list(DEFAULT_SETS)
+    except ValueError as e:
+        print(f"Parameter error: {e}")
+        return
+    follow_device = len(sys.argv) <= 2  # set 1 mirrors the board's parameters
+
+    try:
+        link = open_link(url, name='compare')
+    except (TransportError, ValueError) as e:
+        print(f"Serial Error: {e}")
+        return
+
+    samples = metrics.counter('samples_total', 'Raw samples fused', client='compare')
+    parse_errors = metrics.counter('parse_errors_total', 'Lines that failed to parse', client='compare')
+    telemetry = TelemetryMonitor(name='compare')
+    comparison = Comparison(param_sets)
+    feed = RawFeed(link, comparison)
+
+    pygame.init()
+    screen, vsync = set_mode_vsync((WIDTH, HEIGHT), DOUBLEBUF | OPENGL)
+    pygame.display.set_caption(f"Filter comparison ({len(param_sets)} sets)")
+    pacer = FramePacer(vsync=vsync)
+    font = pygame.font.SysFont("Courier", 14, True)
+    boards = BoardBatch(len(param_sets), model)
+    init_gl()
+    frame_timer = metrics.FrameTimer(client='compare')
+    metrics.start_http_server()
+    link.send('?')
+
+    while True:
+        for event in pygame.event.get():
+            if event.type == QUIT:
+                pygame.quit()
+                feed.stop()
+                link.close()
+                print("Telemetry:", telemetry.summary())
+                return
+            elif event.type == KEYDOWN:
+                if event.key == K_z:
+                    comparison.yaw_mode = not comparison.yaw_mode
+                    comparison.bank.zero_yaw()
+                elif event.key == K_r:
+                    comparison.reset()
+                elif K_1 <= event.key <= K_9:
+                    comparison.set_reference(event.key - K_1)
+                elif event.key == K_F9:
+                    profiling.toggle()
+                pacer.invalidate()
+            elif event.type in REDRAW_EVENTS:
+                pacer.invalidate()
+
+        # Poll raw samples until the stream runs, replies are read next frame
+        feed.request()
+        rows = []
+        for line in link.read_lines():
+            try:
+                if line.startswith(RAW_BATCH_PREFIX):
+                    feed.streaming = True
+                    batch_rows, batch = parse_raw_batch(line)
+                    if telemetry.update_batch(batch) not in (DUPLICATE, REORDERED):
+                        rows.extend(batch_rows)
+                elif line.startswith('raw:'):
+                    feed.poll.answered()
+                    row, sample = parse_raw_line(line)
+                    if telemetry.update(sample, polled=True) not in (DUPLICATE, REORDERED):
+                        rows.append(row)
+                elif line.startswith('params:') and follow_device:
+                    device = parse_param_sets([line[7:]])[0]
+                    if device != tuple(comparison.bank.param_sets[0]):
+                        param_sets[0] = device
+                        comparison.bank.set_params(param_sets)
+                        comparison.reset()
+                else:
+                    parse_errors.inc()
+            except ValueError:
+                parse_errors.inc()
+        if rows:
+            comparison.process(rows)
+            samples.inc(len(rows))
+
+        if pacer.update(*comparison.angles.ravel().tolist(), comparison.yaw_mode, comparison.reference, telemetry.is_stale()):
+            frame_timer.begin()
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            glLoadIdentity()
+            glTranslatef(0.0, 0.0, -boards.distance)
+            boards.update(comparison.angles, comparison.yaw_mode)
+            boards.draw()
+            for k, (x, y, _) in enumerate(boards.offsets):
+                title, detail = comparison.labels(k)
+                color = (255, 255, 0, 255) if k == comparison.reference else (255, 255, 255, 255)
+                draw_text(font, (x - 1.3, y - 1.05, 1.2), title, color)
+                draw_text(font, (x - 1.3, y - 1.35, 1.2), detail)
+            if telemetry.is_stale():
+                draw_text(font, (-1.0, boards.offsets[0][1] + 1.3, 1.2), "STALE - no data", (255, 0, 0, 255))
+            pygame.display.flip()
+            frame_timer.end()
+            if model:
+                model.adapt(frame_timer.frame_time.value)
+        pacer.sleep()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+import math
+import time
+import numpy as np
+from sample import SAMPLE_DTYPE
+
+"""
+Multi-rate display stage: full-rate sample batches in, display-rate envelopes out
+
+The sensor can run far above the 50 Hz FREQ, but a plot only has a few
+hundred pixels. DisplayDecimator passes every batch on to a full-rate sink
+(SampleBuffer, SessionWriter, anything with extend()) and folds it into
+fixed time bins of 1/rate seconds, keeping the min, max and last value of
+each channel per bin. A spike of a single sample still widens its bin, so
+nothing is hidden, and the UI always draws the same number of bins however
+fast the data comes in.
+
+    stage = DisplayDecimator(rate=30, window=10, sink=writer)
+    stage.push(batch)                    # SAMPLE_DTYPE array, any length
+    t, lo, hi, last = stage.history()    # at most rate * window bins
+"""
+
+DEFAULT_FIELDS = ('gx', 'gy', 'gz')
+
+
+def envelope(t, values, rate):
+    """
+    Min/max/last of values (N, C) per 1/rate s time bin.
+    Returns bin ids (M,) and lo, hi, last (M, C). Times must not decrease.
+    """
+    ids = np.floor(np.asarray(t) * rate).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    ends = np.r_[starts[1:], len(ids)] - 1
+    lo = np.minimum.reduceat(values, starts, axis=0)
+    hi = np.maximum.reduceat(values, starts, axis=0)
+    return ids[starts], lo, hi, values[ends]
+
+
+class DisplayDecimator:
+    def __init__(self, rate=30.0, window=10.0, fields=DEFAULT_FIELDS, sink=None, epsilon=0.05):
+        self.rate = rate
+        self.epsilon = epsilon  # smaller changes do not count as new display data
+        self.fields = fields
+        self.sink = sink
+        self.bins = int(math.ceil(rate * window))
+        channels = len(fields)
+        self.ids = np.zeros(self.bins, dtype=np.int64)
+        self.lo = np.zeros((self.bins, channels), dtype=np.float32)
+        self.hi = np.zeros((self.bins, channels), dtype=np.float32)
+        self.last = np.zeros((self.bins, channels), dtype=np.float32)
+        self.head = 0   # next closed bin slot
+        self.count = 0  # closed bins held
+        self.open = None  # (id, lo, hi, last) of the bin still filling
+        self.samples = 0
+        self.version = 0  # changes whenever the drawn strip would
+        self.shown = None  # lo, hi, last of the newest bin when version last changed
+
+    def push(self, batch):
+        """Add a SAMPLE_DTYPE batch: all of it to the sink, folded into bins for display"""
+        if not len(batch):
+            return
+        if self.sink is not None:
+            self.sink.extend(batch)
+        self.samples += len(batch)
+
+        t = batch['t']
+        if np.isnan(t).any():
+            # Frames without device time are binned by arrival
+            t = np.where(np.isnan(t), time.monotonic(), t)
+        values = np.stack([batch[f] for f in self.fields], axis=1)
+        ids, lo, hi, last = envelope(t, values, self.rate)
+
+        previous = self.open[0] if self.open is not None else None
+        closed = self.count
+        if self.open is not None:
+            if ids[0] == self.open[0]:
+                lo[0] = np.minimum(lo[0], self.open[1])
+                hi[0] = np.maximum(hi[0], self.open[2])
+            elif ids[0] < self.open[0]:
+                self.clear()  # device clock went back (reset), start over
+                previous = None
+            else:
+                self._close(np.array([self.open[0]]), self.open[1][None], self.open[2][None],
+                            self.open[3][None])
+        if len(ids) > 1:
+            self._close(ids[:-1], lo[:-1], hi[:-1], last[:-1])
+        self.open = (ids[-1], lo[-1].copy(), hi[-1].copy(), last[-1].copy())
+        if self._changed(previous, closed, ids, lo, hi, last):
+            self.shown = self.open[1:]
+            self.version += 1
+
+    def _changed(self, previous, closed, ids, lo, hi, last):
+        """
+        True if the bins of a push change what the strip shows: the strip is
+        still filling, bins were skipped, or a bin differs from the one shown
+        last by more than epsilon. Constant input scrolls identical bins, so
+        the version (and with it the render loop) stays idle.
+        """
+        if self.shown is None or previous is None:
+            return True
+        if self.count > closed and closed < self.bins:
+            return True
+        if ids[-1] - previous > len(ids) - (ids[0] == previous):
+            return True  # a gap: bins without samples are drawn empty
+        for new, old in zip((lo, hi, last), self.shown):
+            if (np.abs(new - old) > self.epsilon).any():
+                return True
+        return False
+
+    def _close(self, ids, lo, hi, last):
+        """Store finished bins in the ring, keeping only the newest self.bins"""
+        n = min(len(ids), self.bins)
+        slots = (self.head + np.arange(n)) % self.bins
+        self.ids[slots] = ids[-n:]
+        self.lo[slots] = lo[-n:]
+        self.hi[slots] = hi[-n:]
+        self.last[slots] = last[-n:]
+        self.head = (self.head + n) % self.bins
+        self.count = min(self.count + n, self.bins)
+
+    def history(self):
+        """Bin start times and lo, hi, last per channel, oldest first, including the open bin"""
+        n = self.count
+        order = (self.head - n + np.arange(n)) % self.bins
+        ids, lo, hi, last = self.ids[order], self.lo[order], self.hi[order], self.last[order]
+        if self.open is not None:
+            ids = np.r_[ids, self.open[0]][-self.bins:]
+            lo = np.vstack([lo, self.open[1]])[-self.bins:]
+            hi = np.vstack([hi, self.open[2]])[-self.bins:]
+            last = np.vstack([last, self.open[3]])[-self.bins:]
+        return ids / self.rate, lo, hi, last
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+        self.open = None
+        self.shown = None
+        self.version += 1
+
+
+class Strip:
+    """
+    Vertex array for a strip chart of a DisplayDecimator: one vertical line
+    per bin and channel from lo to hi, so the vertex count is fixed by the
+    bin count, not by the sample rate.
+    """
+
+    def __init__(self, stage, rect, span=90.0, colors=((1.0, 0.3, 0.3), (0.3, 1.0, 0.3), (0.3, 0.5, 1.0))):
+        self.stage = stage
+        self.rect = rect  # x, y, width, height in the target coordinates
+        self.span = span  # values map from -span..span onto the height
+        channels = len(stage.fields)
+        self.vertices = np.zeros((stage.bins * channels * 2, 2), dtype=np.float32)
+        # Vertex order is (bin, channel, lo/hi), colours follow the channel
+        per_bin = np.repeat(np.asarray(colors[:channels], dtype=np.float32), 2, axis=0)
+        self.colors = np.ascontiguousarray(np.tile(per_bin, (stage.bins, 1)))
+        self.size = 0
+
+    def update(self):
+        """Rebuild the vertices from the stage history, returns the vertex count"""
+        t, lo, hi, _ = self.stage.history()
+        if not len(t):
+            self.size = 0
+            return 0
+        # Newest bin at the right edge, one bin per horizontal step; bins
+        # with no samples stay empty and older ones scroll off the left
+        age = np.rint((t[-1] - t) * self.stage.rate)
+        keep = age < self.stage.bins
+        age, lo, hi = age[keep], lo[keep], hi[keep]
+        n = len(age)
+        x0, y0, width, height = self.rect
+        x = x0 + width * (self.stage.bins - 1 - age) / self.stage.bins
+        scale = height / (2.0 * self.span)
+        mid = y0 + height / 2.0
+        channels = lo.shape[1]
+        out = self.vertices[:n * channels * 2].reshape(n, channels, 2, 2)
+        out[:, :, :, 0] = x[:, None, None]
+        out[:, :, 0, 1] = mid + np.clip(lo, -self.span, self.span) * scale
+        out[:, :, 1, 1] = mid + np.clip(hi, -self.span, self.span) * scale
+        # Flat bins still need a visible line
+        out[:, :, 1, 1] += (out[:, :, 1, 1] - out[:, :, 0, 1] < 1.0)
+        self.size = n * channels * 2
+        return self.size
+
+
+if __name__ == '__main__':
+    # Benchmark: 10 s of data at rising sensor rates, pushed in 60 Hz UI ticks.
+    # Recording cost grows with the rate, the display side stays flat.
+    from sample import SampleBuffer
+
+    seconds, tick, rate, window = 10, 1 / 60, 30, 10
+    print(f"{'input Hz':>9} {'push/tick':>10} {'history+strip':>14} {'vertices':>9} {'naive vertices':>15}")
+    for input_rate in (50, 500, 5000, 50000, 200000):
+        n = seconds * input_rate
+        data = np.zeros(n, dtype=SAMPLE_DTYPE)
+        data['t'] = np.arange(n) / input_rate
+        data['seq'] = np.arange(n)
+        rng = np.random.default_rng(1)
+        data['gx'] = 30 * np.sin(2 * np.pi * 0.5 * data['t']) + rng.normal(0, 1, n)
+        data['gy'] = 20 * np.cos(2 * np.pi * 0.3 * data['t'])
+        data['gz'] = np.cumsum(rng.normal(0, 0.01, n))
+        data['gy'][n // 2] = 85.0  # a single-sample spike must survive
+
+        recorder = SampleBuffer(n)
+        stage = DisplayDecimator(rate, window, sink=recorder)
+        strip = Strip(stage, (0, 0, 640, 120))
+        per_tick = max(1, int(input_rate * tick))
+        push_time = draw_time = 0.0
+        ticks = 0
+        for start in range(0, n, per_tick):
+            begin = time.perf_counter()
+            stage.push(data[start:start + per_tick])
+            middle = time.perf_counter()
+            vertices = strip.update()
+            draw_time += time.perf_counter() - middle
+            push_time += middle - begin
+            ticks += 1
+
+        assert len(recorder) == n  # full rate kept for recording
+        _, lo, hi, _ = stage.history()
+        assert hi[:, 1].max() == 85.0, "spike lost"
+        print(f"{input_rate:>9} {push_time / ticks * 1e6:>8.0f}us {draw_time / ticks * 1e6:>12.0f}us "
+              f"{vertices:>9} {min(n, window * input_rate) * 3:>15}")
@@ -0,0 +1,430 @@
+import math
+import os
+import sys
+import threading
+import time
+
+"""
+Stand-in for the ESP32 + MPU6050 board
+
+Speaks both protocols used by the host clients so they can be run without
+hardware:
+    serial  (Modifiable_values_with_gui_FW1.ino)  '.', 'r', '?', 'p..', 'c', 'z', 'f'
+            and tagged '#<id> <command>' answered with ack/err, including
+            's<hz>' (sample rate), 'b<n>' (batched angle stream) and
+            'R<n>' (batched raw stream); 'c' is acked after the one
+            second calibration, like the firmware
+    tcp     (ESP32 WiFi firmware used by FilterGUI) get, setA/setG/setC, save,
+            startPWMStream, startCubeStream, stopCubeStream
+
+The board is simulated as rocking in roll and pitch while slowly turning.
+Bytes go in through write() and responses come out of read(), so the same
+object can sit behind an in-process transport or a pty (run_pty).
+Like the firmware, input waits in a RX_BUFFER byte receive buffer (excess
+bytes are lost) and is only handled once per sample loop: all of it by
+default, or one command byte per loop with drain=False, as the firmware
+did before it drained Serial in a while loop.
+
+    python device_emulator.py --check   # batched stream loss check at 200-1000 Hz
+"""
+
+
+MIN_RATE = 50.0
+MAX_RATE = 1000.0
+MAX_BATCH = 50
+RX_BUFFER = 256  # ESP32 HardwareSerial default receive buffer
+CALIBRATION_TIME = 1.0  # seconds of loop samples the firmware averages
+LINE_COMMANDS = b'#pgs'  # serial '#id ..' and 'p..', TCP get/set/save/start/stop
+
+
+def scaled_clock(speed, clock=time.monotonic):
+    """Clock running `speed` times faster than `clock`, for accelerated (soak) runs"""
+    origin = clock()
+    return lambda: origin + (clock() - origin) * speed
+
+
+class DeviceEmulator:
+    def __init__(self, rate=50.0, clock=time.monotonic, drain=True):
+        self.rate = rate
+        self.drain = drain
+        self.clock = clock
+        self.start_time = clock()
+        self.seq_base = 0  # seq and time of the last sample rate change
+        self.seq_time = 0.0
+        self.params = [0.3, 0.08, 0.7]
+        self.saved_params = list(self.params)
+        self.yaw_offset = 0.0
+        self.streams = set()  # 'cube' and/or 'pwm'
+        self.stream_seq = 0
+        self.next_stream_time = None
+        self.batch = 0  # samples per 'b:' frame, 0 = batched stream off
+        self.batch_next = 0  # seq of the next sample to stream
+        self.raw_batch = 0  # samples per 'rb:' frame, 0 = raw stream off
+        self.raw_next = 0
+        self.calibration = None  # (end time, tagged id or 0) while calibrating
+        self.rx = bytearray()       # receive buffer, handled at loop ticks
+        self.rx_seq = 0             # loop that last handled it
+        self.rx_overflows = 0       # bytes lost to a full receive buffer
+        self.output = bytearray()   # responses not yet read
+        self.lock = threading.Lock()
+
+    # --- simulated sensor -------------------------------------------------
+
+    def angles(self, t):
+        """Orientation (gx, gy, gz) in degrees at device time t"""
+        gx = 30.0 * math.sin(2 * math.pi * 0.3 * t)
+        gy = 20.0 * math.sin(2 * math.pi * 0.17 * t + 1.0)
+        gz = 10.0 * t - self.yaw_offset
+        return gx, gy, gz
+
+    def raw(self, t):
+        """Raw accel counts (+-4g range) and gyro rates in deg/s at time t"""
+        gx, gy, _ = self.angles(t)
+        r, p = math.radians(gx), math.radians(-gy)
+        acc = (-math.sin(p) * 8192, math.sin(r) * math.cos(p) * 8192, math.cos(r) * math.cos(p) * 8192)
+        rates = (30.0 * 2 * math.pi * 0.3 * math.cos(2 * math.pi * 0.3 * t),
+                 -20.0 * 2 * math.pi * 0.17 * math.cos(2 * math.pi * 0.17 * t + 1.0),
+                 10.0)
+        return acc, rates
+
+    def pwm(self, t):
+        """Servo input percentages (3 channels + autopilot switch)"""
+        chans = [int(50 + 45 * math.sin(2 * math.pi * 0.2 * t + i)) for i in range(3)]
+        return chans + [100 if int(t / 10) % 2 else 0]
+
+    def now(self):
+        return self.clock() - self.start_time
+
+    def seq(self, t):
+        """Sample counter of the firmware loop at time t"""
+        return self.seq_base + int((t - self.seq_time) * self.rate)
+
+    def seq_to_time(self, seq):
+        return self.seq_time + (seq - self.seq_base) / self.rate
+
+    def set_rate(self, hz):
+        """Snap to 1000 / (1 + divider) like the firmware, keeping seq continuous"""
+        t = self.now()
+        self.seq_base = self.seq(t)
+        self.seq_time = t
+        divider = int(1000.0 / hz + 0.5) - 1
+        self.rate = 1000.0 / (divider + 1)
+
+    # --- protocol ---------------------------------------------------------
+
+    def handle(self, line):
+        """Handle one command line, returns the response lines"""
+        t = self.now()
+        if not line:
+            return []
+
+        # TCP protocol (word commands)
+        if line == 'get':
+            return ["{:.3f},{:.3f},{:.3f}".format(*self.params)]
+        if line.startswith('set') and len(line) > 4:
+            try:
+                value = float(line[4:])
+            except ValueError:
+                return ["ERR"]
+            index = 'AGC'.find(line[3])
+            if index < 0:
+                return ["ERR"]
+            self.params[index] = value
+            return ["OK"]
+        if line == 'save':
+            self.saved_params = list(self.params)
+            return ["OK"]
+        if line == 'startPWMStream':
+            self._start_stream('pwm')
+            return []
+        if line == 'startCubeStream':
+            self._start_stream('cube')
+            return []
+        if line == 'stopCubeStream':
+            self.streams.discard('cube')
+            return []
+
+        # Serial protocol (single character commands)
+        cmd, args = line[0], line[1:]
+        if cmd == '#':
+            reply = self._tagged(args)
+            return [reply] if reply else []
+        if cmd == '.':
+            return ["{:.2f}, {:.2f}, {:.2f}, {}, {}".format(*self.angles(t), self.seq(t), int(t * 1000))]
+        if cmd == 'r':
+            acc, rates = self.raw(t)
+            return ["raw:{},{},{},{},{:.3f},{:.3f},{:.3f},{}".format(
+                int(t * 1000), *(int(a) for a in acc), *rates, self.seq(t))]
+        if cmd == '?':
+            return ["params:{:.4f},{:.4f},{:.4f}".format(*self.params)]
+        if cmd == 'p':
+            parts = args.split(',')
+            if len(parts) == 3:
+                try:
+                    self.params = [float(p) for p in parts]
+                except ValueError:
+                    pass
+            return []
+        if cmd == 'z':
+            self.yaw_offset = 10.0 * t
+            return []
+        if cmd == 'f':
+            self.saved_params = list(self.params)
+            return []
+        if cmd == 'c':
+            superseded = self._start_calibration(0)
+            return [superseded] if superseded else []
+        return []  # unknown commands are silent, like the firmware
+
+    def _tagged(self, frame):
+        """Tagged command '#<id> <command>', returns its ack or err line (None if answered later)"""
+        id_text, _, command = frame.strip().partition(' ')
+        if not id_text.isdigit() or int(id_text) <= 0 or not command:
+            return "err:0:bad frame"
+        cid = int(id_text)
+        cmd, args = command[0], command[1:]
+        if cmd == 'p':
+            try:
+                params = [float(p) for p in args.split(',')]
+            except ValueError:
+                params = []
+            if len(params) != 3:
+                return f"err:{cid}:bad params"
+            if not all(0.0 < p <= 1.0 for p in params):
+                return f"err:{cid}:out of range"
+            self.params = params
+        elif cmd == '?':
+            return "ack:{}:{:.4f},{:.4f},{:.4f}".format(cid, *self.params)
+        elif cmd == 'z':
+            self.yaw_offset = 10.0 * self.now()
+        elif cmd == 'f':
+            self.saved_params = list(self.params)
+        elif cmd == 's':
+            if args:
+                try:
+                    hz = float(args)
+                except ValueError:
+                    hz = math.nan
+                if not MIN_RATE <= hz <= MAX_RATE:
+                    return f"err:{cid}:out of range"
+                self.set_rate(hz)
+            return f"ack:{cid}:{self.rate:.1f}"
+        elif cmd == 'b':
+            n = int(args) if args.isdigit() else -1
+            if not 0 <= n <= MAX_BATCH:
+                return f"err:{cid}:out of range"
+            self.batch = n
+            self.batch_next = self.seq(self.now()) + 1
+        elif cmd == 'R':
+            n = int(args) if args.isdigit() else -1
+            if not 0 <= n <= MAX_BATCH:
+                return f"err:{cid}:out of range"
+            self.raw_batch = n
+            self.raw_next = self.seq(self.now()) + 1
+        elif cmd == 'c':
+            return self._start_calibration(cid)  # acked when the calibration ends
+        else:
+            return f"err:{cid}:unknown command"
+        return f"ack:{cid}"
+
+    def _start_calibration(self, cid):
+        """Calibrate over the next CALIBRATION_TIME s like the firmware, returns the err of one superseded"""
+        superseded = None
+        if self.calibration and self.calibration[1]:
+            superseded = f"err:{self.calibration[1]}:superseded"
+        self.calibration = (self.now() + CALIBRATION_TIME, cid)
+        return superseded
+
+    def _calibration_lines(self):
+        """The ack of a tagged calibration that has finished"""
+        if self.calibration is None or self.now() < self.calibration[0]:
+            return []
+        _, cid = self.calibration
+        self.calibration = None
+        return [f"ack:{cid}"] if cid else []
+
+    def _start_stream(self, name):
+        self.streams.add(name)
+        if self.next_stream_time is None:
+            self.next_stream_time = self.now()
+
+    def _frames(self, prefix, size, first, body):
+        """
+        Complete batched frames of `size` samples from seq `first` up to now,
+        body(t) formats one sample. Returns (lines, seq of the next sample).
+        """
+        lines = []
+        last = self.seq(self.now())
+        # Never burst more than a second of data after a stall
+        first = max(first, last + 1 - int(self.rate))
+        while last - first + 1 >= size:
+            times = [self.seq_to_time(seq) for seq in range(first, first + size)]
+            text = "".join(body(ts) for ts in times)
+            lines.append(f"{prefix}{first},{int(times[0] * 1000)},{int(times[-1] * 1000)}{text}")
+            first += size
+        return lines, first
+
+    def _angle_text(self, t):
+        return ";{},{},{}".format(*(round(a * 100) for a in self.angles(t)))
+
+    def _raw_text(self, t):
+        acc, rates = self.raw(t)
+        return ";{},{},{},{},{},{}".format(*(int(a) for a in acc), *(round(r * 1000) for r in rates))
+
+    def _stream_lines(self):
+        """Lines produced by the active streams since the last read"""
+        lines = []
+        if self.batch:
+            lines, self.batch_next = self._frames('b:', self.batch, self.batch_next, self._angle_text)
+        if self.raw_batch:
+            raw, self.raw_next = self._frames('rb:', self.raw_batch, self.raw_next, self._raw_text)
+            lines += raw
+        if not self.streams:
+            self.next_stream_time = None
+            return lines
+        t = self.now()
+        period = 1.0 / self.rate
+        # Never burst more than a second of data after a stall
+        self.next_stream_time = max(self.next_stream_time, t - 1.0)
+        while self.next_stream_time <= t:
+            ts = self.next_stream_time
+            if 'cube' in self.streams:
+                lines.append("{:.2f},{:.2f},{},{}".format(*self.angles(ts)[:2], self.stream_seq, int(ts * 1000)))
+                self.stream_seq += 1
+            if 'pwm' in self.streams:
+                lines.append(",".join(str(p) for p in self.pwm(ts)))
+            self.next_stream_time += period
+        return lines
+
+    # --- byte interface ---------------------------------------------------
+
+    def _next_command(self):
+        """Take one firmware Serial.read() worth of input, None if a line is still incomplete"""
+        if self.rx[0] in LINE_COMMANDS:
+            end = self.rx.find(b'\n')
+            if end < 0:
+                return None
+            raw = bytes(self.rx[:end])
+            del self.rx[:end + 1]
+        else:
+            raw = bytes(self.rx[:1])
+            del self.rx[:1]
+        return raw.decode(errors='replace').strip()
+
+    def _service_rx(self):
+        """Handle the input received up to now, at most one command byte per loop unless draining"""
+        loops = self.seq(self.now()) - self.rx_seq
+        if loops <= 0:
+            return
+        self.rx_seq += loops
+        budget = len(self.rx) if self.drain else loops
+        while self.rx and budget > 0:
+            command = self._next_command()
+            if command is None:
+                break
+            budget -= 1
+            for reply in self.handle(command):
+                self.output += reply.encode() + b'\r\n'
+
+    def write(self, data):
+        with self.lock:
+            space = RX_BUFFER - len(self.rx)
+            if len(data) > space:
+                self.rx_overflows += len(data) - space
+            self.rx += data[:max(space, 0)]
+
+    def read(self):
+        with self.lock:
+            self._service_rx()
+            for line in self._calibration_lines() + self._stream_lines():
+                self.output += line.encode() + b'\r\n'
+            data = bytes(self.output)
+            self.output.clear()
+            return data
+
+
+def run_pty(emulator=None, stop_event=None):
+    """
+    Serve an emulator on a pseudo terminal (POSIX only).
+    Returns (slave_path, thread); open slave_path with pyserial like a COM port.
+    """
+    import pty
+    import select
+
+    emulator = emulator or DeviceEmulator()
+    stop_event = stop_event or threading.Event()
+    master, slave = pty.openpty()
+    try:
+        import tty
+        tty.setraw(slave)  # no echo or newline translation
+    except Exception:
+        pass
+    path = os.ttyname(slave)
+
+    def serve():
+        try:
+            while not stop_event.is_set():
+                readable, _, _ = select.select([master], [], [], 1.0 / emulator.rate)
+                if readable:
+                    try:
+                        emulator.write(os.read(master, 1024))
+                    except OSError:
+                        break
+                data = emulator.read()
+                if data:
+                    os.write(master, data)
+        finally:
+            os.close(master)
+            os.close(slave)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    return path, thread
+
+
+def check_rates(rates=(200, 500, 1000), seconds=5.0, url='pty:', frames_per_second=50):
+    """
+    Stream batched frames at each sample rate through a Link, reading them on
+    a 20 ms tick like StabilizerGUI, and report lost samples
+    """
+    from transport import open_link
+    from sample import BATCH_PREFIX, parse_batch
+    from telemetry import TelemetryMonitor
+
+    for rate in rates:
+        link = open_link(url, name=f'check_{rate}')
+        applied = float(link.command(f"s{rate}").result(2.0))
+        batch = max(1, round(applied / frames_per_second))
+        link.command(f"b{batch}").result(2.0)
+        monitor = TelemetryMonitor(name=f'check_{rate}')
+        samples = frames = 0
+        busy = 0.0
+        start = time.monotonic()
+        while time.monotonic() - start < seconds:
+            begin = time.perf_counter()
+            for line in link.read_lines():
+                if line.startswith(BATCH_PREFIX):
+                    data = parse_batch(line)
+                    monitor.update_batch(data)
+                    samples += len(data)
+                    frames += 1
+            busy += time.perf_counter() - begin
+            time.sleep(0.02)
+        link.command("b0").result(2.0)
+        link.close()
+        print(f"{applied:6.0f} Hz x{batch:<3} {samples / seconds:6.0f} samples/s in {frames / seconds:3.0f} "
+              f"lines/s, host {busy / seconds * 100:4.1f}% busy, dropped {link.dropped.value}, "
+              f"{monitor.summary()}")
+
+
+# Optional: run a stand-in device on a pty for the serial clients
+if __name__ == '__main__':
+    if '--check' in sys.argv:
+        check_rates()
+        sys.exit()
+    path, thread = run_pty()
+    print(f"Emulated ESP32 on {path} (Ctrl+C to stop)")
+    try:
+        thread.join()
+    except KeyboardInterrupt:
+        pass
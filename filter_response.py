@@ -0,0 +1,203 @@
+import collections
+import numpy as np
+from sensor_fusion import linear_recurrence
+
+"""
+Frequency and step response of the firmware filter chain
+
+Small-angle linear model of one axis of the loop in
+Modifiable_values_with_gui_FW1.ino at sample rate fs, with a = accel_filter,
+g = gyro_filter, c = comp_filter:
+    accel angle   EMA      A(z) = a / (1 - (1-a) z^-1)
+    gyro rate     EMA      G(z) = g / (1 - (1-g) z^-1), integrated as rate / fs
+    angle         y[k] = (1-c) (y[k-1] + gyro[k] / fs) + c accel[k]
+For a true angle x (gyro = fs (1 - z^-1) x, accel = x) that is
+    H(z) = ((1-c) G(z) (1 - z^-1) + c A(z)) / (1 - (1-c) z^-1)
+The noise figures are the output RMS per unit of white sensor noise:
+accel noise in deg per deg, gyro noise in deg per deg/s.
+
+Everything is computed for K parameter sets at once, so a whole slider
+range costs a few NumPy calls, and ResponseCache keeps one Response per
+(params, rate) so dragging a slider only looks results up.
+
+    cache = ResponseCache()
+    cache.sweep('accel_filter', (0.3, 0.08, 0.7), 50.0)  # every slider position
+    r = cache.get((0.31, 0.08, 0.7), 50.0)
+    r.mag_db, r.phase, r.step, r.rise, r.accel_noise ...
+"""
+
+PARAM_NAMES = ('accel_filter', 'gyro_filter', 'comp_filter')
+SLIDER_VALUES = np.arange(1, 101) / 100.0  # StabilizerGUI sliders, 0.01-1.0
+FREQ_POINTS = 120
+MIN_FREQ = 0.05  # Hz
+STEP_SECONDS = 2.0
+SETTLE_BAND = 0.02
+
+Response = collections.namedtuple('Response', [
+    'params', 'rate',
+    'freqs', 'mag_db', 'phase',  # Hz, dB, degrees
+    't', 'step',                 # s, unit step of the true angle
+    'rise', 'delay', 'overshoot', 'settle', 'bandwidth',  # s, s, %, s, Hz
+    'accel_noise', 'gyro_noise',
+])
+
+
+def frequencies(rate, points=FREQ_POINTS):
+    """Log spaced analysis frequencies up to Nyquist"""
+    return np.geomspace(MIN_FREQ, rate / 2.0, points)
+
+
+def frequency_response(params, rate, freqs):
+    """Complex H for (K, 3) params at freqs, shape (K, F)"""
+    a, g, c = np.asarray(params, dtype=np.float64).reshape(-1, 3).T[:, :, None]
+    zi = np.exp(-2j * np.pi * np.asarray(freqs) / rate)  # z^-1
+    accel = a / (1.0 - (1.0 - a) * zi)
+    gyro = g / (1.0 - (1.0 - g) * zi)
+    return ((1.0 - c) * gyro * (1.0 - zi) + c * accel) / (1.0 - (1.0 - c) * zi)
+
+
+def step_response(params, rate, seconds=STEP_SECONDS):
+    """Output for a unit step of the true angle at t = 0, shape (K, N)"""
+    a, g, c = np.asarray(params, dtype=np.float64).reshape(-1, 3).T
+    k = np.arange(max(2, int(seconds * rate)), dtype=np.float64)[:, None]
+    accel = 1.0 - (1.0 - a) ** (k + 1.0)  # EMA of the step
+    gyro = g * (1.0 - g) ** k             # EMA of the one-sample rate impulse, / fs
+    u = (1.0 - c) * gyro + c * accel
+    return k[:, 0] / rate, linear_recurrence(u, 1.0 - c).T
+
+
+def _cascade_power(gain, p, q):
+    """Sum of h[k]^2 for gain * (p^k conv q^k), two first order poles"""
+    same = np.abs(p - q) < 1e-9
+    d = np.where(same, 1.0, p - q)
+    distinct = (p * p / (1.0 - p * p) - 2.0 * p * q / (1.0 - p * q) + q * q / (1.0 - q * q)) / (d * d)
+    repeated = (1.0 + p * p) / (1.0 - p * p) ** 3
+    return gain * gain * np.where(same, repeated, distinct)
+
+
+def noise_gains(params, rate):
+    """Output RMS per unit white accel noise and per deg/s white gyro noise, each (K,)"""
+    a, g, c = np.asarray(params, dtype=np.float64).reshape(-1, 3).T
+    a, g, c = (np.minimum(x, 1.0 - 1e-9) for x in (a, g, c))  # a pole at 0 is fine, at 1 is not
+    accel = _cascade_power(c * a, 1.0 - a, 1.0 - c)
+    gyro = _cascade_power((1.0 - c) * g / rate, 1.0 - g, 1.0 - c)
+    return np.sqrt(accel), np.sqrt(gyro)
+
+
+def _crossing(t, y, level):
+    """First time each row of y reaches level (linear interpolation), nan if never"""
+    above = y >= level
+    first = np.argmax(above, axis=1)
+    hit = above[np.arange(len(y)), first]
+    prev = np.maximum(first - 1, 0)
+    rows = np.arange(len(y))
+    y0, y1 = y[rows, prev], y[rows, first]
+    frac = np.where(y1 > y0, (level - y0) / np.where(y1 > y0, y1 - y0, 1.0), 0.0)
+    crossing = t[prev] + np.clip(frac, 0.0, 1.0) * (t[first] - t[prev])
+    return np.where(hit, np.where(first == 0, t[0], crossing), np.nan)
+
+
+def responses(params, rate):
+    """Response for each of the (K, 3) parameter sets, computed together"""
+    params = np.asarray(params, dtype=np.float64).reshape(-1, 3)
+    freqs = frequencies(rate)
+    h = frequency_response(params, rate, freqs)
+    mag = np.abs(h)
+    mag_db = 20.0 * np.log10(np.maximum(mag, 1e-12))
+    phase = np.degrees(np.unwrap(np.angle(h), axis=1))
+    t, step = step_response(params, rate)
+
+    rise = _crossing(t, step, 0.9) - _crossing(t, step, 0.1)
+    delay = _crossing(t, step, 0.5)
+    overshoot = np.maximum(step.max(axis=1) - 1.0, 0.0) * 100.0
+    outside = np.abs(step - 1.0) > SETTLE_BAND
+    last_out = len(t) - 1 - np.argmax(outside[:, ::-1], axis=1)
+    settle = np.where(outside.any(axis=1),
+                      np.where(outside[:, -1], np.nan, t[np.minimum(last_out + 1, len(t) - 1)]), 0.0)
+    below = mag < np.sqrt(0.5)
+    bandwidth = np.where(below.any(axis=1), freqs[np.argmax(below, axis=1)], np.nan)
+    accel_noise, gyro_noise = noise_gains(params, rate)
+
+    return [Response(tuple(params[i]), rate, freqs, mag_db[i], phase[i], t, step[i],
+                     rise[i], delay[i], overshoot[i], settle[i], bandwidth[i],
+                     accel_noise[i], gyro_noise[i])
+            for i in range(len(params))]
+
+
+class ResponseCache:
+    """Responses keyed by (params rounded to the GUI's 4 decimals, rate), oldest evicted"""
+
+    def __init__(self, maxsize=2048):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+
+    @staticmethod
+    def key(params, rate):
+        return tuple(round(float(p), 4) for p in params) + (float(rate),)
+
+    def _store(self, key, response):
+        self.entries[key] = response
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def get(self, params, rate):
+        key = self.key(params, rate)
+        response = self.entries.get(key)
+        if response is None:
+            response = responses([key[:3]], rate)[0]
+            self._store(key, response)
+        else:
+            self.entries.move_to_end(key)
+        return response
+
+    def sweep(self, name, params, rate, values=SLIDER_VALUES):
+        """Compute every value of one parameter (the others fixed) in one batch"""
+        index = PARAM_NAMES.index(name)
+        sets = np.tile(np.asarray(params, dtype=np.float64), (len(values), 1))
+        sets[:, index] = values
+        missing = [row for row in sets if self.key(row, rate) not in self.entries]
+        if missing:
+            for row, response in zip(missing, responses(missing, rate)):
+                self._store(self.key(row, rate), response)
+
+
+if __name__ == '__main__':
+    # Check the model against the host replica of the firmware, then time it
+    import time
+    from sensor_fusion import FilterBank
+
+    params, rate = (0.3, 0.08, 0.7), 200.0
+    r = responses([params], rate)[0]
+    bank = FilterBank([params], freq=rate)
+    n = len(r.t)
+    flat = np.zeros((int(10 * rate), 7))
+    flat[:, 0] = np.arange(len(flat)) / rate
+    flat[:, 3] = 8192.0
+    raw = np.zeros((n, 7))
+    raw[:, 0] = flat[-1, 0] + np.arange(1, n + 1) / rate
+    raw[:, 2] = 8192.0 * np.sin(np.radians(1.0))  # tilted 1 degree about x at t = 0
+    raw[:, 3] = 8192.0 * np.cos(np.radians(1.0))
+    raw[0, 4] = 1.0 * rate  # the turn happens within one sample
+    bank.update_batch(flat)  # settle the accel EMA on the level board first
+    simulated = bank.update_batch(raw)[:, 0, 0]
+    error = np.max(np.abs(simulated - r.step))
+    print(f"step vs FilterBank: max error {error:.2e} deg")
+
+    print(f"{params} at {rate:g} Hz: rise {r.rise * 1e3:.0f} ms, delay {r.delay * 1e3:.0f} ms, "
+          f"overshoot {r.overshoot:.1f} %, -3 dB {r.bandwidth:.2f} Hz, "
+          f"accel noise x{r.accel_noise:.3f}, gyro noise {r.gyro_noise:.4f} deg per deg/s")
+
+    for rate in (50.0, 1000.0):
+        cache = ResponseCache()
+        start = time.perf_counter()
+        cache.sweep('accel_filter', params, rate)
+        sweep = time.perf_counter() - start
+        start = time.perf_counter()
+        for value in SLIDER_VALUES:
+            cache.get((value, 0.08, 0.7), rate)
+        lookup = (time.perf_counter() - start) / len(SLIDER_VALUES)
+        start = time.perf_counter()
+        responses([params], rate)
+        single = time.perf_counter() - start
+        print(f"{rate:6g} Hz: sweep of {len(SLIDER_VALUES)} positions {sweep * 1e3:.1f} ms, "
+              f"cached lookup {lookup * 1e6:.1f} us, uncached single {single * 1e3:.2f} ms")
@@ -0,0 +1,285 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sample import SAMPLE_DTYPE, NO_SEQ, parse_angles
+from replay import split_line
+from session_store import SessionWriter, CHUNK_RECORDS, pack_chunk, monotonic
+
+"""
+Parallel bulk ingest of text serial dumps into .tlm session stores
+
+Converts the captures the serial clients read ('gx, gy, gz[, seq, ms]' angle
+lines mixed with 'params:a,g,c' replies, optionally with the replay.py time
+column) into the indexed binary format of session_store.py. Sample times
+follow replay.py: the time column when present, otherwise line number x
+interval, so the result matches session_store.convert() exactly. Samples
+whose time goes back (the board reset during a timestamped capture) are
+dropped like SessionWriter.append does, within a block by the worker and
+across block boundaries by the writer.
+
+The file is cut into blocks at line boundaries. Each block is parsed by a
+worker process: line and field boundaries are found on the raw bytes with
+NumPy and all numbers of the block are converted in one call. Blocks with
+anything unusual (garbage bytes, broken fields) fall back to parse_angles
+line by line, so nothing is parsed differently from the GUIs. Workers also
+compress their chunks, the parent process only appends them to the file.
+'params:' lines become parameter events in the store.
+
+    python ingest.py dump1.log [dump2.log ...] [--workers N]   # writes dump1.tlm ...
+    python ingest.py --bench                                   # scaling benchmark
+"""
+
+BLOCK_SIZE = 8 << 20  # bytes per worker task
+DEFAULT_INTERVAL = 0.02  # line spacing of dumps without a time column (50 Hz)
+
+# Bytes allowed in an angle line ('-1.25, 3.50, 0.42, 118, 2360\r')
+_NUMBER_START = np.zeros(256, dtype=bool)
+_NUMBER_START[list(b'0123456789-+.')] = True
+_LINE_START = _NUMBER_START.copy()
+_LINE_START[ord(' ')] = True  # the readers strip lines before parsing
+_ANGLE_BYTES = np.zeros(256, dtype=bool)
+_ANGLE_BYTES[list(b'0123456789-+.eE, \r\n')] = True
+_SEPARATORS = bytes.maketrans(b',\r\n\t', b'    ')
+
+
+def split_blocks(path, block_size=BLOCK_SIZE):
+    """(start, end, first line number) byte ranges of path, cut after a newline"""
+    size = os.path.getsize(path)
+    blocks = []
+    with open(path, 'rb') as f:
+        start = 0
+        line = 0
+        while start < size:
+            f.seek(min(start + block_size, size))
+            f.readline()  # finish the line the cut landed in
+            end = min(f.tell(), size)
+            f.seek(start)
+            blocks.append((start, end, line))
+            line += f.read(end - start).count(b'\n')
+            start = end
+    return blocks
+
+
+def _line_times(buf, starts, ends, line_numbers, interval):
+    """
+    Time of every line and where its text starts: after a leading
+    '<seconds>\\t' column if it has one, else line number x interval
+    """
+    times = line_numbers * interval
+    text_starts = starts.copy()
+    tabs = np.flatnonzero(buf == 9)
+    if not len(tabs):
+        return times, text_starts
+    owners = np.searchsorted(starts, tabs, 'right') - 1
+    first = np.r_[True, owners[1:] != owners[:-1]]
+    tabs, owners = tabs[first], owners[first]
+    # Stamps are converted with the fallback when any of them is not a number
+    data = buf.tobytes()
+    try:
+        stamps = np.fromstring(b' '.join(data[s:t] for s, t in zip(starts[owners], tabs)),
+                               dtype=np.float64, sep=' ')
+        if len(stamps) != len(owners):
+            raise ValueError
+    except ValueError:
+        stamps = np.array([split_line(data[s:e])[0] for s, e in zip(starts[owners], ends[owners])],
+                          dtype=np.float64)  # None -> nan
+        valid = ~np.isnan(stamps)
+        owners, tabs, stamps = owners[valid], tabs[valid], stamps[valid]
+    times[owners] = stamps
+    text_starts[owners] = tabs + 1
+    return times, text_starts
+
+
+def parse_block(data, first_line=0, interval=DEFAULT_INTERVAL):
+    """
+    Parse the lines of a text dump block.
+    Returns (SAMPLE_DTYPE records, params events [(t, accel, gyro, comp)],
+    number of lines that were neither angles nor params).
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    newlines = np.flatnonzero(buf == 10)
+    starts = np.r_[0, newlines + 1]
+    ends = np.r_[newlines, len(buf)]
+    if len(data) and data[-1:] == b'\n':
+        starts, ends = starts[:-1], ends[:-1]
+    line_numbers = first_line + np.arange(len(starts))
+    times, text_starts = _line_times(buf, starts, ends, line_numbers, interval)
+
+    # Classify every line on its bytes
+    padded = np.r_[buf, np.uint8(10)]
+    first_byte = padded[np.minimum(text_starts, len(buf))]
+    nonempty = ends > text_starts
+    # Per line counts from byte positions (commas and unexpected bytes are sparse)
+    comma_pos = np.flatnonzero(buf == 44)
+    comma_count = np.bincount(np.searchsorted(starts, comma_pos, 'right') - 1, minlength=len(starts))
+    bad_pos = np.flatnonzero(~_ANGLE_BYTES[buf])
+    bad_lines = np.searchsorted(starts, bad_pos, 'right') - 1
+    bad_lines = bad_lines[bad_pos >= text_starts[bad_lines]]  # the time column is not part of the text
+    angle = (nonempty & _LINE_START[first_byte] & ((comma_count == 2) | (comma_count == 4)))
+    angle[bad_lines] = False
+    # Every field must start with a number ('1,,2' and '1, ' are not angle lines)
+    after = padded[comma_pos + 1]
+    after = np.where(after == 32, padded[np.minimum(comma_pos + 2, len(buf))], after)
+    broken = comma_pos[~_NUMBER_START[after]]
+    angle[np.searchsorted(starts, broken, 'right') - 1] = False
+
+    params = []
+    for i in np.flatnonzero(nonempty & ~angle & (first_byte == ord('p'))):
+        text = data[text_starts[i]:ends[i]].decode(errors='replace').strip()
+        if text.startswith('params:'):
+            try:
+                accel, gyro, comp = (float(p) for p in text[7:].split(','))
+            except ValueError:
+                continue
+            params.append((float(times[i]), accel, gyro, comp))
+    skipped = int(np.count_nonzero(nonempty & ~angle)) - len(params)
+
+    rows = np.flatnonzero(angle)
+    fields = comma_count[rows] + 1
+    records = np.zeros(len(rows), dtype=SAMPLE_DTYPE)
+    records['t'] = times[rows]
+    records['seq'] = NO_SEQ
+    if not len(rows):
+        return records, params, skipped
+
+    # One conversion for all numbers of the block
+    lengths = ends[rows] - text_starts[rows] + 1
+    keep = np.repeat(text_starts[rows] - np.r_[0, np.cumsum(lengths)[:-1]], lengths) + np.arange(lengths.sum())
+    text = padded[keep].tobytes().translate(_SEPARATORS)
+    try:
+        values = np.fromstring(text, dtype=np.float64, sep=' ')
+        if len(values) != fields.sum():
+            raise ValueError
+    except ValueError:
+        records = _parse_lines(data, rows, text_starts, ends, records)
+        return records, params, skipped + len(rows) - len(records)
+    offsets = np.r_[0, np.cumsum(fields)[:-1]]
+    records['gx'] = values[offsets]
+    records['gy'] = values[offsets + 1]
+    records['gz'] = values[offsets + 2]
+    long_rows = fields == 5
+    records['seq'][long_rows] = values[offsets[long_rows] + 3]
+    return records, params, skipped
+
+
+def _parse_lines(data, rows, text_starts, ends, records):
+    """Slow path: parse_angles on each candidate line, dropping the ones it rejects"""
+    keep = np.zeros(len(rows), dtype=bool)
+    for n, i in enumerate(rows):
+        try:
+            sample = parse_angles(data[text_starts[i]:ends[i]].decode(errors='replace').strip())
+        except ValueError:
+            continue
+        records[n]['gx'], records[n]['gy'], records[n]['gz'] = sample.angles
+        records[n]['seq'] = sample.seq
+        keep[n] = True
+    return records[keep]
+
+
+def _ingest_block(task):
+    """Worker: read, parse and compress one block"""
+    path, start, end, first_line, interval, chunk_records = task
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    records, params, skipped = parse_block(data, first_line, interval)
+    records = monotonic(records)  # the parent drops what goes back behind earlier blocks
+    chunks = [pack_chunk(records[i:i + chunk_records]) for i in range(0, len(records), chunk_records)]
+    return chunks, params, skipped
+
+
+def ingest(src, dst, workers=None, interval=DEFAULT_INTERVAL, block_size=BLOCK_SIZE,
+           chunk_records=CHUNK_RECORDS):
+    """Convert text dump src into the .tlm store dst, returns (samples, params events, skipped lines)"""
+    tasks = [(src, start, end, line, interval, chunk_records)
+             for start, end, line in split_blocks(src, block_size)]
+    writer = SessionWriter(dst, 'angles', chunk_records)
+    samples = events = skipped = 0
+    try:
+        if workers == 1:
+            results = map(_ingest_block, tasks)
+            pool = None
+        else:
+            pool = ProcessPoolExecutor(workers)
+            results = pool.map(_ingest_block, tasks)
+        # Blocks come back in file order, so the store stays sorted by time
+        for chunks, params, bad in results:
+            for chunk in chunks:
+                samples += writer.write_packed(*chunk)
+            for event in params:
+                writer.add_params(*event)
+            events += len(params)
+            skipped += bad
+    finally:
+        if pool:
+            pool.shutdown()
+        writer.close()
+    return samples, events, skipped
+
+
+def synthetic_dump(path, lines=2_000_000, seed=0):
+    """Legacy style dump: '.' replies with and without seq/ms, params replies and some noise"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(lines) * 0.02
+    gx = 30 * np.sin(t * 1.9)
+    gy = 20 * np.sin(t * 1.1 + 1)
+    gz = (t * 10) % 360 - 180
+    with open(path, 'w', newline='\n') as f:
+        for i in range(lines):
+            if i % 5000 == 0:
+                f.write(f"params:{rng.uniform(0.1, 1):.4f},{rng.uniform(0.01, 0.2):.4f},{rng.uniform(0.5, 1):.4f}\n")
+            elif i % 20000 == 7:
+                f.write("MPU6050 connection lost\n")
+            elif i < lines // 2:
+                f.write(f"{gx[i]:.2f}, {gy[i]:.2f}, {gz[i]:.2f}\r\n")
+            else:
+                f.write(f"{gx[i]:.2f}, {gy[i]:.2f}, {gz[i]:.2f}, {i}, {i * 20}\r\n")
+
+
+if __name__ == '__main__':
+    import tempfile
+    from session_store import SessionStore, convert
+
+    if '--bench' in sys.argv:
+        folder = tempfile.mkdtemp()
+        src = os.path.join(folder, 'dump.log')
+        synthetic_dump(src)
+        size = os.path.getsize(src) / 1e6
+        print(f"Dump: {size:.0f} MB, {os.cpu_count()} cores")
+
+        start = time.perf_counter()
+        convert(src, os.path.join(folder, 'reference.tlm'))
+        base = time.perf_counter() - start
+        print(f"session_store.convert (line by line): {base:.2f} s, {size / base:.1f} MB/s")
+        reference = SessionStore(os.path.join(folder, 'reference.tlm'))
+        expected = reference.range(-1, reference.duration + 1)
+
+        counts = sorted({1, 2, 4, os.cpu_count() or 1})
+        for workers in counts:
+            dst = os.path.join(folder, f'ingest{workers}.tlm')
+            start = time.perf_counter()
+            samples, events, skipped = ingest(src, dst, workers, block_size=4 << 20)
+            elapsed = time.perf_counter() - start
+            store = SessionStore(dst)
+            same = np.array_equal(store.range(-1, store.duration + 1), expected)
+            same_params = np.array_equal(store.params, reference.params)
+            print(f"ingest, {workers} workers: {elapsed:.2f} s, {size / elapsed:.1f} MB/s "
+                  f"({base / elapsed:.1f}x), {samples} samples, {events} params events, "
+                  f"{skipped} skipped, identical to convert: {same and same_params}")
+            store.close()
+        reference.close()
+        sys.exit()
+
+    paths = [a for a in sys.argv[1:] if not a.startswith('--')]
+    workers = None
+    if '--workers' in sys.argv:
+        workers = int(sys.argv[sys.argv.index('--workers') + 1])
+        paths.remove(str(workers))
+    for src in paths:
+        dst = os.path.splitext(src)[0] + '.tlm'
+        start = time.perf_counter()
+        samples, events, skipped = ingest(src, dst, workers)
+        print(f"{src} -> {dst}: {samples} samples, {events} params events, {skipped} other lines, "
+              f"{time.perf_counter() - start:.1f} s")
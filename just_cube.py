@@ -1,25 +1,40 @@
-import serial
 import pygame
 from pygame.locals import *
 from OpenGL.GL import *
 from OpenGL.GLU import *
 import sys
 import time
-
-# Global variables for orientation angles
-ax = ay = az = 0.0  # Angles of rotation around x, y, z axes
+from transport import open_link, Poll, TransportError, DEFAULT_SERIAL_URL
+import metrics
+import profiling
+from render_loop import FramePacer, set_mode_vsync, REDRAW_EVENTS
+from telemetry import TelemetryMonitor, DUPLICATE, REORDERED
+from sample import Sample, parse_angles
+import mesh
+from trail import Trail
+
+# Global orientation sample (angles of rotation around x, y, z axes)
+sample = Sample()
 yaw_mode = False  # Flag to toggle yaw rotation mode
+model = None  # Airframe mesh from --model, the box when None
+trail = Trail()  # Last 10 s of orientation on an attitude sphere, shown with 't'
+show_trail = False
+
+# Health metrics, served on http://127.0.0.1:9108/metrics
+samples_applied = metrics.counter('samples_total', 'Orientation samples applied', client='cube')
+parse_errors = metrics.counter('parse_errors_total', 'Lines that failed to parse', client='cube')
+telemetry = TelemetryMonitor(name='cube')  # gap detection and stale data policy
 
 # Function to initialize serial communication
-def init_serial():
+def init_serial(url=DEFAULT_SERIAL_URL):
     """
     Initializes serial communication with the MPU6050 sensor.
-    Sets the port to COM8 and baud rate to 38400.
-    Returns a serial object if successful, else prints an error message and returns None.
+    Defaults to port COM8 at 921600 baud, any transport URL can be given.
+    Returns a transport link if successful, else prints an error message and returns None.
     """
     try:
-        return serial.Serial('COM8', 38400, timeout=1)
-    except serial.SerialException as e:
+        return open_link(url, name='cube')
+    except (TransportError, ValueError) as e:
         print(f"Serial Error: {e}")
         return None
 
@@ -44,22 +59,36 @@ def init_gl():
     glHint(GL_PERSPECTIVE_CORRECTION_HINT, GL_NICEST)  # Set perspective correction for smooth rendering
 
 # Function to draw a rotating cube based on orientation angles
-def draw_cube(ax, ay, az, yaw_mode):
+def draw_cube(sample, yaw_mode):
     """
     Draws a 3D cube with different colored faces.
-    Rotates the cube based on the input angles (ax, ay, az).
+    Rotates the cube based on the sample angles (gx, gy, gz).
     If yaw_mode is enabled, only yaw rotation (around the z-axis) is applied.
+    With a --model loaded the airframe mesh is drawn instead of the box.
+    With the trail shown, the orientation history is drawn around it.
     """
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)  # Clear the color and depth buffers
     glLoadIdentity()  # Reset the modelview matrix
     glTranslatef(0.0, 0.0, -7.0)  # Move the cube along the z-axis to make it visible
 
+    glPushMatrix()
     if yaw_mode:
-        glRotatef(az, 0.0, 1.0, 0.0)  # Apply yaw rotation (around z-axis)
-    glRotatef(ay, 1.0, 0.0, 0.0)  # Apply pitch rotation (around x-axis)
-    glRotatef(-ax, 0.0, 0.0, 1.0)  # Apply roll rotation (around y-axis)
-
-    # Draw the cube faces with different colors
+        glRotatef(sample.gz, 0.0, 1.0, 0.0)  # Apply yaw rotation (around z-axis)
+    glRotatef(sample.gy, 1.0, 0.0, 0.0)  # Apply pitch rotation (around x-axis)
+    glRotatef(-sample.gx, 0.0, 0.0, 1.0)  # Apply roll rotation (around y-axis)
+
+    if model:
+        model.draw(model.lod_for(mesh.TRIANGLE_BUDGET))  # Vertex buffer, level picked by budget
+    else:
+        draw_box()
+    glPopMatrix()
+
+    if show_trail:
+        trail.draw()  # After the body, so the body hides the part behind it
+
+# Function to draw the sensor board as a box
+def draw_box():
+    """Draws the cube faces with different colors"""
     glBegin(GL_QUADS)
     
     # Front face (green)
@@ -111,50 +140,82 @@ def main():
     Main function that sets up serial communication, initializes OpenGL,
     and runs the main loop for handling events and rendering the cube.
     """
-    global ax, ay, az, yaw_mode
+    global sample, yaw_mode, model, show_trail
+
+    # Optional airframe model: python just_cube.py [URL] --model quad.stl
+    model = mesh.model_from_args(sys.argv)
 
     # Initialize serial communication
-    ser = init_serial()
+    ser = init_serial(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SERIAL_URL)
     if not ser:
         return
 
     # Initialize pygame and OpenGL
     pygame.init()
-    screen = pygame.display.set_mode((640, 480), DOUBLEBUF | OPENGL)
+    screen, vsync = set_mode_vsync((640, 480), DOUBLEBUF | OPENGL)
     pygame.display.set_caption("MPU6050 3D Cube")  # Set window title
-    clock = pygame.time.Clock()
+    pacer = FramePacer(vsync=vsync)  # Redraw only on change, idle when still
+    poll = Poll(ser)  # One angle request in flight, the board answers once per loop
 
     init_gl()  # Initialize OpenGL settings
+    frame_timer = metrics.FrameTimer(client='cube')
+    metrics.start_http_server()
 
     # Main loop
+    stale = False
     while True:
         for event in pygame.event.get():
             # Handle window close event
             if event.type == QUIT:
                 pygame.quit()
                 ser.close()
+                print("Telemetry:", telemetry.summary())
                 sys.exit()
             # Handle key press to toggle yaw mode
             elif event.type == KEYDOWN:
                 if event.key == K_z:
                     yaw_mode = not yaw_mode
-                    ser.write(b'z\n')  # Send command to zero yaw angle
-
-        # Request sensor data for angles (ax, ay, az)
-        try:
-            ser.write(b'.\n')  # Send command to request data
-            line = ser.readline().decode().strip()  # Read the response from serial
-            if line and (line[0].isdigit() or line[0] == '-' or line[0] == '0'):
-                parts = line.split(',')
-                if len(parts) == 3:
-                    ax, ay, az = [float(p) for p in parts]  # Parse and assign angles
-        except Exception as e:
-            print(f"Serial error: {e}")  # Print any serial errors
-
-        # Draw the cube with updated angles
-        draw_cube(ax, ay, az, yaw_mode)
-        pygame.display.flip()  # Update the display
-        clock.tick(60)  # Control the frame rate
+                    trail.set_yaw(yaw_mode)
+                    ser.send('z')  # Send command to zero yaw angle
+                elif event.key == K_t:
+                    show_trail = not show_trail  # Orientation history trail
+                elif event.key == K_F9:
+                    profiling.toggle()  # Sample the render and link threads
+            elif event.type in REDRAW_EVENTS:
+                pacer.invalidate()
+
+        # Request sensor data for angles (gx, gy, gz), replies are read next frame
+        poll.send('.')  # Send command to request data, unless still waiting for the last reply
+        for line in ser.read_lines():  # Responses received so far
+            try:
+                if line and (line[0].isdigit() or line[0] == '-' or line[0] == '0'):
+                    poll.answered()
+                    new_sample = parse_angles(line)
+                    # Skip repeated or late frames, keep the last good value
+                    if telemetry.update(new_sample, polled=True) not in (DUPLICATE, REORDERED):
+                        sample = new_sample  # Parse and assign angles
+                        trail.append(sample)
+                        samples_applied.inc()
+                    continue
+                parse_errors.inc()
+            except ValueError as e:
+                parse_errors.inc()
+                print(f"Serial error: {e}")  # Print any parse errors
+
+        # Flag stale data in the window title
+        if telemetry.is_stale() != stale:
+            stale = not stale
+            pygame.display.set_caption("MPU6050 3D Cube" + (" [STALE - no data]" if stale else ""))
+
+        # Draw the cube only if the angles changed
+        if pacer.update(sample.gx, sample.gy, sample.gz, yaw_mode, show_trail):
+            frame_timer.begin()
+            draw_cube(sample, yaw_mode)
+            pygame.display.flip()  # Update the display
+            frame_timer.end()
+            if model:
+                model.adapt(frame_timer.frame_time.value)  # Coarser level if frames are slow
+        pacer.sleep()  # Control the frame rate
 
 # Entry point of the program
 if __name__ == '__main__':
@@ -0,0 +1,332 @@
+import ctypes
+import os
+import re
+import sys
+import time
+import numpy as np
+from OpenGL.GL import *
+
+"""
+Airframe models for the visualizers
+
+Loads an STL (binary or ASCII) or OBJ model of the airframe so the sensor's
+mounting orientation can be checked against the real aircraft instead of
+the generic box. Models are:
+    parsed with NumPy into flat-shaded triangles (position + face normal),
+    centred and scaled to the box size (2 units across), Z-up CAD axes
+    turned to the visualizers' Y-up,
+    decimated by vertex clustering into levels of detail, each about a
+    quarter of the triangles of the previous one,
+    cached next to the model as <model>.meshcache.npz, holding the
+    interleaved float32 arrays exactly as they are uploaded,
+    uploaded once per level into a static vertex buffer and drawn with one
+    glDrawArrays call.
+Views pick a level by triangle budget (multi-board views use coarser ones)
+and adapt() steps down a level when the GL implementation cannot keep up.
+
+    model = load_model('quad.stl')           # parse or load the cache
+    model.draw(model.lod_for(TRIANGLE_BUDGET))   # GL context needed from here on
+    model.adapt(frame_timer.frame_time.value)
+
+Clients take the model with '--model <path>' on the command line.
+"""
+
+MESH_VERSION = 1
+STRIDE = 6  # floats per vertex: x, y, z, nx, ny, nz
+MIN_LOD_TRIANGLES = 500
+MAX_LODS = 5
+MODEL_COLOR = (0.75, 0.78, 0.85)
+TRIANGLE_BUDGET = 200000  # per frame, shared by all boards in a view
+SLOW_FRAME = 1.0 / 50  # frames slower than this miss 60 Hz
+SLOW_FRAMES = 10       # misses in a row before dropping a level
+
+STL_DTYPE = np.dtype([
+    ('normal', '<f4', (3,)),
+    ('vertices', '<f4', (3, 3)),
+    ('attribute', '<u2'),
+])
+
+
+def model_argument(argv):
+    """Remove '--model <path>' from argv, returns the path or None"""
+    if '--model' not in argv:
+        return None
+    i = argv.index('--model')
+    if i + 1 >= len(argv):
+        raise ValueError("--model needs a file name")
+    path = argv[i + 1]
+    del argv[i:i + 2]
+    return path
+
+
+def model_from_args(argv):
+    """Model named by '--model <path>' in argv (removed from it), None without one or on error"""
+    try:
+        path = model_argument(argv)
+        return load_model(path) if path else None
+    except (OSError, ValueError) as e:
+        print(f"Model error: {e}")
+        return None
+
+
+# --- parsing ---------------------------------------------------------------
+
+def load_stl(path):
+    """(N, 3, 3) float32 triangles of a binary or ASCII STL file"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) >= 84:
+        count = int(np.frombuffer(data, '<u4', 1, 80)[0])
+        if len(data) == 84 + count * STL_DTYPE.itemsize:
+            return np.frombuffer(data, STL_DTYPE, count, 84)['vertices'].copy()
+    coords = re.findall(rb'vertex\s+(\S+)\s+(\S+)\s+(\S+)', data)
+    if not coords or len(coords) % 3:
+        raise ValueError(f"Not an STL file: {path}")
+    return np.array(coords, dtype=np.float32).reshape(-1, 3, 3)
+
+
+def load_obj(path):
+    """(N, 3, 3) float32 triangles of an OBJ file, polygons split into fans"""
+    with open(path) as f:
+        lines = f.read().splitlines()
+    vertices = np.array([line.split()[1:4] for line in lines if line.startswith('v ')], dtype=np.float32)
+    faces = [[int(token.split('/')[0]) for token in line.split()[1:]]
+             for line in lines if line.startswith('f ')]
+    if not len(vertices) or not faces:
+        raise ValueError(f"No geometry in OBJ file: {path}")
+    triangles = []
+    sizes = np.array([len(face) for face in faces])
+    for size in np.unique(sizes):
+        if size < 3:
+            continue
+        polygons = np.array([face for face in faces if len(face) == size])
+        # 1-based, negative indices count back from the last vertex
+        polygons = np.where(polygons < 0, polygons + len(vertices), polygons - 1)
+        fan = np.arange(1, size - 1)
+        triangles.append(np.stack([np.repeat(polygons[:, :1], len(fan), axis=1),
+                                   polygons[:, fan], polygons[:, fan + 1]], axis=2).reshape(-1, 3))
+    return vertices[np.concatenate(triangles)]
+
+
+def weld(triangles):
+    """Indexed form of a triangle soup: (vertices (V, 3), faces (N, 3))"""
+    vertices, faces = np.unique(triangles.reshape(-1, 3), axis=0, return_inverse=True)
+    return vertices, faces.reshape(-1, 3)
+
+
+def interleave(vertices, faces):
+    """Flat-shaded (3 * N, STRIDE) float32 array of positions and face normals"""
+    tri = vertices[faces]
+    normals = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    length = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = normals / np.where(length > 0, length, 1.0)
+    out = np.empty((len(faces), 3, STRIDE), dtype=np.float32)
+    out[:, :, :3] = tri
+    out[:, :, 3:] = normals[:, None, :]
+    return out.reshape(-1, STRIDE)
+
+
+def normalize(vertices, z_up=True):
+    """Centre on the bounding box and scale to 2 units across, Y up"""
+    if z_up:
+        vertices = vertices[:, [0, 2, 1]] * np.array([1.0, 1.0, -1.0], dtype=vertices.dtype)
+    lo, hi = vertices.min(axis=0), vertices.max(axis=0)
+    extent = float((hi - lo).max()) or 1.0
+    return ((vertices - (lo + hi) / 2.0) * (2.0 / extent)).astype(np.float32)
+
+
+def decimate(vertices, faces, target):
+    """
+    Vertex clustering: merge the vertices in each cell of a grid, coarser
+    until at most `target` triangles are left. Returns (vertices, faces).
+    """
+    lo = vertices.min(axis=0)
+    extent = float((vertices.max(axis=0) - lo).max()) or 1.0
+    resolution = max(2, int(4 * np.sqrt(target)))
+    while True:
+        cells = np.minimum(((vertices - lo) / extent * resolution).astype(np.int64), resolution - 1)
+        keys = (cells[:, 0] * resolution + cells[:, 1]) * resolution + cells[:, 2]
+        _, cluster = np.unique(keys, return_inverse=True)
+        counts = np.bincount(cluster)
+        merged = np.stack([np.bincount(cluster, vertices[:, i]) / counts for i in range(3)], axis=1)
+        remapped = cluster[faces]
+        a, b, c = remapped.T
+        remapped = remapped[(a != b) & (b != c) & (a != c)]
+        # The same triangle can come out of several original ones
+        _, first = np.unique(np.sort(remapped, axis=1), axis=0, return_index=True)
+        remapped = remapped[np.sort(first)]
+        if len(remapped) <= target or resolution <= 2:
+            return merged.astype(np.float32), remapped
+        resolution = max(2, int(resolution * 0.7))
+
+
+def build_lods(triangles, z_up=True):
+    """Interleaved arrays, most detailed first, each about 1/4 of the previous"""
+    vertices, faces = weld(triangles)
+    vertices = normalize(vertices, z_up)
+    lods = [interleave(vertices, faces)]
+    target = len(faces) // 4
+    while target >= MIN_LOD_TRIANGLES and len(lods) < MAX_LODS:
+        vertices, faces = decimate(vertices, faces, target)
+        lods.append(interleave(vertices, faces))
+        target = len(faces) // 4
+    return lods
+
+
+# --- cache and GPU buffers ---------------------------------------------------
+
+class Model:
+    """Levels of detail of one model, uploaded to the GPU on first draw"""
+
+    def __init__(self, lods, name='model'):
+        self.lods = lods
+        self.name = name
+        self.buffers = None
+        self.bias = 0  # levels dropped by adapt()
+        self.slow = 0
+
+    def triangles(self, lod=0):
+        return len(self.lods[lod]) // 3
+
+    def lod_for(self, budget):
+        """Most detailed level with at most `budget` triangles, minus the adapt() drops"""
+        for lod, data in enumerate(self.lods):
+            if len(data) // 3 <= budget:
+                break
+        return min(lod + self.bias, len(self.lods) - 1)
+
+    def adapt(self, frame_seconds):
+        """Count frames that missed 60 Hz, use a coarser level after SLOW_FRAMES in a row"""
+        self.slow = self.slow + 1 if frame_seconds > SLOW_FRAME else 0
+        if self.slow >= SLOW_FRAMES and self.bias < len(self.lods) - 1:
+            self.bias += 1
+            self.slow = 0
+            print(f"{self.name}: frames too slow, drawing {self.bias} level(s) coarser")
+
+    def upload(self):
+        """Copy every level into a static vertex buffer (needs a GL context)"""
+        self.buffers = [int(b) for b in np.atleast_1d(glGenBuffers(len(self.lods)))]
+        for buffer, data in zip(self.buffers, self.lods):
+            glBindBuffer(GL_ARRAY_BUFFER, buffer)
+            glBufferData(GL_ARRAY_BUFFER, data.nbytes, data, GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def reset(self):
+        """Forget the vertex buffers, for a window that opens a new GL context"""
+        self.buffers = None
+
+    def draw(self, lod=0, color=MODEL_COLOR):
+        """Draw one level with the current transform, lit from the camera"""
+        if self.buffers is None:
+            self.upload()
+        glPushAttrib(GL_ENABLE_BIT | GL_LIGHTING_BIT)
+        glEnable(GL_LIGHTING)
+        glEnable(GL_LIGHT0)
+        glEnable(GL_COLOR_MATERIAL)
+        glEnable(GL_NORMALIZE)
+        glColor3f(*color)
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffers[lod])
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glVertexPointer(3, GL_FLOAT, STRIDE * 4, ctypes.c_void_p(0))
+        glNormalPointer(GL_FLOAT, STRIDE * 4, ctypes.c_void_p(12))
+        glDrawArrays(GL_TRIANGLES, 0, len(self.lods[lod]))
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glPopAttrib()
+
+
+def _cache_key(path, z_up):
+    stat = os.stat(path)
+    return np.array([stat.st_size, stat.st_mtime_ns, MESH_VERSION, int(z_up)], dtype=np.int64)
+
+
+def load_model(path, z_up=True, cache=True):
+    """Model for an .stl or .obj file, from <path>.meshcache.npz when it is current"""
+    cache_path = path + '.meshcache.npz'
+    key = _cache_key(path, z_up)
+    if cache:
+        try:
+            with np.load(cache_path) as cached:
+                if np.array_equal(cached['key'], key):
+                    lods = [cached[f'lod{i}'] for i in range(len(cached.files) - 1)]
+                    return Model(lods, os.path.basename(path))
+        except (OSError, ValueError, KeyError):
+            pass
+
+    if path.lower().endswith('.obj'):
+        triangles = load_obj(path)
+    else:
+        triangles = load_stl(path)
+    lods = build_lods(triangles, z_up)
+    if cache:
+        try:
+            np.savez(cache_path, key=key, **{f'lod{i}': data for i, data in enumerate(lods)})
+        except OSError:
+            pass  # read-only location, parse again next time
+    return Model(lods, os.path.basename(path))
+
+
+def synthetic_stl(path, segments=224):
+    """Binary STL of a torus with 2 * segments^2 triangles (100k at 224)"""
+    u, v = np.meshgrid(np.linspace(0, 2 * np.pi, segments + 1), np.linspace(0, 2 * np.pi, segments + 1))
+    x = (3 + np.cos(v)) * np.cos(u)
+    y = (3 + np.cos(v)) * np.sin(u)
+    z = np.sin(v) * 0.5
+    grid = np.stack([x, y, z], axis=-1)
+    a, b = grid[:-1, :-1], grid[:-1, 1:]
+    c, d = grid[1:, 1:], grid[1:, :-1]
+    tris = np.concatenate([np.stack([a, b, c], axis=2).reshape(-1, 3, 3),
+                           np.stack([a, c, d], axis=2).reshape(-1, 3, 3)])
+    records = np.zeros(len(tris), dtype=STL_DTYPE)
+    records['vertices'] = tris
+    with open(path, 'wb') as f:
+        f.write(b'synthetic torus'.ljust(80, b'\0'))
+        f.write(np.uint32(len(tris)).tobytes())
+        f.write(records.tobytes())
+
+
+if __name__ == '__main__':
+    # Benchmark: parse, cache reload and (with a display) 60 Hz drawing of a 100k triangle model
+    import tempfile
+
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(tempfile.mkdtemp(), 'torus.stl')
+    if len(sys.argv) <= 1:
+        synthetic_stl(path)
+    start = time.perf_counter()
+    model = load_model(path, cache=False)
+    parsed = time.perf_counter() - start
+    load_model(path)
+    start = time.perf_counter()
+    model = load_model(path)
+    cached = time.perf_counter() - start
+    print(f"{model.name}: parse + LODs {parsed * 1e3:.0f} ms, from cache {cached * 1e3:.1f} ms")
+    print("LOD triangles:", [model.triangles(i) for i in range(len(model.lods))])
+
+    import pygame
+    from pygame.locals import DOUBLEBUF, OPENGL
+    from OpenGL.GLU import gluPerspective
+    try:
+        pygame.init()
+        pygame.display.set_mode((640, 480), DOUBLEBUF | OPENGL)
+    except pygame.error as e:
+        print(f"No OpenGL display ({e}), skipping the draw test")
+        sys.exit()
+    glMatrixMode(GL_PROJECTION)
+    gluPerspective(45, 640 / 480, 0.1, 100.0)
+    glMatrixMode(GL_MODELVIEW)
+    glEnable(GL_DEPTH_TEST)
+    frames = 300
+    start = time.perf_counter()
+    for i in range(frames):
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        glLoadIdentity()
+        glTranslatef(0.0, 0.0, -7.0)
+        glRotatef(i, 1.0, 0.0, 0.0)
+        model.draw(0)
+        pygame.display.flip()
+    glFinish()
+    elapsed = time.perf_counter() - start
+    print(f"{model.triangles(0)} triangles: {frames / elapsed:.0f} frames/s (vsync may cap this)")
+    pygame.quit()
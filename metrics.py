@@ -0,0 +1,219 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+Lightweight link and render health metrics
+
+Counters, gauges and summaries are plain Python objects updated in place,
+so instrumenting the hot path costs one method call per event. The values
+are only formatted when the endpoint is scraped.
+
+Each client serves its metrics in Prometheus text format on localhost:
+    curl http://127.0.0.1:9108/metrics
+
+Metric names used by the clients:
+    link_lines_total              lines received from the device
+    link_bytes_total              bytes received
+    link_dropped_lines_total      lines dropped because the client fell behind
+    link_reconnects_total         transport reconnections
+    samples_total                 orientation samples applied
+    parse_errors_total            lines that failed to parse
+    command_rtt_seconds           request -> reply round trip time
+    render_frames_total           frames drawn
+    render_fps                    frames per second (smoothed)
+    render_frame_seconds          time spent drawing the last frame
+"""
+
+DEFAULT_PORT = 9108
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in sorted(labels.items())) + '}'
+
+
+class Counter:
+    __slots__ = ('name', 'labels', 'value')
+    kind = 'counter'
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Gauge:
+    __slots__ = ('name', 'labels', 'value')
+    kind = 'gauge'
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Summary:
+    """Sum and count of observations, the last value is kept for local display"""
+
+    __slots__ = ('name', 'labels', 'sum', 'count', 'last')
+    kind = 'summary'
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.sum = 0.0
+        self.count = 0
+        self.last = 0.0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        self.last = value
+
+    def samples(self):
+        yield self.name + '_sum', self.labels, self.sum
+        yield self.name + '_count', self.labels, self.count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}  # (name, labels) -> metric
+        self.help = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = cls(name, labels)
+                    self.metrics[key] = metric
+                    self.help.setdefault(name, (cls.kind, help_text))
+        return metric
+
+    def counter(self, name, help_text='', **labels):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text='', **labels):
+        return self._get(Gauge, name, help_text, labels)
+
+    def summary(self, name, help_text='', **labels):
+        return self._get(Summary, name, help_text, labels)
+
+    def render(self):
+        """Prometheus text exposition format"""
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda m: m.name)
+        out = []
+        last_name = None
+        for metric in metrics:
+            if metric.name != last_name:
+                kind, help_text = self.help[metric.name]
+                if help_text:
+                    out.append(f"# HELP {metric.name} {help_text}")
+                out.append(f"# TYPE {metric.name} {kind}")
+                last_name = metric.name
+            for name, labels, value in metric.samples():
+                out.append(f"{name}{_format_labels(labels)} {value}")
+        return '\n'.join(out) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help_text='', **labels):
+    return REGISTRY.counter(name, help_text, **labels)
+
+
+def gauge(name, help_text='', **labels):
+    return REGISTRY.gauge(name, help_text, **labels)
+
+
+def summary(name, help_text='', **labels):
+    return REGISTRY.summary(name, help_text, **labels)
+
+
+class FrameTimer:
+    """Render loop instrumentation: call begin() before drawing and end() after"""
+
+    def __init__(self, **labels):
+        self.frames = counter('render_frames_total', 'Frames drawn', **labels)
+        self.fps = gauge('render_fps', 'Frames per second (smoothed)', **labels)
+        self.frame_time = gauge('render_frame_seconds', 'Time spent drawing the last frame', **labels)
+        self.start = 0.0
+        self.last_end = None
+
+    def begin(self):
+        self.start = time.perf_counter()
+
+    def end(self):
+        now = time.perf_counter()
+        self.frame_time.set(now - self.start)
+        self.frames.inc()
+        if self.last_end is not None and now > self.last_end:
+            # Exponential moving average of the instantaneous rate
+            rate = 1.0 / (now - self.last_end)
+            self.fps.set(0.9 * self.fps.value + 0.1 * rate if self.fps.value else rate)
+        self.last_end = now
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # keep the console quiet
+
+
+_servers = {}
+
+
+def start_http_server(port=DEFAULT_PORT, host='127.0.0.1', registry=REGISTRY):
+    """
+    Serve the registry on http://host:port/metrics from a daemon thread.
+    Safe to call more than once; returns None if the port is taken.
+    """
+    if port in _servers:
+        return _servers[port]
+    handler = type('MetricsHandler', (_Handler,), {'registry': registry})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        print(f"Metrics endpoint not started on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _servers[port] = server
+    return server
@@ -1,5 +1,6 @@
 # cube_visualizer.py
-import serial
+import os
+import sys
 import pygame
 from pygame.locals import *
 from OpenGL.GL import *
@@ -7,19 +8,38 @@ from OpenGL.GLU import *
 import threading
 import time
 
+# Shared host modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from transport import open_link, Poll, TransportError
+import metrics
+import profiling
+from render_loop import FramePacer, set_mode_vsync, REDRAW_EVENTS
+from telemetry import TelemetryMonitor, DUPLICATE, REORDERED
+from sample import Sample, parse_angles
+import mesh
+from trail import Trail
+
 class CubeVisualizer(threading.Thread):
-    def __init__(self, port='COM8', baudrate=38400):
+    def __init__(self, port='COM8', baudrate=921600, url=None, model=None):
         super().__init__()
-        self.ser = self.init_serial(port, baudrate)
-        self.ax = self.ay = self.az = 0.0
+        self.ser = self.init_serial(port, baudrate, url)
+        self.sample = Sample()  # Last good orientation
         self.yaw_mode = False
         self.running = True
         self.daemon = True  # Ends thread when main program exits
-
-    def init_serial(self, port, baudrate):
+        self.samples = metrics.counter('samples_total', 'Orientation samples applied', client='cube')
+        self.parse_errors = metrics.counter('parse_errors_total', 'Lines that failed to parse', client='cube')
+        self.frame_timer = metrics.FrameTimer(client='cube')
+        self.telemetry = TelemetryMonitor(name='cube')  # gap detection and stale data policy
+        self.stale = False
+        self.model = model  # mesh.Model drawn instead of the box
+        self.trail = Trail()  # orientation history, shown with 't'
+        self.show_trail = False
+
+    def init_serial(self, port, baudrate, url=None):
         try:
-            return serial.Serial(port, baudrate, timeout=1)
-        except serial.SerialException as e:
+            return open_link(url or f"serial:{port}?baud={baudrate}", name='cube')
+        except (TransportError, ValueError) as e:
             print(f"Serial Error: {e}")
             return None
 
@@ -42,11 +62,22 @@ class CubeVisualizer(threading.Thread):
         glLoadIdentity()
         glTranslatef(0.0, 0.0, -7.0)
 
+        glPushMatrix()
         if self.yaw_mode:
-            glRotatef(self.az, 0.0, 1.0, 0.0)
-        glRotatef(self.ay, 1.0, 0.0, 0.0)
-        glRotatef(-self.ax, 0.0, 0.0, 1.0)
+            glRotatef(self.sample.gz, 0.0, 1.0, 0.0)
+        glRotatef(self.sample.gy, 1.0, 0.0, 0.0)
+        glRotatef(-self.sample.gx, 0.0, 0.0, 1.0)
+
+        if self.model:
+            self.model.draw(self.model.lod_for(mesh.TRIANGLE_BUDGET))
+        else:
+            self.draw_box()
+        glPopMatrix()
+
+        if self.show_trail:
+            self.trail.draw()
 
+    def draw_box(self):
         glBegin(GL_QUADS)
         glColor3f(0.0, 1.0, 0.0)  # Front
         glVertex3f(1.0, 0.2, -1.0)
@@ -90,11 +121,13 @@ class CubeVisualizer(threading.Thread):
             return
 
         pygame.init()
-        screen = pygame.display.set_mode((640, 480), DOUBLEBUF | OPENGL)
+        screen, vsync = set_mode_vsync((640, 480), DOUBLEBUF | OPENGL)
         pygame.display.set_caption("MPU6050 3D Cube")
-        clock = pygame.time.Clock()
+        pacer = FramePacer(vsync=vsync)
+        poll = Poll(self.ser)  # one angle request in flight at a time
 
         self.init_gl()
+        metrics.start_http_server()
 
         while self.running:
             for event in pygame.event.get():
@@ -103,23 +136,47 @@ class CubeVisualizer(threading.Thread):
                 elif event.type == KEYDOWN:
                     if event.key == K_z:
                         self.yaw_mode = not self.yaw_mode
-                        self.ser.write(b'z\n')
-
-            try:
-                self.ser.write(b'.\n')
-                line = self.ser.readline().decode().strip()
-                if line and (line[0].isdigit() or line[0] == '-' or line[0] == '0'):
-                    parts = line.split(',')
-                    if len(parts) == 3:
-                        self.ax, self.ay, self.az = [float(p) for p in parts]
-            except Exception as e:
-                print(f"Serial error: {e}")
-
-            self.draw_cube()
-            pygame.display.flip()
-            clock.tick(60)
+                        self.trail.set_yaw(self.yaw_mode)
+                        self.ser.send('z')
+                    elif event.key == K_t:
+                        self.show_trail = not self.show_trail
+                    elif event.key == K_F9:
+                        profiling.toggle()
+                elif event.type in REDRAW_EVENTS:
+                    pacer.invalidate()
+
+            poll.send('.')
+            for line in self.ser.read_lines():
+                try:
+                    if line and (line[0].isdigit() or line[0] == '-' or line[0] == '0'):
+                        poll.answered()
+                        sample = parse_angles(line)
+                        if self.telemetry.update(sample, polled=True) not in (DUPLICATE, REORDERED):
+                            self.sample = sample
+                            self.trail.append(sample)
+                            self.samples.inc()
+                        continue
+                    self.parse_errors.inc()
+                except ValueError as e:
+                    self.parse_errors.inc()
+                    print(f"Serial error: {e}")
+
+            # Keep showing the last good orientation, but flag it as stale
+            if self.telemetry.is_stale() != self.stale:
+                self.stale = not self.stale
+                pygame.display.set_caption("MPU6050 3D Cube" + (" [STALE - no data]" if self.stale else ""))
+
+            if pacer.update(self.sample.gx, self.sample.gy, self.sample.gz, self.yaw_mode, self.show_trail):
+                self.frame_timer.begin()
+                self.draw_cube()
+                pygame.display.flip()
+                self.frame_timer.end()
+                if self.model:
+                    self.model.adapt(self.frame_timer.frame_time.value)
+            pacer.sleep()
 
         # Cleanup
+        print("Telemetry:", self.telemetry.summary())
         pygame.quit()
         if self.ser:
             self.ser.close()
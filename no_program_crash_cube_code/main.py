@@ -1,9 +1,11 @@
 # main.py
+import sys
 from cube_visualizer import CubeVisualizer
+import mesh
 import time
 
-# Start the visualizer in background
-cube = CubeVisualizer()
+# Start the visualizer in background, python main.py --model quad.stl for an airframe
+cube = CubeVisualizer(model=mesh.model_from_args(sys.argv))
 cube.start()
 
 # Main app loop
@@ -0,0 +1,175 @@
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+"""
+On-demand sampling profiler for the GUIs
+
+Nothing is instrumented: while the profiler is off there is no hook, no
+thread and no per-call cost, so it can stay in production builds. When it
+is switched on (F9 in the pygame windows, the Profile button in
+StabilizerGUI) a background thread samples the Python stack of every other
+thread (GUI/render loop, link reader) every `interval` seconds for
+`duration` seconds and then writes:
+    profile-<time>.collapsed         one 'thread;outer;...;inner count' line per
+                                     stack, for flamegraph.pl / speedscope
+    profile-<time>.speedscope.json   speedscope.app sampled profile, one per thread
+
+    profiling.toggle()   # start, or stop early and write the files
+"""
+
+DEFAULT_INTERVAL = 0.001
+DEFAULT_DURATION = 10.0
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, interval=DEFAULT_INTERVAL, output_dir='.'):
+        self.interval = interval
+        self.output_dir = output_dir
+        self.counts = collections.Counter()  # (thread name, stack tuple) -> samples
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.started = None
+        self.samples = 0
+        self.elapsed = 0.0
+        self.on_done = None  # called with the written paths when a run ends
+
+    @property
+    def active(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, duration=DEFAULT_DURATION):
+        """Start sampling for `duration` seconds (None = until stop())"""
+        if self.active:
+            return
+        self.counts.clear()
+        self.samples = 0
+        self.stop_event.clear()
+        self.started = time.time()
+        self.thread = threading.Thread(target=self._run, args=(duration,), name='profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop early; the files are written by the sampling thread"""
+        self.stop_event.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def _run(self, duration):
+        own = threading.get_ident()
+        begin = time.monotonic()
+        deadline = None if duration is None else time.monotonic() + duration
+        names = {}
+        while not self.stop_event.is_set():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            frames = sys._current_frames()
+            if len(names) != len(frames):
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                self.counts[(names.get(ident, str(ident)), tuple(stack))] += 1
+            self.samples += 1
+            self.stop_event.wait(self.interval)
+        self.elapsed = time.monotonic() - begin
+        paths = self.write()
+        if self.on_done:
+            self.on_done(paths)
+
+    def write(self):
+        """Write the collapsed and speedscope files, returns their paths"""
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started))
+        base = os.path.join(self.output_dir, f"profile-{stamp}")
+        with open(base + '.collapsed', 'w') as f:
+            for (thread, stack), count in sorted(self.counts.items()):
+                f.write(';'.join((thread.replace(';', '_'),) + stack) + f" {count}\n")
+        with open(base + '.speedscope.json', 'w') as f:
+            json.dump(self.speedscope(), f)
+        return base + '.collapsed', base + '.speedscope.json'
+
+    def speedscope(self):
+        """Samples as a speedscope file (https://www.speedscope.app/file-format-schema.json)"""
+        frames = []
+        frame_index = {}
+        per_thread = collections.defaultdict(list)
+        for (thread, stack), count in self.counts.items():
+            indices = []
+            for name in stack:
+                if name not in frame_index:
+                    frame_index[name] = len(frames)
+                    frames.append({'name': name})
+                indices.append(frame_index[name])
+            per_thread[thread].append((indices, count))
+        # Samples come when the GIL allows, weight them by the measured period
+        period = self.elapsed / self.samples if self.samples else self.interval
+        profiles = []
+        for thread, stacks in sorted(per_thread.items()):
+            total = sum(count for _, count in stacks) * period
+            profiles.append({
+                'type': 'sampled',
+                'name': thread,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': total,
+                'samples': [indices for indices, _ in stacks],
+                'weights': [count * period for _, count in stacks],
+            })
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': frames},
+            'profiles': profiles,
+            'name': f"profile {time.ctime(self.started)}",
+            'exporter': 'profiling.py',
+        }
+
+
+PROFILER = SamplingProfiler()
+
+
+def toggle(duration=DEFAULT_DURATION):
+    """Start a profiling window, or end the running one early. Returns True if started"""
+    if PROFILER.active:
+        PROFILER.stop()
+        return False
+    PROFILER.on_done = lambda paths: print(f"Profile written: {paths[0]}, {paths[1]}")
+    PROFILER.start(duration)
+    print(f"Profiling for {duration:.0f} s (toggle again to stop early)")
+    return True
+
+
+if __name__ == '__main__':
+    # Overhead check: a busy loop with and without the profiler running
+    def work(n=300000):
+        total = 0
+        for i in range(n):
+            total += i * i % 7
+        return total
+
+    start = time.perf_counter()
+    for _ in range(10):
+        work()
+    base = time.perf_counter() - start
+
+    profiler = SamplingProfiler(output_dir=os.environ.get('TMPDIR', '/tmp'))
+    profiler.start(None)
+    start = time.perf_counter()
+    for _ in range(10):
+        work()
+    sampled = time.perf_counter() - start
+    profiler.stop()
+    # Samples are taken when the GIL is released, so the real rate is lower than 1/interval
+    print(f"off: {base * 1e3:.0f} ms, sampling: {sampled * 1e3:.0f} ms "
+          f"({profiler.samples / sampled:.0f} samples/s)")
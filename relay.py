@@ -0,0 +1,394 @@
+import asyncio
+import base64
+import collections
+import hashlib
+import socket
+import struct
+import time
+import metrics
+from transport import make_transport, DEFAULT_TCP_URL
+
+"""
+Telemetry fan-out relay
+
+The ESP32 copes with one or two sockets, so the relay holds the only device
+connection and rebroadcasts every received line to any number of
+subscribers on the LAN:
+    TCP        line protocol, same as the ESP32 cube stream, so existing
+               clients only change their URL:  CubeViewer(url='tcp:relayhost:12346')
+    WebSocket  one text message per batch of lines, for browser dashboards
+
+Each subscriber has its own bounded queue and writer task. The device loop
+only appends to the queues, so a slow or stalled subscriber never delays the
+device or the other subscribers. When a queue is full the overflow policy
+decides what is lost:
+    drop-oldest  keep the newest lines (lowest latency)
+    downsample   drop every other queued line (half rate, whole time span)
+Subscribers that stop reading for stall_timeout seconds are disconnected.
+
+Subscribers cannot command the board; startCubeStream / stopCubeStream only
+pause and resume their own feed. Start commands for the device (and a poll
+command for the serial protocol) are given to the relay:
+    python relay.py tcp:esp32.local:12345 --start startCubeStream
+    python relay.py serial:COM8 --poll . --ws-port 8765
+    python relay.py --simulate 300     # load test with local subscribers
+"""
+
+DEFAULT_RELAY_PORT = 12346
+DROP_OLDEST = 'drop-oldest'
+DOWNSAMPLE = 'downsample'
+SEND_BUFFER = 32768  # kernel send buffer per subscriber socket
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def ws_frame(text, opcode=0x1):
+    """Unmasked server WebSocket frame"""
+    payload = text.encode()
+    n = len(payload)
+    if n < 126:
+        header = struct.pack('!BB', 0x80 | opcode, n)
+    elif n < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+    return header + payload
+
+
+async def ws_read_message(reader):
+    """Next (opcode, text) from a (masked) client WebSocket frame"""
+    b1, b2 = await reader.readexactly(2)
+    n = b2 & 0x7F
+    if n == 126:
+        n, = struct.unpack('!H', await reader.readexactly(2))
+    elif n == 127:
+        n, = struct.unpack('!Q', await reader.readexactly(8))
+    mask = await reader.readexactly(4) if b2 & 0x80 else b'\0\0\0\0'
+    data = bytearray(await reader.readexactly(n))
+    for i in range(n):
+        data[i] ^= mask[i % 4]
+    return b1 & 0x0F, data.decode(errors='replace')
+
+
+async def ws_handshake(reader, writer):
+    """Answer the HTTP upgrade request, False if it is not a WebSocket request"""
+    request = await reader.readuntil(b'\r\n\r\n')
+    key = None
+    for line in request.decode(errors='replace').split('\r\n'):
+        name, _, value = line.partition(':')
+        if name.strip().lower() == 'sec-websocket-key':
+            key = value.strip()
+    if not key:
+        writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+        await writer.drain()
+        return False
+    accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+    writer.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+                  f'Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n').encode())
+    await writer.drain()
+    return True
+
+
+class Subscriber:
+    """One connected client: bounded queue plus its own writer task"""
+
+    def __init__(self, writer, name, max_queue=256, policy=DROP_OLDEST, websocket=False):
+        self.writer = writer
+        self.name = name
+        self.max_queue = max_queue
+        self.policy = policy
+        self.websocket = websocket
+        self.queue = collections.deque()
+        self.wakeup = asyncio.Event()
+        self.paused = False
+        self.tasks = ()  # writer and listener tasks, cancelled to disconnect
+        self.dropped = 0
+        self.sent = 0
+
+    def offer(self, line):
+        """Queue a line without ever blocking, applying the overflow policy"""
+        if self.paused:
+            return 0
+        queue = self.queue
+        dropped = 0
+        if len(queue) >= self.max_queue:
+            if self.policy == DOWNSAMPLE:
+                kept = list(queue)[1::2]  # every other line, newest kept
+                dropped = len(queue) - len(kept)
+                queue.clear()
+                queue.extend(kept)
+            else:
+                queue.popleft()
+                dropped = 1
+            self.dropped += dropped
+        queue.append(line)
+        self.wakeup.set()
+        return dropped
+
+    async def pump(self, stall_timeout):
+        """Write queued lines as they come, in batches when behind"""
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            if not self.queue:
+                continue
+            lines = list(self.queue)
+            self.queue.clear()
+            text = '\n'.join(lines)
+            self.writer.write(ws_frame(text) if self.websocket else (text + '\n').encode())
+            self.sent += len(lines)
+            await asyncio.wait_for(self.writer.drain(), stall_timeout)
+
+
+class Relay:
+    def __init__(self, device=DEFAULT_TCP_URL, host='0.0.0.0', port=DEFAULT_RELAY_PORT, ws_port=None,
+                 max_queue=256, policy=DROP_OLDEST, start_commands=(), poll=None,
+                 poll_interval=0.02, stall_timeout=10.0):
+        # device is a transport URL or a Transport
+        self.transport = make_transport(device, name='relay') if isinstance(device, str) else device
+        self.transport.on_open = self._device_opened
+        self.host = host
+        self.port = port
+        self.ws_port = ws_port
+        self.max_queue = max_queue
+        self.policy = policy
+        self.start_commands = list(start_commands)
+        self.poll = poll
+        self.poll_interval = poll_interval
+        self.stall_timeout = stall_timeout
+        self.subscribers = set()
+        self.servers = []
+        self.tasks = []
+
+        self.subscriber_gauge = metrics.gauge('relay_subscribers', 'Connected relay subscribers')
+        self.lines_in = metrics.counter('relay_lines_in_total', 'Lines received from the device')
+        self.lines_dropped = metrics.counter('relay_lines_dropped_total',
+                                             'Lines dropped by full subscriber queues', policy=policy)
+        self.disconnects = metrics.counter('relay_stalled_disconnects_total',
+                                           'Subscribers dropped for not reading')
+
+    # --- device side ------------------------------------------------------
+
+    async def _device_opened(self):
+        for command in self.start_commands:
+            await self.transport.send_command(command)
+
+    async def _device_loop(self):
+        async for line in self.transport.lines():
+            self.lines_in.inc()
+            dropped = 0
+            for sub in self.subscribers:
+                dropped += sub.offer(line)
+            if dropped:
+                self.lines_dropped.inc(dropped)
+        print("Relay: device stream ended")
+
+    async def _poll_loop(self):
+        while True:
+            if self.transport.is_open:
+                try:
+                    await self.transport.send_command(self.poll)
+                except Exception:
+                    pass  # the read side reconnects
+            await asyncio.sleep(self.poll_interval)
+
+    # --- subscriber side --------------------------------------------------
+
+    async def _handle(self, reader, writer, websocket):
+        peer = writer.get_extra_info('peername')
+        try:
+            if websocket and not await ws_handshake(reader, writer):
+                return
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        # Small socket buffers so the queue policy, not the kernel, absorbs a slow reader
+        writer.transport.set_write_buffer_limits(high=16384)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        sub = Subscriber(writer, f"{peer}", self.max_queue, self.policy, websocket)
+        self.subscribers.add(sub)
+        self.subscriber_gauge.set(len(self.subscribers))
+        pump = asyncio.ensure_future(sub.pump(self.stall_timeout))
+        listen = asyncio.ensure_future(self._listen(sub, reader))
+        sub.tasks = (pump, listen)
+        try:
+            done, _ = await asyncio.wait({pump, listen}, return_when=asyncio.FIRST_COMPLETED)
+            if pump in done and not pump.cancelled() and isinstance(pump.exception(), asyncio.TimeoutError):
+                self.disconnects.inc()
+        finally:
+            pump.cancel()
+            listen.cancel()
+            await asyncio.gather(pump, listen, return_exceptions=True)
+            self.subscribers.discard(sub)
+            self.subscriber_gauge.set(len(self.subscribers))
+            writer.close()
+
+    async def _listen(self, sub, reader):
+        """Subscriber input: stream start/stop only, returns when the client leaves"""
+        try:
+            while True:
+                if sub.websocket:
+                    opcode, text = await ws_read_message(reader)
+                    if opcode == 0x8:
+                        return
+                else:
+                    data = await reader.readline()
+                    if not data:
+                        return
+                    text = data.decode(errors='replace')
+                for command in text.split('\n'):
+                    command = command.strip()
+                    if command == 'stopCubeStream':
+                        sub.paused = True
+                        sub.queue.clear()
+                    elif command == 'startCubeStream':
+                        sub.paused = False
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return
+
+    # --- lifecycle --------------------------------------------------------
+
+    async def start(self):
+        server = await asyncio.start_server(lambda r, w: self._handle(r, w, False), self.host, self.port,
+                                            backlog=1024)
+        self.servers.append(server)
+        self.port = server.sockets[0].getsockname()[1]
+        if self.ws_port is not None:
+            server = await asyncio.start_server(lambda r, w: self._handle(r, w, True), self.host, self.ws_port,
+                                                backlog=1024)
+            self.servers.append(server)
+            self.ws_port = server.sockets[0].getsockname()[1]
+        self.tasks.append(asyncio.ensure_future(self._device_loop()))
+        if self.poll:
+            self.tasks.append(asyncio.ensure_future(self._poll_loop()))
+        return self
+
+    async def stop(self):
+        for server in self.servers:
+            server.close()
+        # Disconnect subscribers and let their handlers finish
+        for sub in list(self.subscribers):
+            for task in sub.tasks:
+                task.cancel()
+        for _ in range(100):
+            if not self.subscribers:
+                break
+            await asyncio.sleep(0.01)
+        for task in self.tasks:
+            task.cancel()
+        await self.transport.close()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"Relay: tcp port {self.port}" + (f", websocket port {self.ws_port}" if self.ws_port else ""))
+        await asyncio.gather(*self.tasks)
+
+
+async def simulate(subscribers=300, slow_every=10, seconds=10.0, rate=1000.0, policy=DROP_OLDEST):
+    """
+    Load test: an emulated board streaming at `rate` Hz and many local TCP
+    subscribers, every slow_every-th of which never reads (with a tiny
+    receive buffer so it stalls quickly). Reports the delivery latency seen
+    by the fast subscribers.
+    """
+
+    from transport import EmulatorTransport
+    from device_emulator import DeviceEmulator
+
+    emulator = DeviceEmulator(rate=rate)
+    relay = Relay(EmulatorTransport(emulator=emulator, name='relay'), host='127.0.0.1', port=0,
+                  max_queue=64, policy=policy, start_commands=['startCubeStream'], stall_timeout=60.0)
+    await relay.start()
+
+    latencies = []
+    received = []
+
+    measuring = asyncio.Event()
+
+    async def fast_client():
+        reader, writer = await asyncio.open_connection('127.0.0.1', relay.port)
+        count = 0
+        try:
+            await measuring.wait()
+            pending = b''
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                *lines, pending = (pending + data).split(b'\n')
+                if lines:
+                    # Latency of the newest line in each read
+                    latencies.append(emulator.now() - int(lines[-1].split(b',')[3]) / 1000.0)
+                    count += len(lines)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            received.append(count)
+            writer.close()
+
+    async def slow_client():
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', relay.port))
+        reader, writer = await asyncio.open_connection(sock=sock)
+        try:
+            await asyncio.sleep(3600)  # connected but never reading
+        except asyncio.CancelledError:
+            writer.close()
+
+    clients = [asyncio.ensure_future(slow_client() if slow_every and i % slow_every == slow_every - 1
+                                     else fast_client()) for i in range(subscribers)]
+    # Wait for everyone to be connected, then measure
+    deadline = time.monotonic() + 10.0
+    while len(relay.subscribers) < subscribers and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    measuring.set()
+    start = time.monotonic()
+    await asyncio.sleep(seconds)
+    elapsed = time.monotonic() - start
+    dropped = sum(sub.dropped for sub in relay.subscribers)
+    for client in clients:
+        client.cancel()
+    await asyncio.gather(*clients, return_exceptions=True)
+    await relay.stop()
+
+    latencies.sort()
+    n = len(latencies)
+    expected = rate * elapsed
+    print(f"{subscribers} subscribers ({len(received)} fast), {rate:.0f} Hz for {elapsed:.1f} s, policy {policy}")
+    print(f"fast clients received {min(received)}..{max(received)} of ~{expected:.0f} lines")
+    if n:
+        print(f"latency p50 {latencies[n // 2] * 1e3:.1f} ms, p99 {latencies[int(n * 0.99)] * 1e3:.1f} ms, "
+              f"max {latencies[-1] * 1e3:.1f} ms")
+    print(f"lines dropped for slow subscribers: {dropped}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Telemetry fan-out relay")
+    parser.add_argument('device', nargs='?', default=DEFAULT_TCP_URL, help="device transport URL")
+    parser.add_argument('--port', type=int, default=DEFAULT_RELAY_PORT, help="TCP subscriber port")
+    parser.add_argument('--ws-port', type=int, default=None, help="WebSocket subscriber port")
+    parser.add_argument('--queue', type=int, default=256, help="lines queued per subscriber")
+    parser.add_argument('--policy', choices=(DROP_OLDEST, DOWNSAMPLE), default=DROP_OLDEST)
+    parser.add_argument('--start', action='append', default=[], help="command sent on every connect")
+    parser.add_argument('--poll', default=None, help="command sent every --poll-interval seconds")
+    parser.add_argument('--poll-interval', type=float, default=0.02)
+    parser.add_argument('--simulate', type=int, default=0, metavar='N', help="load test with N subscribers")
+    args = parser.parse_args()
+
+    if args.simulate:
+        asyncio.run(simulate(args.simulate, policy=args.policy))
+    else:
+        metrics.start_http_server()
+        relay = Relay(args.device, port=args.port, ws_port=args.ws_port, max_queue=args.queue,
+                      policy=args.policy, start_commands=args.start, poll=args.poll,
+                      poll_interval=args.poll_interval)
+        try:
+            asyncio.run(relay.serve_forever())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,92 @@
+import time
+import pygame
+
+"""
+Dirty-flag rendering and adaptive frame pacing for the visualizers
+
+The cube only needs to be redrawn when the orientation moved by more than
+`epsilon` degrees or the overlay text changed. While things change the loop
+runs at the active rate (synced to the display when vsync is available);
+after `idle_after` seconds without changes it drops to the idle rate, which
+only polls for new data and window events.
+
+Typical pygame loop:
+    pacer = FramePacer(vsync=vsync)
+    while running:
+        ...handle events, pacer.invalidate() on expose/resize...
+        if pacer.update(ax, ay, az, text):
+            draw(); pygame.display.flip()
+        pacer.sleep()
+"""
+
+REDRAW_EVENTS = {pygame.VIDEOEXPOSE, pygame.VIDEORESIZE, getattr(pygame, 'WINDOWEVENT', -1)}
+
+
+def set_mode_vsync(size, flags):
+    """Open the display with vsync if the driver supports it, returns (screen, vsync)"""
+    try:
+        return pygame.display.set_mode(size, flags, vsync=1), True
+    except (TypeError, pygame.error):
+        # pygame 1.x has no vsync argument, some GL drivers refuse it
+        return pygame.display.set_mode(size, flags), False
+
+
+class FramePacer:
+    def __init__(self, active_fps=60.0, idle_fps=10.0, idle_after=0.5, epsilon=0.05,
+                 vsync=False, clock=time.monotonic):
+        self.active_interval = 1.0 / active_fps
+        self.idle_interval = 1.0 / idle_fps
+        self.idle_after = idle_after
+        self.epsilon = epsilon
+        self.vsync = vsync
+        self.clock = clock
+        self.last_state = None
+        self.last_change = clock()
+        self.last_tick = clock()
+        self.dirty = True
+        self.drew = False
+
+    def invalidate(self):
+        """Force a redraw on the next update (window exposed, resized...)"""
+        self.dirty = True
+
+    def _changed(self, state):
+        if self.last_state is None or len(state) != len(self.last_state):
+            return True
+        for new, old in zip(state, self.last_state):
+            if isinstance(new, float) and isinstance(old, float):
+                if abs(new - old) > self.epsilon:
+                    return True
+            elif new != old:
+                return True
+        return False
+
+    def update(self, *state):
+        """Returns True if a frame with this state needs to be drawn"""
+        now = self.clock()
+        if self.dirty or self._changed(state):
+            self.last_state = state
+            self.last_change = now
+            self.dirty = False
+            self.drew = True
+        else:
+            self.drew = False
+        return self.drew
+
+    @property
+    def idle(self):
+        return self.clock() - self.last_change > self.idle_after
+
+    def interval(self):
+        """Seconds between loop ticks for the current mode"""
+        return self.idle_interval if self.idle else self.active_interval
+
+    def sleep(self):
+        """Wait for the next tick; a vsynced flip has already paced active frames"""
+        now = self.clock()
+        if not (self.vsync and self.drew and not self.idle):
+            remaining = self.last_tick + self.interval() - now
+            if remaining > 0:
+                time.sleep(remaining)
+                now = self.clock()
+        self.last_tick = now
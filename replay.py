@@ -0,0 +1,157 @@
+import bisect
+import json
+import os
+import time
+
+"""
+Session recording and time-indexed replay
+
+A recorded session is a text file with one received line per row, prefixed
+by the host receive time in seconds since the start of the recording:
+    0.0213<TAB>1.25, -3.10, 0.42, 118, 2360
+Plain serial dumps without the time column are also accepted; their lines
+are spaced `interval` seconds apart (50 Hz by default).
+
+SessionReader builds a sparse time index (one entry every `index_every`
+lines) the first time a file is opened and caches it next to the file as
+<session>.idx, so seeking anywhere in an hour-long session is one bisect and
+one file seek. Replays are driven through the transport layer:
+    replay:session.log?speed=10&start=2520
+speed=0 replays as fast as possible.
+
+Long sessions are better kept as .tlm stores (session_store.py): chunked,
+compressed Samples with a time index and min/max summaries. Recording to or
+replaying from a path ending in .tlm uses the store instead of text.
+"""
+
+INDEX_VERSION = 1
+
+
+class SessionRecorder:
+    """Writes received lines with their host receive time"""
+
+    def __init__(self, path, clock=time.monotonic):
+        self.file = open(path, 'w', buffering=1 << 16)
+        self.clock = clock
+        self.start = clock()
+
+    def write(self, line):
+        self.file.write(f"{self.clock() - self.start:.4f}\t{line}\n")
+
+    def close(self):
+        self.file.close()
+
+
+def split_line(raw):
+    """(time or None, text) for one raw session line"""
+    text = raw.decode(errors='replace').strip()
+    stamp, tab, rest = text.partition('\t')
+    if tab:
+        try:
+            return float(stamp), rest
+        except ValueError:
+            pass
+    return None, text
+
+
+def open_recorder(path, parser=None):
+    """SessionRecorder, or a StoreRecorder for .tlm paths (parser defaults to angle frames)"""
+    if path.endswith('.tlm'):
+        from session_store import StoreRecorder
+        return StoreRecorder(path, parser) if parser else StoreRecorder(path)
+    return SessionRecorder(path)
+
+
+def open_reader(path, interval=0.02):
+    """SessionReader, or a StoreReader for .tlm stores"""
+    if path.endswith('.tlm'):
+        from session_store import StoreReader
+        return StoreReader(path)
+    return SessionReader(path, interval)
+
+
+class SessionReader:
+    def __init__(self, path, interval=0.02, index_every=256):
+        self.path = path
+        self.interval = interval
+        self.index_every = index_every
+        self.file = open(path, 'rb')
+        self.times, self.offsets, self.line_numbers, self.duration = self._load_index()
+        self.line_no = 0
+        self.last_time = 0.0
+
+    # --- index ------------------------------------------------------------
+
+    def _index_path(self):
+        return self.path + '.idx'
+
+    def _load_index(self):
+        stat = os.stat(self.path)
+        key = [stat.st_size, stat.st_mtime_ns, self.interval, self.index_every, INDEX_VERSION]
+        try:
+            with open(self._index_path()) as f:
+                cached = json.load(f)
+            if cached['key'] == key:
+                return cached['times'], cached['offsets'], cached['lines'], cached['duration']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        index = self._build_index()
+        try:
+            with open(self._index_path(), 'w') as f:
+                json.dump(dict(zip(('times', 'offsets', 'lines', 'duration'), index), key=key), f)
+        except OSError:
+            pass  # read-only location, index stays in memory
+        return index
+
+    def _build_index(self):
+        """One pass over the file, remembering every index_every-th line"""
+        times, offsets, lines = [], [], []
+        offset = 0
+        t = 0.0
+        self.file.seek(0)
+        for n, raw in enumerate(self.file):
+            stamp, _ = split_line(raw)
+            t = stamp if stamp is not None else n * self.interval
+            if n % self.index_every == 0:
+                times.append(t)
+                offsets.append(offset)
+                lines.append(n)
+            offset += len(raw)
+        self.file.seek(0)
+        return times, offsets, lines, t
+
+    # --- reading ----------------------------------------------------------
+
+    def seek(self, t):
+        """Position the reader on the first line at or after time t"""
+        i = max(bisect.bisect_right(self.times, t) - 1, 0)
+        if not self.offsets:
+            return
+        self.file.seek(self.offsets[i])
+        self.line_no = self.line_numbers[i]
+        # Skip forward inside the block
+        while True:
+            pos = self.file.tell()
+            line_no = self.line_no
+            item = self.read()
+            if item is None or item[0] >= t:
+                self.file.seek(pos)
+                self.line_no = line_no
+                return
+
+    def read(self):
+        """Next (time, text) or None at the end of the file"""
+        while True:
+            raw = self.file.readline()
+            if not raw:
+                return None
+            n = self.line_no
+            self.line_no += 1
+            stamp, text = split_line(raw)
+            if text:
+                self.last_time = stamp if stamp is not None else n * self.interval
+                return self.last_time, text
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,191 @@
+import math
+import numpy as np
+
+"""
+Shared telemetry sample representation
+
+Sample is a __slots__ record for one telemetry frame, SAMPLE_DTYPE is the
+matching NumPy structured dtype for batches (storage, buffers, plotting).
+Fields:
+    t           device time in seconds (nan if the frame had none)
+    seq         firmware sample counter (NO_SEQ if the frame had none)
+    gx, gy, gz  orientation angles in degrees (firmware order and signs)
+    rx, ry, rz  body rates in deg/s
+    pwm         servo input channels 1-3 in percent
+    autopilot   autopilot switch channel in percent
+
+All parsers return Samples and all clients keep their current orientation
+in one, instead of per-module attributes, globals and lists. Batched stream
+frames (several samples per line) parse straight into SAMPLE_DTYPE arrays.
+"""
+
+NO_SEQ = -1
+BATCH_PREFIX = 'b:'
+
+SAMPLE_DTYPE = np.dtype([
+    ('t', 'f8'),
+    ('seq', 'i8'),
+    ('gx', 'f4'), ('gy', 'f4'), ('gz', 'f4'),
+    ('rx', 'f4'), ('ry', 'f4'), ('rz', 'f4'),
+    ('pwm', 'u1', (3,)),
+    ('autopilot', 'u1'),
+])
+
+
+class Sample:
+    __slots__ = ('t', 'seq', 'gx', 'gy', 'gz', 'rx', 'ry', 'rz', 'pwm1', 'pwm2', 'pwm3', 'autopilot')
+
+    def __init__(self, t=math.nan, seq=NO_SEQ, gx=0.0, gy=0.0, gz=0.0,
+                 rx=0.0, ry=0.0, rz=0.0, pwm1=0, pwm2=0, pwm3=0, autopilot=0):
+        self.t = t
+        self.seq = seq
+        self.gx = gx
+        self.gy = gy
+        self.gz = gz
+        self.rx = rx
+        self.ry = ry
+        self.rz = rz
+        self.pwm1 = pwm1
+        self.pwm2 = pwm2
+        self.pwm3 = pwm3
+        self.autopilot = autopilot
+
+    @property
+    def angles(self):
+        return self.gx, self.gy, self.gz
+
+    @property
+    def pwm(self):
+        return self.pwm1, self.pwm2, self.pwm3
+
+    def record(self):
+        """Tuple in SAMPLE_DTYPE field order"""
+        return (self.t, self.seq, self.gx, self.gy, self.gz, self.rx, self.ry, self.rz,
+                (self.pwm1, self.pwm2, self.pwm3), self.autopilot)
+
+    @classmethod
+    def from_record(cls, rec):
+        """Sample from one element of a SAMPLE_DTYPE array"""
+        p1, p2, p3 = rec['pwm'].tolist()
+        return cls(float(rec['t']), int(rec['seq']), float(rec['gx']), float(rec['gy']),
+                   float(rec['gz']), float(rec['rx']), float(rec['ry']), float(rec['rz']),
+                   p1, p2, p3, int(rec['autopilot']))
+
+    def __repr__(self):
+        return (f"Sample(t={self.t:.3f}, seq={self.seq}, angles=({self.gx:.2f}, {self.gy:.2f}, "
+                f"{self.gz:.2f}), pwm={self.pwm}, autopilot={self.autopilot})")
+
+
+def to_array(samples):
+    """Pack a list of Samples into a SAMPLE_DTYPE array"""
+    return np.array([s.record() for s in samples], dtype=SAMPLE_DTYPE)
+
+
+def parse_angles(line, count=3):
+    """
+    Parse an angle frame 'gx, gy[, gz][, seq, ms]' into a Sample.
+    Legacy frames without seq and ms get NO_SEQ and t = nan.
+    Raises ValueError for anything else.
+    """
+    parts = line.split(',')
+    n = len(parts)
+    if n == count + 2:
+        sample = Sample(int(parts[count + 1]) / 1000.0, int(parts[count]))
+    elif n == count:
+        sample = Sample()
+    else:
+        raise ValueError(f"Expected {count} or {count + 2} fields: {line}")
+    sample.gx = float(parts[0])
+    sample.gy = float(parts[1])
+    if count > 2:
+        sample.gz = float(parts[2])
+    return sample
+
+
+def parse_batch(line):
+    """
+    Parse a batched angle frame 'b:seq,ms0,ms1;gx,gy,gz;...' (angles in
+    hundredths of a degree) into a SAMPLE_DTYPE array. Samples have
+    consecutive seq numbers and times spread evenly from ms0 to ms1.
+    Raises ValueError for anything else.
+    """
+    if not line.startswith(BATCH_PREFIX):
+        raise ValueError(f"Not a batch frame: {line}")
+    head, _, body = line[len(BATCH_PREFIX):].partition(';')
+    fields = head.split(',')
+    if len(fields) != 3 or not body:
+        raise ValueError(f"Bad batch frame: {line}")
+    seq, ms0, ms1 = (int(f) for f in fields)
+    values = np.array(body.replace(';', ',').split(','), dtype=np.float64)
+    if values.size % 3:
+        raise ValueError(f"Expected 3 angles per sample: {line}")
+    values = values.reshape(-1, 3) / 100.0
+    batch = np.zeros(len(values), dtype=SAMPLE_DTYPE)
+    batch['seq'] = seq + np.arange(len(values))
+    batch['t'] = np.linspace(ms0, ms1, len(values)) / 1000.0
+    batch['gx'], batch['gy'], batch['gz'] = values.T
+    return batch
+
+
+def parse_pwm(line):
+    """
+    Parse a servo stream line 'p1,p2,p3[,autopilot]' (percent) into a Sample.
+    'No signal' lines give an all-zero sample.
+    """
+    sample = Sample()
+    if "No signal" in line:
+        return sample
+    parts = line.split(',')
+    if not 1 <= len(parts) <= 4:
+        raise ValueError(f"Expected 1 to 4 PWM fields: {line}")
+    values = [max(0, min(100, int(p))) for p in parts] + [0] * (4 - len(parts))
+    sample.pwm1, sample.pwm2, sample.pwm3, sample.autopilot = values
+    return sample
+
+
+class SampleBuffer:
+    """Fixed-capacity ring buffer of SAMPLE_DTYPE records"""
+
+    def __init__(self, capacity):
+        self.data = np.zeros(capacity, dtype=SAMPLE_DTYPE)
+        self.capacity = capacity
+        self.head = 0   # next write position
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, sample):
+        self.data[self.head] = sample.record()
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def extend(self, batch):
+        """Append a SAMPLE_DTYPE array, keeping only the newest capacity records"""
+        n = len(batch)
+        if n >= self.capacity:
+            self.data[:] = batch[-self.capacity:]
+            self.head = 0
+            self.count = self.capacity
+            return
+        end = self.head + n
+        if end <= self.capacity:
+            self.data[self.head:end] = batch
+        else:
+            split = self.capacity - self.head
+            self.data[self.head:] = batch[:split]
+            self.data[:n - split] = batch[split:]
+        self.head = end % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    def latest(self, n=None):
+        """The newest n records (all by default) in time order, as a copy"""
+        n = self.count if n is None else min(n, self.count)
+        start = (self.head - n) % self.capacity
+        if start + n <= self.capacity:
+            return self.data[start:start + n].copy()
+        return np.concatenate([self.data[start:], self.data[:self.head]])
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
@@ -0,0 +1,631 @@
+import math
+import time
+import numpy as np
+from sample import Sample, NO_SEQ, SAMPLE_DTYPE
+
+"""
+Host-side sensor fusion for the MPU6050
+
+The firmware only runs a fixed Euler complementary filter, which has no way
+to correct yaw. This module runs the fusion on the host instead, from raw
+IMU samples sent by the ESP32: polled ('r' command) or every sample in
+batched 'rb:' frames (tagged 'R<n>' command, see the firmware).
+
+Raw sample batches are NumPy arrays with one row per sample and the columns
+in RAW_COLUMNS:
+    t           device time in seconds
+    ax, ay, az  accelerometer (raw counts, only the direction is used)
+    gx, gy, gz  gyro rates in deg/s (already offset corrected by the board)
+
+Every algorithm returns an (N, 3) array of angles in degrees, in the same
+order and sign convention as the firmware's "gx, gy, gz" output, so the
+visualizers can draw them unchanged.
+
+Available algorithms:
+    firmware  - replica of the firmware EMA + complementary chain
+    madgwick  - Madgwick gradient descent AHRS (IMU version)
+    mahony    - Mahony PI filter, the integral term tracks gyro bias
+    kalman    - per-axis angle/bias Kalman filter
+"""
+
+RAW_COLUMNS = ('t', 'ax', 'ay', 'az', 'gx', 'gy', 'gz')
+RAW_BATCH_PREFIX = 'rb:'
+
+DEG2RAD = math.pi / 180.0
+RAD2DEG = 180.0 / math.pi
+
+# Block length for the vectorized recurrences (keeps b**-k well inside float64)
+_BLOCK = 64
+
+# Longest gap the firmware replicas integrate over (polled rows, dropouts)
+MAX_DT = 0.25
+
+
+def linear_recurrence(u, b, y0=0.0):
+    """
+    Vectorized y[k] = b * y[k-1] + u[k] along axis 0, starting from y0.
+    Both the firmware EMA stages and the complementary filter have this form,
+    so a whole batch is filtered with a few NumPy calls per block.
+    b may also be an array broadcasting against u[0] (one factor per column).
+    """
+    u = np.asarray(u, dtype=np.float64)
+    if np.ndim(b):
+        return _linear_recurrence_columns(u, np.asarray(b, dtype=np.float64), y0)
+    y = np.empty_like(u)
+    prev = np.asarray(y0, dtype=np.float64)
+    if b == 0.0:
+        y[:] = u
+        return y
+    if b == 1.0:
+        return np.cumsum(u, axis=0) + prev
+
+    n = u.shape[0]
+    k = np.arange(1, _BLOCK + 1, dtype=np.float64)
+    powers = b ** k              # b, b^2, ... b^BLOCK
+    inv_powers = 1.0 / powers
+    if u.ndim > 1:
+        powers = powers[:, None]
+        inv_powers = inv_powers[:, None]
+
+    for start in range(0, n, _BLOCK):
+        block = u[start:start + _BLOCK]
+        m = block.shape[0]
+        acc = np.cumsum(block * inv_powers[:m] * b, axis=0)
+        y[start:start + m] = powers[:m] * prev + powers[:m] / b * acc
+        prev = y[start + m - 1]
+    return y
+
+
+def row_periods(t, last_t, freq):
+    """
+    Integration period of each row from the device timestamps, so polled
+    rows (a subset of the board's samples) are integrated over the time they
+    actually cover. The first row of a stream gets one loop period, 1 / freq.
+    """
+    dt = np.empty(len(t))
+    dt[1:] = np.diff(t)
+    dt[0] = t[0] - last_t if last_t is not None else 1.0 / freq
+    np.clip(dt, 0.0, MAX_DT, out=dt)
+    return dt
+
+
+def _linear_recurrence_columns(u, b, y0):
+    """linear_recurrence with a separate factor per column"""
+    zero = b <= 0.0  # y = u, computed as b = 1 and replaced at the end
+    b = np.where(zero, 1.0, b)
+    # Shorter blocks for small factors so b**-block stays finite
+    block = _BLOCK
+    smallest = b.min()
+    if smallest < 1.0:
+        block = max(1, min(_BLOCK, int(600.0 / -math.log2(smallest))))
+    k = np.arange(1, block + 1, dtype=np.float64).reshape((-1,) + (1,) * b.ndim)
+    powers = b ** k
+    inv_powers = 1.0 / powers
+
+    y = np.empty(np.broadcast_shapes(u.shape, (1,) + b.shape))
+    prev = np.broadcast_to(np.asarray(y0, dtype=np.float64), y.shape[1:])
+    for start in range(0, u.shape[0], block):
+        chunk = u[start:start + block]
+        m = chunk.shape[0]
+        acc = np.cumsum(chunk * inv_powers[:m] * b, axis=0)
+        y[start:start + m] = powers[:m] * prev + powers[:m] / b * acc
+        prev = y[start + m - 1]
+    if zero.any():
+        y = np.where(zero, u, y)
+    return y
+
+
+class FirmwareFilter:
+    """
+    Replica of the EMA + complementary filter in the firmware loop().
+    The gyro is integrated over the time between rows, freq (the board's
+    sample rate) only sets the period of the first row.
+    """
+
+    name = 'firmware'
+
+    def __init__(self, accel_filter=0.3, gyro_filter=0.08, comp_filter=0.7, freq=50.0):
+        self.accel_filter = accel_filter
+        self.gyro_filter = gyro_filter
+        self.comp_filter = comp_filter
+        self.freq = freq
+        self.reset()
+
+    def reset(self):
+        self.filtered_acc = np.zeros(3)
+        self.filtered_gyr = np.zeros(3)
+        self.angles = np.zeros(3)
+        self.last_t = None
+
+    def set_params(self, accel_filter, gyro_filter, comp_filter, freq=None):
+        self.accel_filter = accel_filter
+        self.gyro_filter = gyro_filter
+        self.comp_filter = comp_filter
+        if freq:
+            self.freq = freq
+
+    def zero_yaw(self):
+        self.angles[2] = 0.0
+
+    def update_batch(self, batch):
+        acc = batch[:, 1:4]
+        gyr = batch[:, 4:7]
+
+        # EMA low pass on both sensors
+        a = self.accel_filter
+        g = self.gyro_filter
+        f_acc = linear_recurrence(acc * a, 1.0 - a, self.filtered_acc)
+        f_gyr = linear_recurrence(gyr * g, 1.0 - g, self.filtered_gyr)
+        self.filtered_acc = f_acc[-1]
+        self.filtered_gyr = f_gyr[-1]
+
+        fax, fay, faz = f_acc[:, 0], f_acc[:, 1], f_acc[:, 2]
+        acc_x = np.arctan2(fay, np.sqrt(fax * fax + faz * faz)) * RAD2DEG
+        acc_y = np.arctan2(fax, np.sqrt(fay * fay + faz * faz)) * RAD2DEG
+
+        # Integrate over each row's period, then blend (gx, gy only)
+        c = self.comp_filter
+        dt = row_periods(batch[:, 0], self.last_t, self.freq)
+        self.last_t = batch[-1, 0]
+        rate = f_gyr * dt[:, None]
+        out = np.empty((batch.shape[0], 3))
+        out[:, 0] = linear_recurrence((1.0 - c) * rate[:, 0] + c * acc_x, 1.0 - c, self.angles[0])
+        out[:, 1] = linear_recurrence(-(1.0 - c) * rate[:, 1] + c * acc_y, 1.0 - c, self.angles[1])
+        out[:, 2] = np.cumsum(rate[:, 2]) + self.angles[2]
+        self.angles = out[-1].copy()
+        return out
+
+
+class FilterBank:
+    """
+    K firmware filter replicas with different (accel, gyro, comp) settings
+    run side by side on the same raw input, for A/B comparisons.
+    update_batch returns (N, K, 3) angles; set k matches FirmwareFilter
+    with param_sets[k] and the same freq.
+    """
+
+    def __init__(self, param_sets, freq=50.0):
+        self.freq = freq
+        self.set_params(param_sets)
+
+    def set_params(self, param_sets):
+        """Replace all parameter sets, every replica starts from a fresh state"""
+        params = np.asarray(param_sets, dtype=np.float64).reshape(-1, 3)
+        self.param_sets = params
+        self.accel_filter, self.gyro_filter, self.comp_filter = params.T
+        self.reset()
+
+    def __len__(self):
+        return len(self.param_sets)
+
+    def reset(self):
+        k = len(self.param_sets)
+        self.filtered_acc = np.zeros((k, 3))
+        self.filtered_gyr = np.zeros((k, 3))
+        self.angles = np.zeros((k, 3))
+        self.last_t = None
+
+    def zero_yaw(self):
+        self.angles[:, 2] = 0.0
+
+    def update_batch(self, batch):
+        acc = batch[:, None, 1:4]
+        gyr = batch[:, None, 4:7]
+
+        a = self.accel_filter[:, None]
+        g = self.gyro_filter[:, None]
+        f_acc = linear_recurrence(acc * a, 1.0 - a, self.filtered_acc)
+        f_gyr = linear_recurrence(gyr * g, 1.0 - g, self.filtered_gyr)
+        self.filtered_acc = f_acc[-1]
+        self.filtered_gyr = f_gyr[-1]
+
+        fax, fay, faz = f_acc[..., 0], f_acc[..., 1], f_acc[..., 2]
+        acc_x = np.arctan2(fay, np.sqrt(fax * fax + faz * faz)) * RAD2DEG
+        acc_y = np.arctan2(fax, np.sqrt(fay * fay + faz * faz)) * RAD2DEG
+
+        c = self.comp_filter
+        dt = row_periods(batch[:, 0], self.last_t, self.freq)
+        self.last_t = batch[-1, 0]
+        rate = f_gyr * dt[:, None, None]
+        out = np.empty((batch.shape[0], len(c), 3))
+        out[..., 0] = linear_recurrence((1.0 - c) * rate[..., 0] + c * acc_x, 1.0 - c, self.angles[:, 0])
+        out[..., 1] = linear_recurrence(-(1.0 - c) * rate[..., 1] + c * acc_y, 1.0 - c, self.angles[:, 1])
+        out[..., 2] = np.cumsum(rate[..., 2], axis=0) + self.angles[:, 2]
+        self.angles = out[-1].copy()
+        return out
+
+
+def divergence(angles, reference=0):
+    """
+    Per-set angle difference to set `reference` for (N, K, 3) bank output,
+    wrapped to +-180 degrees. Returns an array of the same shape.
+    """
+    diff = angles - angles[:, reference:reference + 1]
+    return (diff + 180.0) % 360.0 - 180.0
+
+
+class _QuaternionFilter:
+    """Shared state and helpers for the quaternion based filters"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.q = [1.0, 0.0, 0.0, 0.0]
+        self.last_t = None
+
+    def zero_yaw(self):
+        # Remove the heading component, keep roll and pitch
+        w, x, y, z = self.q
+        yaw = math.atan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z))
+        cw, sw = math.cos(-yaw / 2.0), math.sin(-yaw / 2.0)
+        self.q = [cw * w - sw * z, cw * x - sw * y, cw * y + sw * x, cw * z + sw * w]
+
+    def _prepare(self, batch):
+        """Vectorized per-batch work: dt, unit accel vectors, gyro in rad/s"""
+        t = batch[:, 0]
+        dt = np.empty(len(t))
+        dt[1:] = np.diff(t)
+        dt[0] = t[0] - self.last_t if self.last_t is not None else 0.0
+        np.clip(dt, 0.0, 0.1, out=dt)  # ignore gaps and clock jumps
+        self.last_t = t[-1]
+
+        acc = batch[:, 1:4]
+        norm = np.linalg.norm(acc, axis=1)
+        valid = norm > 0
+        acc = np.divide(acc, norm[:, None], out=np.zeros_like(acc), where=valid[:, None])
+        gyr = batch[:, 4:7] * DEG2RAD
+        return dt.tolist(), acc.tolist(), valid.tolist(), gyr.tolist()
+
+    @staticmethod
+    def to_angles(quats):
+        """(N, 4) quaternions to firmware style (gx, gy, gz) degrees"""
+        w, x, y, z = quats[:, 0], quats[:, 1], quats[:, 2], quats[:, 3]
+        roll = np.arctan2(2.0 * (w * x + y * z), 1.0 - 2.0 * (x * x + y * y))
+        pitch = np.arcsin(np.clip(2.0 * (w * y - z * x), -1.0, 1.0))
+        yaw = np.arctan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z))
+        # Firmware integrates -gyrY for its second angle
+        return np.stack([roll, -pitch, yaw], axis=1) * RAD2DEG
+
+    def update_batch(self, batch):
+        dts, accs, valids, gyrs = self._prepare(batch)
+        quats = np.empty((len(dts), 4))
+        step = self._step
+        for i in range(len(dts)):
+            quats[i] = step(dts[i], accs[i], valids[i], gyrs[i])
+        return self.to_angles(quats)
+
+
+class MadgwickFilter(_QuaternionFilter):
+    """Madgwick IMU filter, beta trades gyro trust against accel correction"""
+
+    name = 'madgwick'
+
+    def __init__(self, beta=0.1):
+        self.beta = beta
+        super().__init__()
+
+    def _step(self, dt, acc, valid, gyr):
+        q0, q1, q2, q3 = self.q
+        gx, gy, gz = gyr
+
+        # Rate of change of quaternion from gyroscope
+        qd0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        qd1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        qd2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        qd3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+        if valid:
+            ax, ay, az = acc
+            # Gradient of the objective function
+            f1 = 2.0 * (q1 * q3 - q0 * q2) - ax
+            f2 = 2.0 * (q0 * q1 + q2 * q3) - ay
+            f3 = 1.0 - 2.0 * (q1 * q1 + q2 * q2) - az
+            s0 = -2.0 * q2 * f1 + 2.0 * q1 * f2
+            s1 = 2.0 * q3 * f1 + 2.0 * q0 * f2 - 4.0 * q1 * f3
+            s2 = -2.0 * q0 * f1 + 2.0 * q3 * f2 - 4.0 * q2 * f3
+            s3 = 2.0 * q1 * f1 + 2.0 * q2 * f2
+            norm = math.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+            if norm > 0:
+                k = self.beta / norm
+                qd0 -= k * s0
+                qd1 -= k * s1
+                qd2 -= k * s2
+                qd3 -= k * s3
+
+        q0 += qd0 * dt
+        q1 += qd1 * dt
+        q2 += qd2 * dt
+        q3 += qd3 * dt
+        inv = 1.0 / math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+        self.q = [q0 * inv, q1 * inv, q2 * inv, q3 * inv]
+        return self.q
+
+
+class MahonyFilter(_QuaternionFilter):
+    """Mahony PI complementary filter on SO(3)"""
+
+    name = 'mahony'
+
+    def __init__(self, kp=1.0, ki=0.05):
+        self.kp = kp
+        self.ki = ki
+        super().__init__()
+
+    def reset(self):
+        super().reset()
+        self.integral = [0.0, 0.0, 0.0]  # estimated gyro bias (rad/s)
+
+    def _step(self, dt, acc, valid, gyr):
+        q0, q1, q2, q3 = self.q
+        gx, gy, gz = gyr
+
+        if valid:
+            ax, ay, az = acc
+            # Estimated gravity direction vs measured
+            vx = 2.0 * (q1 * q3 - q0 * q2)
+            vy = 2.0 * (q0 * q1 + q2 * q3)
+            vz = q0 * q0 - q1 * q1 - q2 * q2 + q3 * q3
+            ex = ay * vz - az * vy
+            ey = az * vx - ax * vz
+            ez = ax * vy - ay * vx
+            ix, iy, iz = self.integral
+            ix += self.ki * ex * dt
+            iy += self.ki * ey * dt
+            iz += self.ki * ez * dt
+            self.integral = [ix, iy, iz]
+            gx += self.kp * ex + ix
+            gy += self.kp * ey + iy
+            gz += self.kp * ez + iz
+
+        h = 0.5 * dt
+        q0, q1, q2, q3 = (q0 + (-q1 * gx - q2 * gy - q3 * gz) * h,
+                          q1 + (q0 * gx + q2 * gz - q3 * gy) * h,
+                          q2 + (q0 * gy - q1 * gz + q3 * gx) * h,
+                          q3 + (q0 * gz + q1 * gy - q2 * gx) * h)
+        inv = 1.0 / math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+        self.q = [q0 * inv, q1 * inv, q2 * inv, q3 * inv]
+        return self.q
+
+
+class KalmanFilter:
+    """
+    Two state (angle, gyro bias) Kalman filter per tilt axis.
+    Yaw has no absolute reference on the MPU6050, so it is the integrated
+    bias-free gyro rate with a simple rest-detection bias estimate.
+    """
+
+    name = 'kalman'
+
+    def __init__(self, q_angle=0.001, q_bias=0.003, r_measure=0.03):
+        self.q_angle = q_angle
+        self.q_bias = q_bias
+        self.r_measure = r_measure
+        self.reset()
+
+    def reset(self):
+        # Per axis: [angle, bias, P00, P01, P10, P11]
+        self.state = [[0.0, 0.0, 0.0, 0.0, 0.0, 0.0] for _ in range(2)]
+        self.yaw = 0.0
+        self.yaw_bias = 0.0
+        self.last_t = None
+
+    def zero_yaw(self):
+        self.yaw = 0.0
+
+    def _kalman_step(self, s, measured, rate, dt):
+        angle, bias, p00, p01, p10, p11 = s
+        # Predict
+        angle += dt * (rate - bias)
+        p00 += dt * (dt * p11 - p01 - p10 + self.q_angle)
+        p01 -= dt * p11
+        p10 -= dt * p11
+        p11 += self.q_bias * dt
+        # Update
+        innov = measured - angle
+        si = p00 + self.r_measure
+        k0 = p00 / si
+        k1 = p10 / si
+        angle += k0 * innov
+        bias += k1 * innov
+        s[:] = [angle, bias,
+                p00 - k0 * p00, p01 - k0 * p01,
+                p10 - k1 * p00, p11 - k1 * p01]
+        return angle
+
+    def update_batch(self, batch):
+        t = batch[:, 0]
+        dt = np.empty(len(t))
+        dt[1:] = np.diff(t)
+        dt[0] = t[0] - self.last_t if self.last_t is not None else 0.0
+        np.clip(dt, 0.0, 0.1, out=dt)
+        self.last_t = t[-1]
+
+        # Accelerometer tilt angles, same formulas as the firmware
+        ax, ay, az = batch[:, 1], batch[:, 2], batch[:, 3]
+        acc_x = np.arctan2(ay, np.sqrt(ax * ax + az * az)) * RAD2DEG
+        acc_y = np.arctan2(ax, np.sqrt(ay * ay + az * az)) * RAD2DEG
+
+        out = np.empty((len(t), 3))
+        sx, sy = self.state
+        step = self._kalman_step
+        yaw, yaw_bias = self.yaw, self.yaw_bias
+        for i, (d, mx, my, rx, ry, rz) in enumerate(zip(
+                dt.tolist(), acc_x.tolist(), acc_y.tolist(),
+                batch[:, 4].tolist(), batch[:, 5].tolist(), batch[:, 6].tolist())):
+            out[i, 0] = step(sx, mx, rx, d)
+            out[i, 1] = step(sy, my, -ry, d)
+            # Slowly learn the yaw bias while the board is nearly still
+            if abs(rx) < 1.0 and abs(ry) < 1.0 and abs(rz) < 1.0:
+                yaw_bias += 0.01 * (rz - yaw_bias)
+            yaw += (rz - yaw_bias) * d
+            out[i, 2] = yaw
+        self.yaw, self.yaw_bias = yaw, yaw_bias
+        return out
+
+
+ALGORITHMS = {
+    'firmware': FirmwareFilter,
+    'madgwick': MadgwickFilter,
+    'mahony': MahonyFilter,
+    'kalman': KalmanFilter,
+}
+
+
+class FusionEngine:
+    """Selectable fusion algorithm fed with raw sample batches"""
+
+    def __init__(self, algorithm='madgwick', **kwargs):
+        self.filter = None
+        self.angles = (0.0, 0.0, 0.0)
+        self.select(algorithm, **kwargs)
+
+    def select(self, algorithm, **kwargs):
+        """Switch algorithm, the new filter starts from a fresh state"""
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown fusion algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.filter = ALGORITHMS[algorithm](**kwargs)
+
+    def process(self, batch):
+        """Fuse an (N, 7) raw batch, returns (N, 3) angles in degrees"""
+        batch = np.asarray(batch, dtype=np.float64)
+        if batch.ndim == 1:
+            batch = batch[None, :]
+        if not len(batch):
+            return np.empty((0, 3))
+        out = self.filter.update_batch(batch)
+        self.angles = tuple(out[-1].tolist())
+        return out
+
+    def zero_yaw(self):
+        self.filter.zero_yaw()
+
+
+def parse_raw_line(line):
+    """
+    Parse 'raw:ms,ax,ay,az,gx,gy,gz[,seq]' from the firmware.
+    Returns (row, sample): the raw row for FusionEngine.process and a Sample
+    with time, seq and rates filled in (angles are set from the fusion output).
+    """
+    parts = line[4:].split(',')
+    if len(parts) not in (7, 8):
+        raise ValueError(f"Bad raw line: {line}")
+    values = [float(p) for p in parts[:7]]
+    values[0] /= 1000.0  # ms -> s
+    seq = int(parts[7]) if len(parts) == 8 else NO_SEQ
+    sample = Sample(values[0], seq, rx=values[4], ry=values[5], rz=values[6])
+    return values, sample
+
+
+def parse_raw_batch(line):
+    """
+    Parse a batched raw frame 'rb:seq,ms0,ms1;ax,ay,az,gx,gy,gz;...' (gyro
+    rates in thousandths of a deg/s). Returns (rows, batch): the (N, 7) raw
+    rows and a SAMPLE_DTYPE array with time, seq and rates, consecutive seq
+    and times spread evenly from ms0 to ms1 as in sample.parse_batch.
+    Raises ValueError for anything else.
+    """
+    if not line.startswith(RAW_BATCH_PREFIX):
+        raise ValueError(f"Not a raw batch frame: {line}")
+    head, _, body = line[len(RAW_BATCH_PREFIX):].partition(';')
+    fields = head.split(',')
+    if len(fields) != 3 or not body:
+        raise ValueError(f"Bad raw batch frame: {line}")
+    seq, ms0, ms1 = (int(f) for f in fields)
+    values = np.array(body.replace(';', ',').split(','), dtype=np.float64)
+    if values.size % 6:
+        raise ValueError(f"Expected 6 values per sample: {line}")
+    values = values.reshape(-1, 6)
+    n = len(values)
+    rows = np.empty((n, 7))
+    rows[:, 0] = np.linspace(ms0, ms1, n) / 1000.0
+    rows[:, 1:4] = values[:, :3]
+    rows[:, 4:7] = values[:, 3:] / 1000.0
+    batch = np.zeros(n, dtype=SAMPLE_DTYPE)
+    batch['t'] = rows[:, 0]
+    batch['seq'] = seq + np.arange(n)
+    batch['rx'], batch['ry'], batch['rz'] = rows[:, 4:7].T
+    return rows, batch
+
+
+def load_raw_csv(path):
+    """Load a recorded raw session (t, ax, ay, az, gx, gy, gz per line)"""
+    return np.loadtxt(path, delimiter=',', ndmin=2, comments='#')
+
+
+def synthetic_session(seconds=60.0, rate=1000.0, seed=0):
+    """
+    Generate raw samples for a board rocking in roll and pitch while slowly
+    turning, with sensor noise and a constant gyro bias.
+    Returns (batch, truth) with truth in firmware angle order.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * rate)
+    t = np.arange(n) / rate
+    roll = 30.0 * np.sin(2 * np.pi * 0.3 * t)
+    pitch = 20.0 * np.sin(2 * np.pi * 0.17 * t + 1.0)
+    yaw = 10.0 * t
+
+    r, p = roll * DEG2RAD, pitch * DEG2RAD
+    acc = np.stack([-np.sin(p), np.sin(r) * np.cos(p), np.cos(r) * np.cos(p)], axis=1) * 8192.0
+    acc += rng.normal(0.0, 200.0, acc.shape)
+
+    # Body rates from Euler angle rates (ZYX)
+    dr, dp, dy = (np.gradient(a, t) for a in (roll, pitch, yaw))
+    gyr = np.stack([dr - np.sin(p) * dy,
+                    np.cos(r) * dp + np.sin(r) * np.cos(p) * dy,
+                    -np.sin(r) * dp + np.cos(r) * np.cos(p) * dy], axis=1)
+    gyr += rng.normal(0.0, 0.5, gyr.shape) + np.array([0.4, -0.3, 0.5])
+
+    batch = np.column_stack([t, acc, gyr])
+    truth = np.stack([roll, -pitch, yaw], axis=1)
+    return batch, truth
+
+
+def benchmark(batch, reference=None, batch_size=256, freq=None):
+    """
+    Run every algorithm over a recorded batch and report CPU cost and RMS
+    error per axis. Without a ground truth the firmware replica is used
+    as the reference.
+    """
+    if freq is None:
+        freq = 1.0 / np.median(np.diff(batch[:, 0]))
+    results = {}
+    outputs = {}
+    for name in ALGORITHMS:
+        kwargs = {'freq': freq} if name == 'firmware' else {}
+        engine = FusionEngine(name, **kwargs)
+        start = time.process_time()
+        out = np.concatenate([engine.process(batch[i:i + batch_size])
+                              for i in range(0, len(batch), batch_size)])
+        cpu = time.process_time() - start
+        outputs[name] = out
+        results[name] = {'cpu_us_per_sample': cpu / len(batch) * 1e6,
+                         'samples_per_s': len(batch) / cpu if cpu else float('inf')}
+
+    ref = reference if reference is not None else outputs['firmware']
+    skip = min(len(batch) // 10, int(2 * freq))  # let the filters settle
+    for name, out in outputs.items():
+        err = out[skip:] - ref[skip:]
+        err = (err + 180.0) % 360.0 - 180.0  # quaternion yaw wraps at +-180
+        results[name]['rms_deg'] = np.sqrt(np.mean(err * err, axis=0)).tolist()
+    return results
+
+
+if __name__ == '__main__':
+    import sys
+
+    # Usage: python sensor_fusion.py [recorded_raw.csv]
+    if len(sys.argv) > 1:
+        data = load_raw_csv(sys.argv[1])
+        truth = None
+        print(f"Recorded session: {len(data)} samples, reference = firmware filter")
+    else:
+        data, truth = synthetic_session()
+        print(f"Synthetic session: {len(data)} samples, reference = ground truth")
+
+    for name, res in benchmark(data, truth).items():
+        rms = ', '.join(f"{e:6.2f}" for e in res['rms_deg'])
+        print(f"{name:9s} {res['cpu_us_per_sample']:7.2f} us/sample "
+              f"({res['samples_per_s']:9.0f}/s)  rms gx,gy,gz: {rms}")
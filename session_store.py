@@ -0,0 +1,528 @@
+import collections
+import struct
+import time
+import zlib
+import numpy as np
+from sample import SAMPLE_DTYPE, NO_SEQ, BATCH_PREFIX, parse_angles, parse_batch, parse_pwm
+
+"""
+Chunked, compressed, time-indexed storage for long telemetry sessions
+
+A .tlm file holds Samples (see sample.py) in fixed-size chunks:
+    header      b'TLM1' + kind ('angles' or 'pwm', padded to 8 bytes)
+    chunk       <count u4><length u4> zlib(column by column SAMPLE_DTYPE data)
+    ...
+    index       one INDEX_DTYPE entry per chunk: time range, file offset and
+                min/max of every channel in the chunk
+    summaries   one SUMMARY_DTYPE entry per SUMMARY_BLOCK samples: time range
+                and min/max of every channel
+    params      one PARAMS_DTYPE entry per filter parameter change ('params:'
+                replies seen while recording)
+    footer      <index offset u8><summaries offset u8><params offset u8> b'TID2'
+Stores written before parameter events end in <index u8><summaries u8> b'TIDX'
+and are still read.
+
+Sample times are seconds since the start of the recording (host receive
+time, like the text sessions in replay.py) so they always increase.
+
+A time range query is two binary searches in the index plus decompressing
+only the chunks it overlaps; a zoomed-out overview is answered from the
+block min/max summaries alone without decompressing anything. If the program stopped before writing the index
+(crash, power loss) the index is rebuilt from the chunk headers on open.
+
+    store = SessionStore('bench.tlm')
+    minutes = store.range(42 * 60, 45 * 60)          # SAMPLE_DTYPE array
+    t, lo, hi = store.overview(0, store.duration, 800)
+"""
+
+MAGIC = b'TLM1'
+FOOTER_MAGIC = b'TID2'
+CHUNK_HEADER = struct.Struct('<II')
+FOOTER = struct.Struct('<QQQ4s')
+FOOTER_MAGIC_V1 = b'TIDX'
+FOOTER_V1 = struct.Struct('<QQ4s')
+HEADER_SIZE = 12
+CHUNK_RECORDS = 4096  # about 80 s at 50 Hz, 4 s at 1 kHz
+SUMMARY_BLOCK = 128   # samples per overview min/max entry
+
+# Channels summarised per chunk (columns of channels())
+CHANNELS = ('gx', 'gy', 'gz', 'rx', 'ry', 'rz', 'pwm1', 'pwm2', 'pwm3', 'autopilot')
+
+INDEX_DTYPE = np.dtype([
+    ('t0', 'f8'), ('t1', 'f8'),
+    ('offset', 'i8'), ('count', 'i4'), ('length', 'i4'),
+    ('min', 'f4', (len(CHANNELS),)), ('max', 'f4', (len(CHANNELS),)),
+])
+
+SUMMARY_DTYPE = np.dtype([
+    ('t0', 'f8'), ('t1', 'f8'),
+    ('min', 'f4', (len(CHANNELS),)), ('max', 'f4', (len(CHANNELS),)),
+])
+
+
+PARAMS_DTYPE = np.dtype([
+    ('t', 'f8'),
+    ('accel', 'f4'), ('gyro', 'f4'), ('comp', 'f4'),
+])
+
+
+def channels(records):
+    """(N, len(CHANNELS)) float32 view of the numeric fields of SAMPLE_DTYPE records"""
+    out = np.empty((len(records), len(CHANNELS)), dtype=np.float32)
+    for i, name in enumerate(('gx', 'gy', 'gz', 'rx', 'ry', 'rz')):
+        out[:, i] = records[name]
+    out[:, 6:9] = records['pwm']
+    out[:, 9] = records['autopilot']
+    return out
+
+
+def _pack(records):
+    # Column by column compresses far better than interleaved records; on
+    # columns level 1 is as small as level 6 and several times faster
+    return zlib.compress(b''.join(np.ascontiguousarray(records[name]).tobytes()
+                                  for name in SAMPLE_DTYPE.names), 1)
+
+
+def _unpack(payload, count):
+    data = zlib.decompress(payload)
+    records = np.empty(count, dtype=SAMPLE_DTYPE)
+    pos = 0
+    for name in SAMPLE_DTYPE.names:
+        column = records[name]
+        column[...] = np.frombuffer(data, column.dtype, column.size, pos).reshape(column.shape)
+        pos += column.nbytes
+    return records
+
+
+def _index_entry(records, offset, length):
+    values = channels(records)
+    return (records['t'][0], records['t'][-1], offset, len(records), length,
+            values.min(axis=0), values.max(axis=0))
+
+
+def pack_chunk(records):
+    """Payload, index entry (offset 0) and summaries of one chunk, for SessionWriter.write_packed"""
+    payload = _pack(records)
+    return payload, _index_entry(records, 0, len(payload)), _summaries(records)
+
+
+def monotonic(records, last_t=-np.inf):
+    """The records SessionWriter.append keeps: none earlier than one before it or last_t"""
+    t = records['t']
+    latest = np.maximum.accumulate(np.concatenate(([last_t], t)))[:-1]
+    keep = t >= latest
+    return records if keep.all() else records[keep]
+
+
+def _summaries(records):
+    """SUMMARY_DTYPE entries for every SUMMARY_BLOCK samples of a chunk"""
+    starts = np.arange(0, len(records), SUMMARY_BLOCK)
+    values = channels(records)
+    out = np.empty(len(starts), dtype=SUMMARY_DTYPE)
+    out['t0'] = records['t'][starts]
+    out['t1'] = records['t'][np.minimum(starts + SUMMARY_BLOCK, len(records)) - 1]
+    out['min'] = np.minimum.reduceat(values, starts)
+    out['max'] = np.maximum.reduceat(values, starts)
+    return out
+
+
+class SessionWriter:
+    """Appends Samples to a .tlm file, one compressed chunk every chunk_records"""
+
+    def __init__(self, path, kind='angles', chunk_records=CHUNK_RECORDS):
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC + kind.encode().ljust(HEADER_SIZE - len(MAGIC), b'\0'))
+        self.chunk_records = chunk_records
+        self.pending = np.empty(chunk_records, dtype=SAMPLE_DTYPE)
+        self.count = 0
+        self.index = []
+        self.summaries = []
+        self.params = []  # (t, accel, gyro, comp) parameter changes
+        self.last_t = -np.inf
+
+    def append(self, sample):
+        if sample.t < self.last_t:
+            return  # the time index needs increasing times
+        self.last_t = sample.t
+        self.pending[self.count] = sample.record()
+        self.count += 1
+        if self.count == self.chunk_records:
+            self.flush()
+
+    def extend(self, records):
+        """Append a SAMPLE_DTYPE array, dropping records that go back in time like append"""
+        records = monotonic(records, self.last_t)
+        pos = 0
+        while pos < len(records):
+            n = min(self.chunk_records - self.count, len(records) - pos)
+            self.pending[self.count:self.count + n] = records[pos:pos + n]
+            self.count += n
+            pos += n
+            if self.count == self.chunk_records:
+                self.flush()
+        if len(records):
+            self.last_t = records['t'][-1]
+
+    def add_params(self, t, accel, gyro, comp):
+        """Record a filter parameter change at time t"""
+        self.params.append((t, accel, gyro, comp))
+
+    def flush(self):
+        """Write the pending samples as one chunk"""
+        if not self.count:
+            return
+        records = self.pending[:self.count]
+        self.count = 0
+        self._write_chunk(*pack_chunk(records))
+
+    def write_packed(self, payload, entry, summaries):
+        """
+        Append a chunk made by pack_chunk (e.g. in a worker process) after the
+        pending samples, returns the number of samples written. The chunk's
+        times must not decrease; if it starts before the samples already
+        written, only the records append would keep are added.
+        """
+        if entry[0] < self.last_t:
+            records = monotonic(_unpack(payload, entry[3]), self.last_t)
+            self.extend(records)
+            return len(records)
+        self.flush()
+        self._write_chunk(payload, entry, summaries)
+        return entry[3]
+
+    def _write_chunk(self, payload, entry, summaries):
+        offset = self.file.tell()
+        self.file.write(CHUNK_HEADER.pack(entry[3], len(payload)))
+        self.file.write(payload)
+        self.index.append(entry[:2] + (offset,) + entry[3:])
+        self.summaries.append(summaries)
+        self.last_t = entry[1]
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        index_offset = self.file.tell()
+        self.file.write(np.array(self.index, dtype=INDEX_DTYPE).tobytes())
+        summary_offset = self.file.tell()
+        if self.summaries:
+            self.file.write(np.concatenate(self.summaries).tobytes())
+        params_offset = self.file.tell()
+        self.file.write(np.array(self.params, dtype=PARAMS_DTYPE).tobytes())
+        self.file.write(FOOTER.pack(index_offset, summary_offset, params_offset, FOOTER_MAGIC))
+        self.file.close()
+
+
+class StoreRecorder:
+    """
+    Drop-in for replay.SessionRecorder writing a .tlm store: lines are parsed
+    with `parser` and stamped with the host receive time, other lines
+    (replies, raw frames) are skipped. Batched angle frames keep the device
+    spacing between their samples, ending at the receive time.
+    """
+
+    def __init__(self, path, parser=parse_angles, clock=time.monotonic):
+        self.writer = SessionWriter(path, 'pwm' if parser is parse_pwm else 'angles')
+        self.parser = parser
+        self.clock = clock
+        self.start = clock()
+
+    def write(self, line):
+        if self.parser is parse_angles and line.startswith('params:'):
+            try:
+                accel, gyro, comp = (float(p) for p in line[7:].split(','))
+            except ValueError:
+                return
+            self.writer.add_params(self.clock() - self.start, accel, gyro, comp)
+            return
+        if self.parser is parse_angles and line.startswith(BATCH_PREFIX):
+            try:
+                batch = parse_batch(line)
+            except ValueError:
+                return
+            batch['t'] += self.clock() - self.start - batch['t'][-1]
+            np.maximum(batch['t'], self.writer.last_t, out=batch['t'])
+            self.writer.extend(batch)
+            return
+        try:
+            sample = self.parser(line)
+        except ValueError:
+            return
+        sample.t = self.clock() - self.start
+        self.writer.append(sample)
+
+    def close(self):
+        self.writer.close()
+
+
+class SessionStore:
+    """Read side of a .tlm file"""
+
+    def __init__(self, path, cache_chunks=8):
+        self.path = path
+        self.file = open(path, 'rb')
+        header = self.file.read(HEADER_SIZE)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a session store: {path}")
+        self.kind = header[len(MAGIC):].rstrip(b'\0').decode()
+        self.index, self.summaries, self.params = self._load_index()
+        self.cache = collections.OrderedDict()
+        self.cache_chunks = cache_chunks
+
+    def _load_index(self):
+        self.file.seek(0, 2)
+        size = self.file.tell()
+        no_params = np.empty(0, dtype=PARAMS_DTYPE)
+        if size >= HEADER_SIZE + FOOTER_V1.size:
+            self.file.seek(size - 4)
+            magic = self.file.read(4)
+            if magic == FOOTER_MAGIC and size >= HEADER_SIZE + FOOTER.size:
+                self.file.seek(size - FOOTER.size)
+                index_offset, summary_offset, params_offset, _ = FOOTER.unpack(self.file.read(FOOTER.size))
+                end = size - FOOTER.size
+            elif magic == FOOTER_MAGIC_V1:
+                self.file.seek(size - FOOTER_V1.size)
+                index_offset, summary_offset, _ = FOOTER_V1.unpack(self.file.read(FOOTER_V1.size))
+                end = params_offset = size - FOOTER_V1.size
+            else:
+                return self._rebuild_index(size) + (no_params,)
+            if HEADER_SIZE <= index_offset <= summary_offset <= params_offset <= end:
+                self.file.seek(index_offset)
+                index = np.frombuffer(self.file.read(summary_offset - index_offset), INDEX_DTYPE)
+                summaries = np.frombuffer(self.file.read(params_offset - summary_offset), SUMMARY_DTYPE)
+                params = np.frombuffer(self.file.read(end - params_offset), PARAMS_DTYPE)
+                return index, summaries, params
+        return self._rebuild_index(size) + (no_params,)
+
+    def _rebuild_index(self, size):
+        """Walk the chunk headers of a file that was never closed"""
+        print(f"Session store {self.path} has no index, rebuilding")
+        entries = []
+        summaries = [np.empty(0, dtype=SUMMARY_DTYPE)]
+        offset = HEADER_SIZE
+        while offset + CHUNK_HEADER.size <= size:
+            self.file.seek(offset)
+            count, length = CHUNK_HEADER.unpack(self.file.read(CHUNK_HEADER.size))
+            payload = self.file.read(length)
+            try:
+                records = _unpack(payload, count)
+            except (zlib.error, ValueError):
+                break  # truncated last chunk
+            entries.append(_index_entry(records, offset, length))
+            summaries.append(_summaries(records))
+            offset += CHUNK_HEADER.size + length
+        return np.array(entries, dtype=INDEX_DTYPE), np.concatenate(summaries)
+
+    def __len__(self):
+        return int(self.index['count'].sum())
+
+    @property
+    def start_time(self):
+        return float(self.index['t0'][0]) if len(self.index) else 0.0
+
+    @property
+    def duration(self):
+        return float(self.index['t1'][-1]) if len(self.index) else 0.0
+
+    def chunk(self, i):
+        """Decompressed records of chunk i (small LRU cache)"""
+        records = self.cache.get(i)
+        if records is not None:
+            self.cache.move_to_end(i)
+            return records
+        entry = self.index[i]
+        self.file.seek(int(entry['offset']) + CHUNK_HEADER.size)
+        records = _unpack(self.file.read(int(entry['length'])), int(entry['count']))
+        self.cache[i] = records
+        if len(self.cache) > self.cache_chunks:
+            self.cache.popitem(last=False)
+        return records
+
+    def chunks_between(self, t0, t1):
+        """Indices [first, last) of the chunks overlapping [t0, t1]"""
+        first = int(np.searchsorted(self.index['t1'], t0, 'left'))
+        last = int(np.searchsorted(self.index['t0'], t1, 'right'))
+        return first, max(first, last)
+
+    def range(self, t0, t1):
+        """All samples with t0 <= t <= t1 as a SAMPLE_DTYPE array"""
+        first, last = self.chunks_between(t0, t1)
+        if first == last:
+            return np.empty(0, dtype=SAMPLE_DTYPE)
+        records = np.concatenate([self.chunk(i) for i in range(first, last)])
+        t = records['t']
+        return records[np.searchsorted(t, t0, 'left'):np.searchsorted(t, t1, 'right')]
+
+    def overview(self, t0, t1, bins):
+        """
+        Min/max envelope of every channel over [t0, t1] in `bins` time bins.
+        Returns (bin start times, min, max), min/max shaped (bins, len(CHANNELS)),
+        nan where a bin has no data. When a bin is wider than a summary block
+        only the block summaries are read, otherwise the samples are decoded.
+        """
+        edges = np.linspace(t0, t1, bins + 1)
+        width = (t1 - t0) / bins
+        lo = np.full((bins, len(CHANNELS)), np.nan, dtype=np.float32)
+        hi = np.full((bins, len(CHANNELS)), np.nan, dtype=np.float32)
+        blocks = self.summaries
+        blocks = blocks[np.searchsorted(blocks['t1'], t0, 'left'):np.searchsorted(blocks['t0'], t1, 'right')]
+        if not len(blocks) or width <= 0:
+            return edges[:-1], lo, hi
+        if np.median(blocks['t1'] - blocks['t0']) <= width:
+            # Zoomed out: each block goes to the bin it starts in
+            t, mins, maxs = blocks['t0'], blocks['min'], blocks['max']
+        else:
+            records = self.range(t0, t1)
+            t = records['t']
+            mins = maxs = channels(records)
+        slots = np.clip(((t - t0) / width).astype(int), 0, bins - 1)
+        np.fmin.at(lo, slots, mins)
+        np.fmax.at(hi, slots, maxs)
+        return edges[:-1], lo, hi
+
+    def params_at(self, t):
+        """Filter parameters (accel, gyro, comp) in effect at time t, None if unknown"""
+        i = int(np.searchsorted(self.params['t'], t, 'right')) - 1
+        if i < 0:
+            return None
+        entry = self.params[i]
+        return float(entry['accel']), float(entry['gyro']), float(entry['comp'])
+
+    def iter_from(self, t=0.0):
+        """Yield SAMPLE_DTYPE arrays chunk by chunk starting at time t"""
+        first = int(np.searchsorted(self.index['t1'], t, 'left'))
+        for i in range(first, len(self.index)):
+            records = self.chunk(i)
+            if i == first:
+                records = records[np.searchsorted(records['t'], t, 'left'):]
+            yield records
+
+    def close(self):
+        self.file.close()
+
+
+def format_record(rec, kind='angles'):
+    """Protocol line for one stored record (used for replay)"""
+    if kind == 'pwm':
+        p1, p2, p3 = rec['pwm'].tolist()
+        return f"{p1},{p2},{p3},{rec['autopilot']}"
+    line = f"{rec['gx']:.2f}, {rec['gy']:.2f}, {rec['gz']:.2f}"
+    if rec['seq'] != NO_SEQ:
+        line += f", {rec['seq']}, {int(rec['t'] * 1000)}"
+    return line
+
+
+def format_params(event):
+    """'params:' reply for one PARAMS_DTYPE event, as the firmware prints it"""
+    return f"params:{event['accel']:.4f},{event['gyro']:.4f},{event['comp']:.4f}"
+
+
+class StoreReader:
+    """
+    SessionReader interface over a SessionStore, for ReplayTransport.
+    Parameter events come back as 'params:' lines in time order with the
+    samples; after a seek the values in effect at that time come first.
+    """
+
+    def __init__(self, path):
+        self.store = SessionStore(path)
+        self.duration = self.store.duration
+        self.records = iter(())
+        self.events = iter(())
+        self.next_record = None
+        self.next_event = None
+        self.last_time = 0.0
+
+    def seek(self, t):
+        self.records = (rec for block in self.store.iter_from(t) for rec in block)
+        params = self.store.params
+        first = max(int(np.searchsorted(params['t'], t, 'right')) - 1, 0)
+        self.events = iter(params[first:])
+        self.next_record = next(self.records, None)
+        self.next_event = next(self.events, None)
+        self.last_time = t
+
+    def read(self):
+        """Next (time, text) or None at the end of the store"""
+        rec, event = self.next_record, self.next_event
+        if event is not None and (rec is None or event['t'] <= rec['t']):
+            self.next_event = next(self.events, None)
+            self.last_time = max(float(event['t']), self.last_time)
+            return self.last_time, format_params(event)
+        if rec is None:
+            return None
+        self.next_record = next(self.records, None)
+        self.last_time = float(rec['t'])
+        return self.last_time, format_record(rec, self.store.kind)
+
+    def close(self):
+        self.store.close()
+
+
+def convert(src, dst, parser=parse_angles, interval=0.02):
+    """
+    Convert a text session (replay.py format) into a .tlm store, line by line.
+    ingest.py does the same for large files in parallel.
+    """
+    from replay import SessionReader
+    reader = SessionReader(src, interval)
+    writer = SessionWriter(dst, 'pwm' if parser is parse_pwm else 'angles')
+    while True:
+        item = reader.read()
+        if item is None:
+            break
+        t, text = item
+        if parser is parse_angles and text.startswith('params:'):
+            try:
+                writer.add_params(t, *(float(p) for p in text[7:].split(',')))
+            except (ValueError, TypeError):
+                pass
+            continue
+        try:
+            sample = parser(text)
+        except ValueError:
+            continue
+        sample.t = t
+        writer.append(sample)
+    writer.close()
+    reader.close()
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    import tempfile
+
+    # Usage: python session_store.py [session.log out.tlm]
+    if len(sys.argv) > 2:
+        start = time.perf_counter()
+        convert(sys.argv[1], sys.argv[2])
+        print(f"Converted in {time.perf_counter() - start:.1f} s: "
+              f"{os.path.getsize(sys.argv[1]) / 1e6:.1f} MB -> {os.path.getsize(sys.argv[2]) / 1e6:.1f} MB")
+        path = sys.argv[2]
+    else:
+        # Three hours of synthetic 50 Hz angles
+        path = os.path.join(tempfile.mkdtemp(), 'synthetic.tlm')
+        n = 3 * 3600 * 50
+        records = np.zeros(n, dtype=SAMPLE_DTYPE)
+        records['t'] = np.arange(n) / 50.0
+        records['seq'] = np.arange(n)
+        records['gx'] = 20 * np.sin(records['t'] * 1.3)
+        records['gy'] = 10 * np.sin(records['t'] * 0.7)
+        records['gz'] = (records['t'] * 3.0) % 360.0 - 180.0
+        writer = SessionWriter(path)
+        writer.extend(records)
+        writer.close()
+        print(f"Synthetic session: {n} samples, {os.path.getsize(path) / 1e6:.1f} MB "
+              f"({n * SAMPLE_DTYPE.itemsize / 1e6:.1f} MB uncompressed)")
+
+    store = SessionStore(path)
+    print(f"{len(store)} samples in {len(store.index)} chunks, {store.duration:.0f} s")
+    start = time.perf_counter()
+    minutes = store.range(42 * 60, 45 * 60)
+    print(f"Minutes 42-45: {len(minutes)} samples in {(time.perf_counter() - start) * 1e3:.1f} ms")
+    start = time.perf_counter()
+    t, lo, hi = store.overview(0, store.duration, 800)
+    print(f"Overview, 800 bins: {(time.perf_counter() - start) * 1e3:.1f} ms, "
+          f"gx range {np.nanmin(lo[:, 0]):.1f} .. {np.nanmax(hi[:, 0]):.1f}")
+    store.close()
@@ -0,0 +1,392 @@
+"""
+Long-run soak test with memory limits for the host clients
+
+Runs one client against the in-process device emulator with its clock
+sped up (emulator:?rate=..&speed=..), so a short run covers hours of device
+time, while a watcher thread samples the process every `interval` seconds:
+    RSS                    /proc/self/statm, or psutil when installed
+    traced Python memory   tracemalloc
+    GC tracked objects     gc.get_objects(), by type at the start and end
+The first `warmup` part of the run (fonts, GL buffers, caches), at least
+two minutes, is the baseline. The run fails (exit status 1) when, after it:
+    RSS grows by more than --max-growth MB, or traced memory by --max-traced MB
+    tracked objects grow by more than --max-objects
+    RSS passes --max-rss MB, or would pass it after --hours at the rate its
+    low-water mark rises (pools breathe in a sawtooth, a rising floor leaks)
+The report lists the allocation sites and object types that grew most.
+
+Frames are drawn at the normal render rate, only the device data is
+accelerated, so leaks per frame grow in real time and leaks per sample
+`speed` times faster. The projection uses the real-time rate, which is
+exact for the first and on the safe side for the second.
+
+    python soak.py cube --minutes 30 --speed 10   # 5 device hours of just_cube.py
+    python soak.py all --minutes 10               # every client, one process each
+Clients: cube, visualizer, viewer, compare, stabilizer, filtergui, relay.
+"""
+
+import asyncio
+import collections
+import gc
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import metrics
+
+DEFAULT_RATE = 200.0      # Hz, emulated sample rate
+DEFAULT_SPEED = 10.0      # device clock runs this many times faster than real time
+DEFAULT_INTERVAL = 10.0   # seconds between samples
+WARMUP = 0.2              # part of the run before the baseline sample
+MIN_WARMUP = 120.0        # seconds, GL driver pools take a couple of minutes to settle
+MAX_RSS_GROWTH = 32.0     # MB
+MAX_TRACED_GROWTH = 8.0   # MB
+MAX_OBJECT_GROWTH = 20000
+MAX_RSS = 512.0           # MB, hard ceiling
+PROJECT_HOURS = 8.0       # a bench day
+TOP = 10
+SKIPPED = 2               # exit status when a client cannot start here
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MB = 1024.0 * 1024.0
+
+
+def rss_bytes():
+    """Resident set size of this process, None where it cannot be read"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def count_objects(by_type=False):
+    """
+    Number of GC tracked objects (and a Counter by type name).
+    gc.get_objects() also returns tuples other threads are still building,
+    and holding them across a thread switch breaks their resize, so no other
+    thread may run until the list is dropped.
+    """
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1000.0)
+    time.sleep(0)  # threads already waiting for the GIL pick up the new interval
+    try:
+        objects = gc.get_objects()
+        count = len(objects)
+        types = collections.Counter(type(obj).__qualname__ for obj in objects) if by_type else None
+        del objects
+    finally:
+        sys.setswitchinterval(interval)
+    return count, types
+
+
+class MemoryWatch:
+    """Background sampler: RSS, traced memory and object counts over one run"""
+
+    def __init__(self, seconds, interval=DEFAULT_INTERVAL, warmup=WARMUP, frames=1):
+        self.seconds = seconds
+        self.interval = min(interval, seconds / 5.0)
+        self.warmup = min(max(warmup * seconds, MIN_WARMUP, self.interval), seconds / 2.0)
+        self.frames = frames
+        self.samples = []  # (elapsed, rss, traced, objects)
+        self.baseline = None  # index into samples
+        self.snapshots = []  # tracemalloc snapshots at the baseline and the end
+        self.types = []      # type counts at the baseline and the end
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.on_done = None  # called once the last sample is taken
+
+    def start(self, on_done=None):
+        self.on_done = on_done
+        tracemalloc.start(self.frames)
+        self.thread = threading.Thread(target=self._run, name='soak-watch', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        tracemalloc.stop()
+
+    def _sample(self, elapsed, detail):
+        gc.collect()
+        objects, types = count_objects(detail)
+        self.samples.append((elapsed, rss_bytes(), tracemalloc.get_traced_memory()[0], objects))
+        if detail:
+            self.types.append(types)
+            self.snapshots.append(tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, os.path.abspath(__file__)),  # the watcher's own samples
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+            )))
+
+    def _run(self):
+        begin = time.monotonic()
+        next_sample = begin + self.interval
+        end = begin + self.seconds
+        try:
+            while not self.stop_event.wait(max(0.0, min(next_sample, end) - time.monotonic())):
+                now = time.monotonic()
+                elapsed = now - begin
+                if now >= end:
+                    self._sample(elapsed, True)
+                    break
+                baseline = self.baseline is None and elapsed >= self.warmup
+                if baseline:
+                    self.baseline = len(self.samples)
+                self._sample(elapsed, baseline)
+                next_sample += self.interval
+        finally:
+            if self.on_done:
+                self.on_done()
+
+    def check(self, max_growth=MAX_RSS_GROWTH, max_traced=MAX_TRACED_GROWTH,
+              max_objects=MAX_OBJECT_GROWTH, max_rss=MAX_RSS, hours=PROJECT_HOURS):
+        """Print the report, returns the list of exceeded limits"""
+        if self.baseline is None or len(self.snapshots) < 2:
+            return ["run ended before the baseline sample"]
+        print(f"{'time':>8} {'RSS MB':>8} {'traced MB':>10} {'objects':>9}")
+        for i, (elapsed, rss, traced, objects) in enumerate(self.samples):
+            mark = '  <- baseline' if i == self.baseline else ''
+            rss_text = f"{rss / MB:8.1f}" if rss is not None else f"{'-':>8}"
+            print(f"{elapsed:7.0f}s {rss_text} {traced / MB:10.2f} {objects:9d}{mark}")
+
+        first, last = self.samples[self.baseline], self.samples[-1]
+        failures = []
+        traced_growth = (last[2] - first[2]) / MB
+        object_growth = last[3] - first[3]
+        if traced_growth > max_traced:
+            failures.append(f"traced memory grew {traced_growth:.2f} MB (limit {max_traced} MB)")
+        if object_growth > max_objects:
+            failures.append(f"tracked objects grew by {object_growth} (limit {max_objects})")
+        if last[1] is not None:
+            rss_growth = (last[1] - first[1]) / MB
+            peak = max(s[1] for s in self.samples) / MB
+            # Trend of the low-water mark: allocator and GL driver pools grow
+            # and shrink in a sawtooth, only a rising floor is a leak
+            after = self.samples[self.baseline:]
+            half = len(after) // 2
+            rate = 0.0
+            if half:
+                floor_growth = min(s[1] for s in after[half:]) - min(s[1] for s in after[:half])
+                rate = floor_growth / ((after[-1][0] - after[0][0]) / 2.0) * 3600.0 / MB
+            projected = first[1] / MB + rate * hours
+            print(f"RSS growth {rss_growth:+.1f} MB, trend {rate:+.1f} MB/h, "
+                  f"{projected:.0f} MB projected after {hours:g} h, peak {peak:.1f} MB")
+            if rss_growth > max_growth:
+                failures.append(f"RSS grew {rss_growth:.1f} MB (limit {max_growth} MB)")
+            if peak > max_rss:
+                failures.append(f"RSS peaked at {peak:.0f} MB (ceiling {max_rss} MB)")
+            elif projected > max_rss:
+                failures.append(f"RSS would reach {projected:.0f} MB after {hours:g} h (ceiling {max_rss} MB)")
+
+        print("Top allocation growth since the baseline:")
+        for stat in self.snapshots[1].compare_to(self.snapshots[0], 'lineno')[:TOP]:
+            if stat.size_diff > 0:
+                print(f"  {stat.size_diff / 1024:+9.1f} KiB {stat.count_diff:+7d}  {stat.traceback}")
+        growth = self.types[1] - self.types[0]
+        if growth:
+            print("Object types that grew: " + ", ".join(f"{name} +{n}" for name, n in growth.most_common(TOP)))
+        return failures
+
+
+# --- clients ---------------------------------------------------------------
+# Each returns (run, stop): run() drives the client in this (main) thread
+# until stop() is called from the watcher thread.
+
+def _post_quit():
+    import pygame
+    pygame.event.post(pygame.event.Event(pygame.QUIT))
+
+
+def _cube(url):
+    import just_cube
+    sys.argv = ['just_cube.py', url]
+
+    def run():
+        try:
+            just_cube.main()
+        except SystemExit:
+            pass
+    return run, _post_quit
+
+
+def _compare(url):
+    import compare_filters
+    sys.argv = ['compare_filters.py', url]
+    return compare_filters.main, _post_quit
+
+
+def _visualizer(url):
+    sys.path.insert(0, os.path.join(HERE, 'no_program_crash_cube_code'))
+    from cube_visualizer import CubeVisualizer
+    cube = CubeVisualizer(url=url)
+
+    def stop():
+        cube.running = False
+    return cube.run, stop
+
+
+def _viewer(url):
+    sys.path.insert(0, os.path.join(HERE, 'Cube_and_GUI'))
+    from cube_viewer import CubeViewer
+    viewer = CubeViewer(url=url)
+    return viewer.run, viewer.stop
+
+
+def _stabilizer(url):
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QTimer
+    import Main_1
+    app = QApplication(['Main_1.py'])
+    gui = Main_1.StabilizerGUI(url)
+    stopping = threading.Event()
+    timer = QTimer()
+    timer.timeout.connect(lambda: stopping.is_set() and gui.close())  # Qt calls stay on its thread
+
+    def run():
+        gui.show()
+        timer.start(100)
+        app.exec_()
+    return run, stopping.set
+
+
+def _filtergui(url):
+    import tkinter as tk
+    sys.path.insert(0, os.path.join(HERE, 'Cube_and_GUI'))
+    import GUI
+    GUI.ESP32_URL = url
+    root = tk.Tk()
+    app = GUI.FilterGUI(root)
+    stopping = threading.Event()
+
+    def poll():
+        if stopping.is_set():
+            root.destroy()
+        else:
+            root.after(100, poll)
+
+    def run():
+        app.tabs.select(app.servo_tab)  # starts the PWM stream
+        root.after(100, poll)
+        root.mainloop()
+        if app.client:
+            app.client.close()
+    return run, stopping.set
+
+
+def _relay(url, subscribers=20):
+    from relay import Relay
+    stopping = threading.Event()
+
+    async def subscriber(port, lifetime):
+        """Read for `lifetime` seconds, then reconnect (subscriber churn)"""
+        while not stopping.is_set():
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            deadline = time.monotonic() + lifetime
+            while time.monotonic() < deadline and not stopping.is_set():
+                try:
+                    await asyncio.wait_for(reader.read(65536), 0.5)
+                except asyncio.TimeoutError:
+                    pass
+            writer.close()
+
+    async def main():
+        relay = Relay(url, host='127.0.0.1', port=0, start_commands=['startCubeStream'])
+        await relay.start()
+        clients = [asyncio.ensure_future(subscriber(relay.port, 1.0 + i % 5 * 10.0)) for i in range(subscribers)]
+        while not stopping.is_set():
+            await asyncio.sleep(0.1)
+        await asyncio.gather(*clients, return_exceptions=True)
+        await relay.stop()
+
+    return lambda: asyncio.run(main()), stopping.set
+
+
+CLIENTS = {
+    'cube': _cube,
+    'visualizer': _visualizer,
+    'viewer': _viewer,
+    'compare': _compare,
+    'stabilizer': _stabilizer,
+    'filtergui': _filtergui,
+    'relay': _relay,
+}
+
+
+def _work_done():
+    """Frames and samples counted in the metrics registry"""
+    totals = collections.Counter()
+    for (name, _), metric in list(metrics.REGISTRY.metrics.items()):
+        if name in ('render_frames_total', 'samples_total', 'link_lines_total'):
+            totals[name] += metric.value
+    return ", ".join(f"{name} {int(value)}" for name, value in sorted(totals.items()))
+
+
+def soak(client, seconds, rate=DEFAULT_RATE, speed=DEFAULT_SPEED, interval=DEFAULT_INTERVAL, **limits):
+    """Run one client in this process, returns the exceeded limits (None if it cannot run here)"""
+    url = f"emulator:?rate={rate:g}&speed={speed:g}"
+    try:
+        run, stop = CLIENTS[client](url)
+    except Exception as e:  # missing toolkit or no display
+        print(f"{client}: cannot run here ({type(e).__name__}: {e})")
+        return None
+    watch = MemoryWatch(seconds, interval)
+    watch.start(on_done=stop)
+    begin = time.monotonic()
+    try:
+        run()
+        ended_early = watch.thread.is_alive()  # closed or failed before the watcher stopped it
+    finally:
+        watch.stop()
+    elapsed = time.monotonic() - begin
+    print(f"{client}: {elapsed:.0f} s, {elapsed * speed / 3600.0:.1f} device hours at {rate:g} Hz "
+          f"({_work_done()})")
+    if ended_early:
+        return [f"client exited after {elapsed:.0f} s, before the end of the run"]
+    return watch.check(**limits)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Soak test a client with memory limits")
+    parser.add_argument('client', choices=sorted(CLIENTS) + ['all'])
+    parser.add_argument('--minutes', type=float, default=30.0, help="real run time per client")
+    parser.add_argument('--speed', type=float, default=DEFAULT_SPEED, help="device clock speed-up")
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help="emulated sample rate, Hz")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help="seconds between samples")
+    parser.add_argument('--max-growth', type=float, default=MAX_RSS_GROWTH, help="RSS growth limit, MB")
+    parser.add_argument('--max-traced', type=float, default=MAX_TRACED_GROWTH, help="traced growth limit, MB")
+    parser.add_argument('--max-objects', type=int, default=MAX_OBJECT_GROWTH, help="object growth limit")
+    parser.add_argument('--max-rss', type=float, default=MAX_RSS, help="RSS ceiling, MB")
+    parser.add_argument('--hours', type=float, default=PROJECT_HOURS, help="projection horizon")
+    args = parser.parse_args()
+
+    if args.client == 'all':
+        # Each client in a fresh process, so one's memory cannot hide another's
+        results = {}
+        for client in CLIENTS:
+            argv = [sys.executable, os.path.abspath(__file__), client] + sys.argv[2:]
+            results[client] = subprocess.call(argv)
+        labels = {0: 'pass', SKIPPED: 'skipped'}
+        print("\n" + "  ".join(f"{client}: {labels.get(code, 'FAIL')}" for client, code in results.items()))
+        sys.exit(1 if any(code not in labels for code in results.values()) else 0)
+
+    failures = soak(args.client, args.minutes * 60.0, args.rate, args.speed, args.interval,
+                    max_growth=args.max_growth, max_traced=args.max_traced,
+                    max_objects=args.max_objects, max_rss=args.max_rss, hours=args.hours)
+    if failures is None:
+        sys.exit(SKIPPED)
+    for failure in failures:
+        print(f"FAIL {args.client}: {failure}")
+    if not failures:
+        print(f"PASS {args.client}")
+    sys.exit(1 if failures else 0)
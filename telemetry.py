@@ -0,0 +1,133 @@
+import math
+import time
+import metrics
+from sample import Sample, NO_SEQ
+
+"""
+Telemetry sequence tracking and stale-data policy
+
+Angle frames from the firmware carry a sample sequence counter and the
+device time in milliseconds after the angles:
+    serial '.' reply     gx, gy, gz, seq, ms
+    WiFi cube stream     gx,gy,seq,ms
+    serial batch stream  b:seq,ms0,ms1;gx,gy,gz;...  (consecutive seq)
+Frames are parsed into Samples (sample.py). Older firmware without the two
+trailing fields gives samples without seq, for which only the staleness
+check applies.
+
+TelemetryMonitor classifies each frame (new, gap, duplicate, reordered,
+device reset), keeps loss statistics in the metrics registry and tells the
+UI when the last good value is older than the staleness threshold.
+
+seq counts firmware loops, not replies: a polled '.' or 'r' reply carries
+whatever sample the board is on, so the samples between two polls are
+skipped, not lost. Only pushed frames (the batch and cube streams) count
+towards loss; pass polled=True for poll replies.
+"""
+
+SEQ_MODULUS = 2 ** 32  # firmware uses an unsigned long counter
+DEFAULT_STALE_AFTER = 0.5  # seconds without a good frame before data is stale
+
+# Frame classifications returned by TelemetryMonitor.update()
+NEW = 'new'
+GAP = 'gap'
+DUPLICATE = 'duplicate'
+REORDERED = 'reordered'
+RESET = 'reset'
+
+
+class TelemetryMonitor:
+    def __init__(self, stale_after=DEFAULT_STALE_AFTER, name='device',
+                 reorder_window=64, modulus=SEQ_MODULUS, clock=time.monotonic):
+        self.stale_after = stale_after
+        self.reorder_window = reorder_window
+        self.modulus = modulus
+        self.clock = clock
+        self.last_seq = None
+        self.last_device_time = None
+        self.last_good_time = None
+        self.last_polled = False
+        self.largest_gap = 0
+
+        self.received = metrics.counter('frames_received_total', 'Telemetry frames accepted', link=name)
+        self.lost = metrics.counter('frames_lost_total', 'Frames missing from the sequence', link=name)
+        self.skipped = metrics.counter('frames_skipped_total', 'Samples between polled frames (not loss)',
+                                       link=name)
+        self.duplicates = metrics.counter('frames_duplicate_total', 'Repeated frames ignored', link=name)
+        self.reordered = metrics.counter('frames_reordered_total', 'Out of order frames ignored', link=name)
+        self.resets = metrics.counter('device_resets_total', 'Sequence restarts (device reboot)', link=name)
+        self.data_age = metrics.gauge('data_age_seconds', 'Age of the last good frame', link=name)
+
+    def update(self, sample, polled=False):
+        """
+        Classify a Sample; the caller should only apply NEW, GAP and RESET frames.
+        polled marks a reply to a data request, whose seq gaps are not loss.
+        """
+        status = NEW
+        seq = sample.seq
+        device_time = None if math.isnan(sample.t) else sample.t
+        if seq != NO_SEQ:
+            if self.last_seq is not None:
+                delta = (seq - self.last_seq) % self.modulus
+                backwards = self.modulus - delta
+                if delta == 0:
+                    self.duplicates.inc()
+                    return DUPLICATE
+                if delta >= self.modulus // 2:
+                    # Going backwards: a late frame, or the device restarted
+                    clock_reset = (device_time is not None and self.last_device_time is not None
+                                   and device_time < self.last_device_time - 1.0)
+                    if backwards <= self.reorder_window and not clock_reset:
+                        self.reordered.inc()
+                        return REORDERED
+                    self.resets.inc()
+                    status = RESET
+                elif delta > 1:
+                    if polled or self.last_polled:
+                        self.skipped.inc(delta - 1)
+                    else:
+                        self.lost.inc(delta - 1)
+                        self.largest_gap = max(self.largest_gap, delta - 1)
+                        status = GAP
+            self.last_seq = seq
+            self.last_device_time = device_time
+            self.last_polled = polled
+
+        self.received.inc()
+        self.last_good_time = self.clock()
+        return status
+
+    def update_batch(self, batch):
+        """
+        Classify a pushed batched frame (SAMPLE_DTYPE array with consecutive
+        seq) by its first sample, then account for the rest in one step
+        """
+        status = self.update(Sample.from_record(batch[0]))
+        if status in (DUPLICATE, REORDERED) or len(batch) == 1:
+            return status
+        self.last_seq = int(batch['seq'][-1]) % self.modulus
+        self.last_device_time = float(batch['t'][-1])
+        self.received.inc(len(batch) - 1)
+        return status
+
+    def age(self):
+        """Seconds since the last good frame (inf if none yet)"""
+        if self.last_good_time is None:
+            return float('inf')
+        age = self.clock() - self.last_good_time
+        self.data_age.set(age)
+        return age
+
+    def is_stale(self):
+        return self.age() > self.stale_after
+
+    def loss_ratio(self):
+        total = self.received.value + self.lost.value
+        return self.lost.value / total if total else 0.0
+
+    def summary(self):
+        return (f"received {self.received.value}, lost {self.lost.value} "
+                f"({self.loss_ratio() * 100:.2f}%), largest gap {self.largest_gap}, "
+                f"skipped between polls {self.skipped.value}, "
+                f"duplicates {self.duplicates.value}, reordered {self.reordered.value}, "
+                f"resets {self.resets.value}")
@@ -0,0 +1,104 @@
+import numpy as np
+
+from decimation import DisplayDecimator, Strip, envelope
+from render_loop import FramePacer
+from sample import SAMPLE_DTYPE, SampleBuffer
+
+
+def batch(times, gx=0.0, gy=0.0, gz=0.0):
+    out = np.zeros(len(times), dtype=SAMPLE_DTYPE)
+    out['t'] = times
+    out['seq'] = np.arange(len(times))
+    out['gx'], out['gy'], out['gz'] = gx, gy, gz
+    return out
+
+
+def test_envelope_bins():
+    t = np.array([0.00, 0.05, 0.09, 0.10, 0.25, 0.29])
+    values = np.array([[1.0], [5.0], [2.0], [-3.0], [4.0], [0.5]])
+    ids, lo, hi, last = envelope(t, values, 10.0)
+    assert ids.tolist() == [0, 1, 2]
+    assert lo[:, 0].tolist() == [1.0, -3.0, 0.5]
+    assert hi[:, 0].tolist() == [5.0, -3.0, 4.0]
+    assert last[:, 0].tolist() == [2.0, -3.0, 0.5]
+
+
+def test_bins_close_across_pushes():
+    sink = SampleBuffer(100)
+    stage = DisplayDecimator(rate=10.0, window=1.0, sink=sink)
+    stage.push(batch([0.00, 0.05], gx=[1.0, 2.0]))
+    stage.push(batch([0.08], gx=[-1.0]))  # same bin, still open
+    assert stage.count == 0
+    stage.push(batch([0.12], gx=[7.0]))   # closes bin 0
+    assert stage.count == 1
+    t, lo, hi, last = stage.history()
+    assert np.allclose(t, [0.0, 0.1])
+    assert lo[:, 0].tolist() == [-1.0, 7.0]
+    assert hi[:, 0].tolist() == [2.0, 7.0]
+    assert last[:, 0].tolist() == [-1.0, 7.0]
+    assert len(sink) == 4 and stage.samples == 4
+
+
+def test_ring_wraps_to_newest_bins():
+    stage = DisplayDecimator(rate=10.0, window=0.5)  # 5 bins
+    for k in range(12):
+        stage.push(batch([k / 10.0 + 0.01], gx=[float(k)]))
+    t, _, _, last = stage.history()
+    assert len(t) == stage.bins == 5
+    assert np.allclose(t, [0.7, 0.8, 0.9, 1.0, 1.1])
+    assert last[:, 0].tolist() == [7.0, 8.0, 9.0, 10.0, 11.0]
+
+
+def test_clock_reset_clears_history():
+    stage = DisplayDecimator(rate=10.0, window=1.0)
+    stage.push(batch(np.arange(0, 0.5, 0.01)))
+    version = stage.version
+    stage.push(batch([0.02, 0.03], gx=[4.0, 5.0]))  # board reset, time starts over
+    t, lo, hi, _ = stage.history()
+    assert stage.version != version
+    assert np.allclose(t, [0.0])
+    assert lo[0, 0] == 4.0 and hi[0, 0] == 5.0
+
+
+def test_single_sample_spike_survives():
+    n = 5000
+    data = batch(np.arange(n) / 5000.0)
+    data['gy'][1234] = 85.0
+    stage = DisplayDecimator(rate=30.0, window=10.0)
+    for start in range(0, n, 83):
+        stage.push(data[start:start + 83])
+    _, lo, hi, _ = stage.history()
+    assert hi[:, 1].max() == 85.0
+    assert lo[:, 1].min() == 0.0
+    assert len(lo) == 30  # one second of 30 Hz bins, not 5000 samples
+
+
+def test_strip_draws_one_line_per_bin_and_channel():
+    stage = DisplayDecimator(rate=10.0, window=1.0)
+    strip = Strip(stage, (0, 0, 100, 60), span=90.0)
+    assert strip.update() == 0
+    stage.push(batch([0.01, 0.02, 0.11, 0.21], gx=[-90.0, 90.0, 0.0, 200.0]))
+    assert strip.update() == 3 * 3 * 2
+    lines = strip.vertices[:strip.size].reshape(3, 3, 2, 2)
+    # Oldest bin first, newest at the right edge
+    assert lines[0, 0, 0, 0] == 70.0 and lines[-1, 0, 0, 0] == 90.0
+    assert lines[0, 0, 0, 1] == 0.0 and lines[0, 0, 1, 1] == 60.0  # -span..span fills the height
+    assert lines[-1, 0, 0, 1] == 60.0                                 # clipped to span
+    assert lines[1, 1, 1, 1] - lines[1, 1, 0, 1] >= 1.0              # flat bins stay visible
+
+
+def test_constant_input_lets_the_pacer_idle():
+    now = [0.0]
+    pacer = FramePacer(clock=lambda: now[0])
+    stage = DisplayDecimator(rate=30.0, window=1.0)
+    drawn = []
+    for tick in range(300):  # 5 s of 60 Hz ticks with 1 kHz samples
+        t = tick / 60.0 + np.arange(16) / 1000.0
+        stage.push(batch(t, gx=12.0, gy=-3.0, gz=45.0))
+        drawn.append(pacer.update(12.0, -3.0, 45.0, stage.version))
+        now[0] += 1 / 60.0
+    assert not any(drawn[120:])  # nothing new once the strip is full
+    assert pacer.idle
+
+    stage.push(batch([5.0], gx=20.0, gy=-3.0, gz=45.0))  # a real change redraws
+    assert pacer.update(12.0, -3.0, 45.0, stage.version)
@@ -0,0 +1,78 @@
+import numpy as np
+
+import filter_response
+from filter_response import ResponseCache, SLIDER_VALUES, frequency_response, responses
+from sensor_fusion import FilterBank
+
+PARAMS = (0.3, 0.08, 0.7)
+RATE = 200.0
+
+
+def raw_rows(angles, t0, rate):
+    """Raw rows of a board tilted by angles (deg) about x, gyro as the per sample turn"""
+    rows = np.zeros((len(angles), 7))
+    rows[:, 0] = t0 + np.arange(1, len(angles) + 1) / rate
+    rows[:, 2] = 8192.0 * np.sin(np.radians(angles))
+    rows[:, 3] = 8192.0 * np.cos(np.radians(angles))
+    rows[:, 4] = np.diff(np.r_[0.0, angles]) * rate
+    return rows
+
+
+def settled_bank():
+    bank = FilterBank([PARAMS], freq=RATE)
+    level = raw_rows(np.zeros(int(10 * RATE)), -10.0, RATE)
+    bank.update_batch(level)  # settle the accel EMA on the level board first
+    return bank
+
+
+def test_step_matches_filter_bank():
+    r = responses([PARAMS], RATE)[0]
+    simulated = settled_bank().update_batch(raw_rows(np.ones(len(r.t)), 0.0, RATE))[:, 0, 0]
+    assert np.max(np.abs(simulated - r.step)) < 1e-4
+
+
+def test_frequency_response_matches_filter_bank():
+    for freq in (0.5, 4.0, 25.0):
+        periods = max(4, int(freq * 4))
+        n = int(round(periods * RATE / freq))
+        k = np.arange(n)
+        truth = np.sin(2 * np.pi * freq * k / RATE)  # 1 degree, small angle
+        out = settled_bank().update_batch(raw_rows(np.r_[truth, truth], 0.0, RATE))[n:, 0, 0]
+        # Steady state amplitude and phase over whole periods of the second half
+        phasor = 2.0 * np.mean(out * np.exp(-2j * np.pi * freq * (k + n) / RATE)) * 1j
+        expected = frequency_response([PARAMS], RATE, [freq])[0, 0]
+        assert abs(phasor - expected) < 1e-4
+
+
+def test_sweep_fills_the_cache(monkeypatch):
+    calls = []
+    original = filter_response.responses
+    monkeypatch.setattr(filter_response, 'responses',
+                        lambda params, rate: calls.append(len(params)) or original(params, rate))
+    cache = ResponseCache()
+    cache.sweep('gyro_filter', PARAMS, 50.0)
+    assert calls == [len(SLIDER_VALUES)]
+    assert len(cache.entries) == len(SLIDER_VALUES)
+
+    first = cache.get((0.3, 0.42, 0.7), 50.0)  # a slider position: hit
+    assert cache.get((0.30001, 0.42, 0.7), 50.0) is first  # same at the GUI's 4 decimals
+    cache.sweep('gyro_filter', PARAMS, 50.0)
+    assert calls == [len(SLIDER_VALUES)]
+
+    cache.get((0.3, 0.425, 0.7), 50.0)    # between positions: miss
+    cache.get((0.3, 0.42, 0.7), 100.0)    # other rate: miss
+    assert calls == [len(SLIDER_VALUES), 1, 1]
+    cache.sweep('comp_filter', PARAMS, 50.0)  # (0.3, 0.08, 0.7) is already there
+    assert calls[-1] == len(SLIDER_VALUES) - 1
+
+
+def test_cache_evicts_oldest():
+    cache = ResponseCache(maxsize=3)
+    kept = cache.get((0.1, 0.08, 0.7), 50.0)
+    for a in (0.2, 0.3):
+        cache.get((a, 0.08, 0.7), 50.0)
+    cache.get((0.1, 0.08, 0.7), 50.0)  # used again, now the newest
+    cache.get((0.4, 0.08, 0.7), 50.0)
+    assert len(cache.entries) == 3
+    assert ResponseCache.key((0.2, 0.08, 0.7), 50.0) not in cache.entries
+    assert cache.get((0.1, 0.08, 0.7), 50.0) is kept
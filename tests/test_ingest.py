@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from ingest import ingest, parse_block, split_blocks, synthetic_dump
+from sample import NO_SEQ, parse_angles
+from session_store import SessionStore, convert
+
+
+def stored(path):
+    store = SessionStore(path)
+    records = store.range(-np.inf, np.inf)
+    params = store.params.copy()
+    store.close()
+    return records, params
+
+
+def assert_same_as_convert(src, tmp_path, **kwargs):
+    convert(src, str(tmp_path / 'reference.tlm'))
+    samples, events, _ = ingest(src, str(tmp_path / 'ingest.tlm'), **kwargs)
+    expected, expected_params = stored(str(tmp_path / 'reference.tlm'))
+    records, params = stored(str(tmp_path / 'ingest.tlm'))
+    assert samples == len(expected)
+    assert events == len(expected_params)
+    assert np.array_equal(records, expected)
+    assert np.array_equal(params, expected_params)
+    return records
+
+
+def test_blocks_end_at_line_boundaries(tmp_path):
+    path = tmp_path / 'dump.log'
+    lines = [f"{i}.5, -{i}.25, 0.{i}\n" for i in range(200)]
+    path.write_text(''.join(lines))
+    data = path.read_bytes()
+    blocks = split_blocks(str(path), block_size=97)
+    assert len(blocks) > 5
+    assert blocks[0][0] == 0 and blocks[-1][1] == len(data)
+    for (start, end, first_line), following in zip(blocks, blocks[1:] + [None]):
+        assert data[end - 1:end] == b'\n'
+        assert data[:start].count(b'\n') == first_line
+        if following:
+            assert following[0] == end
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_ingest_matches_convert(tmp_path, workers):
+    src = str(tmp_path / 'dump.log')
+    synthetic_dump(src, lines=30000)
+    records = assert_same_as_convert(src, tmp_path, workers=workers, block_size=64 << 10,
+                                     chunk_records=1000)
+    assert len(records) > 29000
+
+
+def test_time_regression_matches_convert(tmp_path):
+    # Timestamped capture where the board reset mid-way: times restart at 0,
+    # inside a block and across a block boundary
+    src = tmp_path / 'reset.log'
+    times = np.r_[np.arange(0, 20, 0.02), np.arange(0, 30, 0.02), np.arange(5, 10, 0.02)]
+    lines = [f"{t:.3f}\t{t % 7:.2f}, {-t % 5:.2f}, {t % 3:.2f}, {i}, {int(t * 1000)}\n"
+             for i, t in enumerate(times)]
+    lines.insert(1200, f"{times[1200]:.3f}\tparams:0.3000,0.0800,0.7000\n")
+    src.write_text(''.join(lines))
+    records = assert_same_as_convert(str(src), tmp_path, workers=1, block_size=16 << 10,
+                                     chunk_records=256)
+    assert (np.diff(records['t']) >= 0).all()
+    store = SessionStore(str(tmp_path / 'ingest.tlm'))
+    assert len(store.range(19.0, 21.0)) == len(records[(records['t'] >= 19.0) & (records['t'] <= 21.0)])
+    store.close()
+
+
+def test_parse_block_fast_path_and_fallback():
+    clean = (b"1.00, 2.00, 3.00\r\n"
+             b"params:0.3000,0.0800,0.7000\n"
+             b"-4.50, 5.25, -6.00, 17, 340\r\n"
+             b"MPU6050 connection lost\n")
+    records, params, skipped = parse_block(clean, first_line=10, interval=0.5)
+    assert records['gx'].tolist() == [1.0, -4.5]
+    assert records['seq'].tolist() == [NO_SEQ, 17]
+    assert records['t'].tolist() == [5.0, 6.0]  # line number x interval
+    assert params == [(5.5, 0.3, 0.08, 0.7)]
+    assert skipped == 1
+
+    # A line the byte scan accepts but the number conversion does not ('1-2')
+    # sends the block to parse_angles line by line
+    messy = b"1.00, 2.00, 3.00\n1-2, 3.00, 4.00\n7.00, 8.00, 9.00, 3, 60\n"
+    records, params, skipped = parse_block(messy)
+    expected = []
+    for line in messy.decode().splitlines():
+        try:
+            expected.append(parse_angles(line).angles)
+        except ValueError:
+            pass
+    assert [tuple(r) for r in records[['gx', 'gy', 'gz']].tolist()] == expected
+    assert skipped == 1 and params == []
@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+import pytest
+
+import mesh
+from mesh import (STL_DTYPE, Model, build_lods, decimate, load_model, load_obj, load_stl,
+                  normalize, synthetic_stl, weld)
+
+# Tetrahedron with one vertex per axis
+TETRA = np.array([
+    [[0, 0, 0], [1, 0, 0], [0, 1, 0]],
+    [[0, 0, 0], [0, 0, 1], [1, 0, 0]],
+    [[0, 0, 0], [0, 1, 0], [0, 0, 1]],
+    [[1, 0, 0], [0, 0, 1], [0, 1, 0]],
+], dtype=np.float32)
+
+
+def write_binary_stl(path, triangles):
+    records = np.zeros(len(triangles), dtype=STL_DTYPE)
+    records['vertices'] = triangles
+    with open(path, 'wb') as f:
+        f.write(b'solid but binary'.ljust(80, b'\0'))
+        f.write(np.uint32(len(triangles)).tobytes())
+        f.write(records.tobytes())
+
+
+def write_ascii_stl(path, triangles):
+    with open(path, 'w') as f:
+        f.write("solid tetra\n")
+        for tri in triangles:
+            f.write("  facet normal 0 0 0\n    outer loop\n")
+            for x, y, z in tri:
+                f.write(f"      vertex {x:e} {y:e} {z:e}\n")
+            f.write("    endloop\n  endfacet\n")
+        f.write("endsolid tetra\n")
+
+
+def test_binary_and_ascii_stl(tmp_path):
+    write_binary_stl(tmp_path / 'b.stl', TETRA)
+    write_ascii_stl(tmp_path / 'a.stl', TETRA)
+    assert np.array_equal(load_stl(str(tmp_path / 'b.stl')), TETRA)
+    assert np.array_equal(load_stl(str(tmp_path / 'a.stl')), TETRA)
+    (tmp_path / 'bad.stl').write_text("solid nothing\nendsolid\n")
+    with pytest.raises(ValueError):
+        load_stl(str(tmp_path / 'bad.stl'))
+
+
+def test_obj_polygons_and_indices(tmp_path):
+    path = tmp_path / 'quad.obj'
+    path.write_text("# unit square and a triangle\n"
+                    "v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\nv 0 0 1\n"
+                    "vn 0 0 1\n"
+                    "f 1/1/1 2/2/1 3/3/1 4/4/1\n"
+                    "f -5 -4 -1\n")
+    triangles = load_obj(str(path))
+    assert triangles.shape == (3, 3, 3)
+    # Grouped by polygon size, so compared as a set
+    assert sorted(map(str, triangles.astype(int).tolist())) == sorted(map(str, [
+        [[0, 0, 0], [1, 0, 0], [1, 1, 0]],  # fan of the quad
+        [[0, 0, 0], [1, 1, 0], [0, 1, 0]],
+        [[0, 0, 0], [1, 0, 0], [0, 0, 1]],  # negative indices
+    ]))
+
+
+def test_weld_shares_vertices():
+    vertices, faces = weld(TETRA)
+    assert len(vertices) == 4
+    assert faces.shape == (4, 3)
+    assert np.array_equal(vertices[faces], TETRA)
+
+
+def test_normalize_centres_and_turns_z_up():
+    vertices = np.array([[0, 0, 0], [4, 2, 10]], dtype=np.float32)
+    out = normalize(vertices)
+    assert np.allclose(out.max(axis=0) - out.min(axis=0), [0.8, 2.0, 0.4])
+    assert np.allclose(out.min(axis=0) + out.max(axis=0), 0.0)
+    assert out[1, 1] > out[0, 1]  # +Z became +Y
+
+
+def test_decimate_merges_to_target(tmp_path):
+    synthetic_stl(str(tmp_path / 'torus.stl'), segments=40)
+    vertices, faces = weld(load_stl(str(tmp_path / 'torus.stl')))
+    merged, remapped = decimate(vertices, faces, 800)
+    assert 0 < len(remapped) <= 800
+    assert remapped.max() < len(merged)
+    a, b, c = remapped.T
+    assert ((a != b) & (b != c) & (a != c)).all()  # no collapsed triangles
+    assert len(np.unique(np.sort(remapped, axis=1), axis=0)) == len(remapped)
+    assert (merged.min(axis=0) >= vertices.min(axis=0) - 1e-5).all()
+    assert (merged.max(axis=0) <= vertices.max(axis=0) + 1e-5).all()
+
+
+def test_lod_triangle_counts(tmp_path):
+    synthetic_stl(str(tmp_path / 'torus.stl'), segments=100)  # 20000 triangles
+    lods = build_lods(load_stl(str(tmp_path / 'torus.stl')))
+    counts = [len(lod) // 3 for lod in lods]
+    assert counts[0] == 20000
+    assert 2 <= len(lods) <= mesh.MAX_LODS
+    for coarse, fine in zip(counts[1:], counts):
+        assert coarse <= fine // 4
+    assert counts[-1] // 4 < mesh.MIN_LOD_TRIANGLES or len(lods) == mesh.MAX_LODS
+
+    model = Model(lods)
+    assert model.lod_for(10 ** 6) == 0
+    assert model.lod_for(counts[1]) == 1
+    assert model.lod_for(0) == len(lods) - 1
+    for _ in range(mesh.SLOW_FRAMES):
+        model.adapt(1.0)
+    assert model.lod_for(10 ** 6) == 1
+
+
+def test_cache_follows_the_source_file(tmp_path, monkeypatch):
+    path = str(tmp_path / 'tetra.stl')
+    write_binary_stl(path, TETRA)
+    first = load_model(path)
+    assert os.path.exists(path + '.meshcache.npz')
+
+    parsed = []
+    original = mesh.load_stl
+    monkeypatch.setattr(mesh, 'load_stl', lambda p: parsed.append(p) or original(p))
+    cached = load_model(path)
+    assert parsed == []
+    assert np.array_equal(cached.lods[0], first.lods[0])
+
+    write_binary_stl(path, TETRA[:2] * 2.0)  # the model was edited
+    edited = load_model(path)
+    assert parsed == [path]
+    assert edited.triangles() == 2
+    assert load_model(path).triangles() == 2 and parsed == [path]  # cached again
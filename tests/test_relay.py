@@ -0,0 +1,92 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+from relay import DOWNSAMPLE, DROP_OLDEST, Relay, Subscriber
+from transport import EmulatorTransport
+
+SUBSCRIBERS = 40
+MAX_QUEUE = 32
+
+
+def test_offer_policies_keep_queue_bounded():
+    for policy in (DROP_OLDEST, DOWNSAMPLE):
+        sub = Subscriber(writer=None, name='test', max_queue=8, policy=policy)
+        dropped = sum(sub.offer(str(i)) for i in range(100))
+        assert len(sub.queue) <= 8
+        assert sub.queue[-1] == '99'  # the newest line is always kept
+        assert dropped == sub.dropped == 100 - len(sub.queue)
+
+
+async def fast_client(port, counts, i):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            counts[i] += data.count(b'\n')
+    except (asyncio.CancelledError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def stalled_client(port):
+    """Connected but never reading, with a tiny receive buffer so it backs up quickly"""
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', port))
+    return sock
+
+
+async def run_relay(policy):
+    # 2000 lines/s from the emulator (1000 Hz cube stream at twice real time)
+    relay = Relay(EmulatorTransport(rate=1000.0, speed=2.0, name=f'test_relay_{policy}'),
+                  host='127.0.0.1', port=0, max_queue=MAX_QUEUE, policy=policy,
+                  start_commands=['startCubeStream'], stall_timeout=0.5)
+    await relay.start()
+    dropped = relay.lines_dropped.value
+    disconnects = relay.disconnects.value
+    counts = [0] * SUBSCRIBERS
+    clients = [asyncio.ensure_future(fast_client(relay.port, counts, i)) for i in range(SUBSCRIBERS)]
+    stalled = await stalled_client(relay.port)
+    stalled_name = str(stalled.getsockname())
+    try:
+        deadline = time.monotonic() + 5.0
+        while len(relay.subscribers) < SUBSCRIBERS + 1 and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        assert len(relay.subscribers) == SUBSCRIBERS + 1
+
+        largest = 0
+        disconnected_at = None
+        deadline = time.monotonic() + 15.0
+        while time.monotonic() < deadline:
+            largest = max([largest] + [len(sub.queue) for sub in relay.subscribers])
+            if disconnected_at is None and stalled_name not in {sub.name for sub in relay.subscribers}:
+                disconnected_at = list(counts)
+            if disconnected_at and min(c - d for c, d in zip(counts, disconnected_at)) > 0:
+                break  # every fast subscriber kept receiving after the stall
+            await asyncio.sleep(0.02)
+        return (largest, relay.lines_dropped.value - dropped, relay.disconnects.value - disconnects,
+                disconnected_at, list(counts), len(relay.subscribers))
+    finally:
+        for client in clients:
+            client.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+        stalled.close()
+        await relay.stop()
+
+
+@pytest.mark.parametrize('policy', [DROP_OLDEST, DOWNSAMPLE])
+def test_relay_fan_out_with_stalled_subscriber(policy):
+    largest, dropped, disconnects, disconnected_at, counts, remaining = asyncio.run(run_relay(policy))
+    assert largest <= MAX_QUEUE
+    assert dropped > 0  # the stalled subscriber's queue overflowed before it was dropped
+    assert disconnects == 1
+    assert disconnected_at is not None
+    assert remaining == SUBSCRIBERS
+    assert all(after > before for after, before in zip(counts, disconnected_at))
@@ -0,0 +1,39 @@
+import numpy as np
+
+from device_emulator import DeviceEmulator
+from sensor_fusion import FilterBank, FirmwareFilter, parse_raw_batch, synthetic_session
+
+
+def test_firmware_replica_integrates_over_row_periods():
+    # Polling every 20th sample of a 1000 Hz board must still turn at the real yaw rate
+    batch, _ = synthetic_session(seconds=5.0, rate=1000.0)
+    full = FirmwareFilter(freq=1000.0).update_batch(batch)
+    polled = FirmwareFilter(freq=1000.0).update_batch(batch[::20])
+    assert abs(polled[-1, 2] - full[-20, 2]) < 0.05 * abs(full[-20, 2])
+
+
+def test_bank_matches_single_filter_across_batches():
+    batch, _ = synthetic_session(seconds=2.0, rate=200.0)
+    params = [(0.3, 0.08, 0.7), (0.5, 0.2, 0.9)]
+    bank = FilterBank(params, freq=200.0)
+    out = np.concatenate([bank.update_batch(batch[i:i + 37]) for i in range(0, len(batch), 37)])
+    for k, p in enumerate(params):
+        single = FirmwareFilter(*p, freq=200.0).update_batch(batch)
+        assert np.allclose(out[:, k], single, atol=1e-6)
+
+
+def test_raw_batch_stream_has_every_sample():
+    now = [0.0]
+    emulator = DeviceEmulator(rate=500.0, clock=lambda: now[0])
+    assert emulator.handle('#1 R10') == ['ack:1']
+    assert emulator.handle('#2 R51') == ['err:2:out of range']
+    now[0] = 0.2
+    frames = [line for line in emulator.read().decode().split() if line.startswith('rb:')]
+    parsed = [parse_raw_batch(line) for line in frames]
+    seq = np.concatenate([batch['seq'] for _, batch in parsed])
+    assert len(frames) == 10
+    assert np.array_equal(seq, np.arange(seq[0], seq[0] + 100))
+    rows = np.concatenate([rows for rows, _ in parsed])
+    acc, rates = emulator.raw(rows[0, 0])
+    assert np.allclose(rows[0, 1:4], acc, atol=1.0)
+    assert np.allclose(rows[0, 4:7], rates, atol=1e-3)
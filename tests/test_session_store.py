@@ -0,0 +1,72 @@
+import time
+
+import numpy as np
+
+from sample import SAMPLE_DTYPE
+from session_store import SessionStore, SessionWriter, StoreReader
+from transport import open_link
+
+
+def records(times):
+    out = np.zeros(len(times), dtype=SAMPLE_DTYPE)
+    out['t'] = times
+    out['seq'] = np.arange(len(times))
+    return out
+
+
+def test_extend_keeps_times_monotonic(tmp_path):
+    path = str(tmp_path / 'session.tlm')
+    writer = SessionWriter(path, chunk_records=4)
+    writer.extend(records([0.0, 0.1, 0.2]))
+    writer.extend(records([0.15, 0.3, 0.25, 0.4, 0.5]))  # overlaps the last batch, then one late sample
+    writer.extend(records([0.45]))
+    writer.close()
+
+    store = SessionStore(path)
+    t = store.range(0.0, 1.0)['t']
+    store.close()
+    assert t.tolist() == [0.0, 0.1, 0.2, 0.3, 0.4, 0.5]
+
+
+def test_store_replay_interleaves_params(tmp_path):
+    path = str(tmp_path / 'session.tlm')
+    writer = SessionWriter(path, chunk_records=4)
+    writer.add_params(0.0, 0.3, 0.08, 0.7)
+    writer.extend(records([0.0, 0.1, 0.2]))
+    writer.add_params(0.25, 0.5, 0.1, 0.9)
+    writer.extend(records([0.3, 0.4, 0.5]))
+    writer.close()
+
+    reader = StoreReader(path)
+    reader.seek(0.0)
+    lines = []
+    while True:
+        item = reader.read()
+        if item is None:
+            break
+        lines.append(item)
+    assert [t for t, _ in lines] == [0.0, 0.0, 0.1, 0.2, 0.25, 0.3, 0.4, 0.5]
+    assert lines[0][1] == 'params:0.3000,0.0800,0.7000'
+    assert lines[4][1] == 'params:0.5000,0.1000,0.9000'
+
+    reader.seek(0.4)  # the values in effect come first
+    assert reader.read() == (0.4, 'params:0.5000,0.1000,0.9000')
+    assert reader.read()[0] == 0.4
+    reader.close()
+
+
+def test_tlm_replay_answers_recorded_params(tmp_path):
+    path = str(tmp_path / 'session.tlm')
+    writer = SessionWriter(path)
+    writer.add_params(0.0, 0.45, 0.12, 0.8)
+    writer.extend(records(np.arange(50) / 50.0))
+    writer.close()
+
+    link = open_link(f"replay:{path}", name='test_tlm_replay')
+    try:
+        deadline = time.monotonic() + 5.0
+        while not link.read_lines() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert link.command('?').result(2.0) == '0.4500,0.1200,0.8000'
+    finally:
+        link.close()
@@ -0,0 +1,33 @@
+from sample import Sample, to_array
+from telemetry import TelemetryMonitor, GAP, NEW
+
+
+def samples(seqs):
+    return [Sample(seq / 1000.0, seq) for seq in seqs]
+
+
+def test_polled_frames_skip_without_loss():
+    monitor = TelemetryMonitor(name='test_polled')
+    statuses = [monitor.update(s, polled=True) for s in samples([10, 30, 31, 55])]
+    assert statuses == [NEW] * 4
+    assert monitor.lost.value == 0
+    assert monitor.skipped.value == 19 + 23
+    assert monitor.loss_ratio() == 0.0
+
+
+def test_pushed_gaps_count_as_loss():
+    monitor = TelemetryMonitor(name='test_pushed')
+    assert monitor.update_batch(to_array(samples(range(0, 5)))) == NEW
+    assert monitor.update_batch(to_array(samples(range(5, 10)))) == NEW
+    assert monitor.update_batch(to_array(samples(range(13, 18)))) == GAP
+    assert monitor.lost.value == 3
+    assert monitor.received.value == 15
+
+
+def test_switch_from_polling_to_stream():
+    # The first batch after a poll reply is not compared against the poll's seq
+    monitor = TelemetryMonitor(name='test_switch')
+    monitor.update(Sample(0.1, 100), polled=True)
+    assert monitor.update_batch(to_array(samples(range(140, 144)))) == NEW
+    assert monitor.update_batch(to_array(samples(range(146, 150)))) == GAP
+    assert monitor.lost.value == 2
@@ -0,0 +1,80 @@
+import numpy as np
+
+from sample import SAMPLE_DTYPE
+from trail import Trail, upload_ranges
+
+
+def samples(t):
+    data = np.zeros(len(t), dtype=SAMPLE_DTYPE)
+    data['t'] = t
+    data['gx'] = 20 * np.sin(2 * np.pi * 0.7 * data['t'])
+    data['gy'] = 15 * np.sin(2 * np.pi * 1.1 * data['t'])
+    return data
+
+
+def test_upload_ranges():
+    assert upload_ranges(5, 5, 10) == []
+    assert upload_ranges(2, 6, 10) == [(2, 6)]
+    assert upload_ranges(0, 4, 10) == [(0, 4), (10, 11)]        # slot 0 and its spare copy
+    assert upload_ranges(7, 13, 10) == [(7, 10), (0, 3), (10, 11)]  # wrapped
+    assert upload_ranges(6, 10, 10) == [(6, 10)]                 # ends exactly at the wrap
+    assert upload_ranges(3, 13, 10) == [(0, 11)]                 # a whole ring or more
+    assert upload_ranges(3, 40, 10) == [(0, 11)]
+
+
+def test_uploads_keep_a_mirror_in_step():
+    # Apply the upload ranges to a copy, as glBufferSubData does to the buffer
+    rng = np.random.default_rng(3)
+    trail = Trail(100, span=1.0)
+    mirror = np.zeros_like(trail.vertices)
+    data = samples(50.0 + np.arange(3000) / 1000.0)
+    pos = 0
+    while pos < len(data):
+        step = int(rng.integers(1, 150))
+        trail.push(data[pos:pos + step])
+        pos += step
+        for start, end in upload_ranges(trail.uploaded, trail.written, trail.capacity):
+            mirror[start:end] = trail.vertices[start:end]
+        trail.uploaded = trail.written
+        assert np.array_equal(mirror, trail.vertices)
+    assert np.array_equal(trail.vertices[trail.capacity], trail.vertices[0])
+
+
+def test_strips_follow_the_ring():
+    rng = np.random.default_rng(1)
+    data = samples(100.0 + np.arange(5000) / 1000.0)
+    trail = Trail(1000, span=0.7)
+    pos = 0
+    while pos < len(data):
+        step = int(rng.integers(1, 1500))
+        trail.push(data[pos:pos + step])
+        pos = min(pos + step, len(data))
+        parts = [trail.vertices[first:first + count] for first, count in trail.strips()]
+        assert len(parts) in (1, 2)
+        shown = np.concatenate([parts[0][:-1], parts[1]]) if len(parts) == 2 else parts[0]  # joint drawn twice
+        held = data[max(0, pos - 1000):pos]
+        expected = held[(held['t'] - data['t'][0]).astype(np.float32) >= np.float32(trail.newest - trail.span)]
+        assert len(shown) == len(expected)
+        assert np.allclose(shown[:, 3], expected['t'] - data['t'][0], atol=1e-4)
+
+
+def test_time_regression_clears():
+    trail = Trail(100, span=10.0)
+    trail.push(samples(20.0 + np.arange(150) / 100.0))
+    trail.uploaded = trail.written
+    trail.push(samples(3.0 + np.arange(5) / 100.0))  # board reset
+    assert len(trail) == 5 and trail.written == 5
+    assert trail.origin == 3.0
+    assert np.allclose(trail.newest, 0.04)
+    assert trail.strips() == [(0, 5)]
+    # Only the new samples go to the buffer, from slot 0
+    assert upload_ranges(trail.uploaded, trail.written, trail.capacity) == [(0, 5), (100, 101)]
+
+
+def test_yaw_switch_clears():
+    trail = Trail(100)
+    trail.push(samples(np.arange(10) / 100.0))
+    trail.set_yaw(False)
+    assert len(trail) == 10
+    trail.set_yaw(True)
+    assert len(trail) == 0 and trail.origin is None
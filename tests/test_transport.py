@@ -0,0 +1,245 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from device_emulator import DeviceEmulator
+from transport import EmulatorTransport, LineFramer, Link, Poll, TransportError, open_link
+
+
+def wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+class FlakyEmulator(EmulatorTransport):
+    """Emulator link that can be unplugged (drop) and refuses the next `failures` opens"""
+
+    def __init__(self, failures=0, **kwargs):
+        super().__init__(retry_delay=0.05, max_retry_delay=0.2, **kwargs)
+        self.failures = failures
+        self.attempts = []
+        self.drop = False
+
+    async def _open(self):
+        self.attempts.append(time.monotonic())
+        if len(self.attempts) > 1 and self.failures > 0:
+            self.failures -= 1
+            raise OSError("port busy")
+        await super()._open()
+
+    async def _read(self):
+        if self.drop:
+            self.drop = False
+            raise OSError("device unplugged")
+        return await super()._read()
+
+
+class SlowOpen(EmulatorTransport):
+    async def _open(self):
+        await asyncio.sleep(5.0)
+
+
+class DeafEmulator(DeviceEmulator):
+    """Old firmware: tagged commands are never answered"""
+
+    def handle(self, line):
+        return [] if line.startswith('#') else super().handle(line)
+
+
+# --- line framing ---------------------------------------------------------
+
+def test_framer_partial_lines():
+    framer = LineFramer()
+    assert framer.feed(b'1.00, 2.') == []
+    assert framer.feed(b'00, 3.00') == []
+    assert framer.feed(b', 7, 140\n12') == ['1.00, 2.00, 3.00, 7, 140']
+    assert framer.feed(b'3\n') == ['123']
+
+
+def test_framer_crlf():
+    framer = LineFramer()
+    assert framer.feed(b'ack:1:50.0\r\n') == ['ack:1:50.0']
+    # CR and LF split across reads
+    assert framer.feed(b'params:0.3\r') == []
+    assert framer.feed(b'\nok\r\n') == ['params:0.3', 'ok']
+
+
+def test_framer_multiple_lines_per_read():
+    framer = LineFramer()
+    assert framer.feed(b'a\nb\r\n\r\n\nc\nd') == ['a', 'b', 'c']
+    assert framer.feed(b'\n') == ['d']
+
+
+def test_framer_drops_garbage_without_newlines():
+    framer = LineFramer(max_line=16)
+    assert framer.feed(bytes(40)) == []
+    assert framer.overflows == 1
+    assert framer.feed(b'ok\n') == ['ok']
+
+
+# --- reconnection ---------------------------------------------------------
+
+def test_reconnect_with_backoff():
+    transport = FlakyEmulator(failures=4, name='test_reconnect')
+    link = Link(transport).start()
+    try:
+        assert link.request('.') is not None
+        transport.drop = True
+        link.send('.')  # wake the pending read, the next one fails
+        # The drop reopens at once, then 4 refused opens back off 0.05, 0.1, 0.2, 0.2 s
+        assert wait_for(lambda: len(transport.attempts) == 6 and link.connected)
+        gaps = [b - a for a, b in zip(transport.attempts[1:], transport.attempts[2:])]
+        for gap, delay in zip(gaps, [0.05, 0.1, 0.2, 0.2]):
+            assert delay <= gap < delay + 0.1
+        assert transport.reconnects.value == 1
+        assert link.request('.') is not None
+    finally:
+        link.close()
+
+
+def test_opens_counts_reconnects_and_keeps_the_open_hook():
+    transport = FlakyEmulator(name='test_opens')
+    started = []
+
+    async def start_stream():
+        started.append(len(transport.attempts))
+        await transport.send_command('startCubeStream')
+
+    transport.on_open = start_stream  # set before the link, like Relay
+    link = Link(transport).start()
+    try:
+        assert link.opens == 1
+        assert link.get_line(1.0) is not None  # streaming
+        transport.drop = True
+        assert wait_for(lambda: link.opens == 2)
+        assert started == [1, 2]
+    finally:
+        link.close()
+
+
+@pytest.mark.skipif(os.name != 'posix', reason="needs a pseudo terminal")
+def test_pty_backend():
+    link = open_link('pty:', name='test_pty')
+    try:
+        line = link.request('.')
+        assert line is not None and len(line.split(',')) == 5
+        assert link.command('s').result(2.0) == '50.0'
+    finally:
+        link.close()
+    assert not link.alive
+
+
+# --- request / command timeouts ------------------------------------------
+
+def test_request_timeout():
+    link = Link(EmulatorTransport(name='test_request')).start()
+    try:
+        start = time.monotonic()
+        assert link.request('z', timeout=0.2) is None  # no reply to a yaw reset
+        assert 0.2 <= time.monotonic() - start < 0.5
+        assert link.request('.', timeout=1.0) is not None
+    finally:
+        link.close()
+
+
+def test_command_ack_err_and_timeout():
+    link = Link(EmulatorTransport(name='test_command')).start()
+    try:
+        assert link.command('s').result(2.0) == '50.0'
+        with pytest.raises(TransportError, match='out of range'):
+            link.command('s5').result(2.0)
+    finally:
+        link.close()
+
+    link = Link(EmulatorTransport(emulator=DeafEmulator(), name='test_command_deaf')).start()
+    try:
+        start = time.monotonic()
+        with pytest.raises(TransportError, match='No ack'):
+            link.command('s', timeout=0.2).result(2.0)
+        assert time.monotonic() - start < 0.5
+        assert link.command_errors.value == 1
+    finally:
+        link.close()
+
+
+def test_calibration_acked_when_done_without_blocking_telemetry():
+    link = Link(EmulatorTransport(name='test_calibrate')).start()
+    try:
+        start = time.monotonic()
+        calibration = link.command('c', timeout=3.0)
+        assert link.request('.', timeout=0.5) is not None  # the board keeps answering
+        assert not calibration.done()
+        assert calibration.result(3.0) == ''
+        assert time.monotonic() - start >= 0.9
+    finally:
+        link.close()
+
+
+# --- start --------------------------------------------------------------
+
+def test_start_open_timeout():
+    link = Link(SlowOpen(name='test_slow_open'))
+    start = time.monotonic()
+    with pytest.raises(TransportError, match='timed out'):
+        link.start(timeout=0.3)
+    assert time.monotonic() - start < 1.0
+    assert not link.alive
+    assert not link.connected
+
+
+def test_start_open_failure():
+    class Refused(EmulatorTransport):
+        async def _open(self):
+            raise OSError("no such port")
+
+    with pytest.raises(TransportError, match='no such port'):
+        Link(Refused(name='test_refused')).start()
+
+
+# --- polling --------------------------------------------------------------
+
+def test_poll_keeps_receive_buffer_bounded():
+    # Firmware that handles one command byte per loop, polled far faster than 50 Hz
+    emulator = DeviceEmulator(drain=False)
+    link = Link(EmulatorTransport(emulator=emulator, name='test_poll')).start()
+    poll = Poll(link)
+    replies = 0
+    try:
+        start = time.monotonic()
+        while time.monotonic() - start < 1.0:
+            poll.send('.')
+            for _ in link.read_lines():
+                poll.answered()
+                replies += 1
+            time.sleep(0.002)
+    finally:
+        link.close()
+    assert replies >= 15
+    assert emulator.rx_overflows == 0
+    assert len(emulator.rx) <= 4  # at most one request and a leftover newline
+
+
+# --- recording ------------------------------------------------------------
+
+def test_recorder_spans_reconnects(tmp_path):
+    from replay import SessionReader, open_recorder
+
+    path = str(tmp_path / 'session.log')
+    recorder = open_recorder(path)
+    for _ in range(2):  # connect, drop, connect again (FilterGUI)
+        link = Link(EmulatorTransport(name='test_record'), record=recorder).start()
+        assert link.request('.') is not None
+        link.close()
+    recorder.close()
+    reader = SessionReader(path)
+    lines = []
+    while (item := reader.read()) is not None:
+        lines.append(item[1])
+    reader.close()
+    assert len(lines) == 2
@@ -0,0 +1,324 @@
+import ctypes
+import math
+import sys
+import time
+import numpy as np
+from OpenGL.GL import *
+
+"""
+Orientation history trail on an attitude sphere
+
+Trail keeps the last seconds of orientation as a path drawn by the tip of
+the board's up axis on a sphere around the body, fading with age, so a
+wobble or a slow drift shows as a shape instead of a blur. Samples live in
+a fixed-size ring of (x, y, z, t) float32 vertices, mirrored in a dynamic
+vertex buffer:
+    push() writes new samples into the host ring only,
+    draw() uploads just the slots written since the last frame with
+    glBufferSubData (two calls when the ring wraps), then draws the ring
+    with at most two glDrawArrays calls, oldest part first, leaving out
+    the points that have already faded.
+The fade needs no per-frame vertex updates: t goes out as a texture
+coordinate into a 1D alpha ramp and the texture matrix maps [newest - span,
+newest] onto it, so older points clamp to transparent. The work per frame
+is the new samples plus one draw of the visible part, whatever the length
+of the trail, up to the capacity (100k points by default).
+
+    trail = Trail(span=10.0)
+    trail.push(batch)        # SAMPLE_DTYPE array, or trail.append(sample)
+    trail.draw()             # scene transform without the body rotation
+"""
+
+DEFAULT_CAPACITY = 100000
+DEFAULT_SPAN = 10.0   # seconds of history shown
+SPHERE_RADIUS = 1.6   # just outside the box corners
+TRAIL_COLOR = (0.2, 0.9, 1.0)
+SPHERE_COLOR = (0.25, 0.25, 0.3)
+FADE_TEXELS = 256
+STRIDE = 4  # floats per vertex: x, y, z, t
+
+
+def up_vectors(gx, gy, gz=None):
+    """
+    Board up axis (0, 1, 0) in view coordinates for angles in degrees, (N, 3),
+    with the clients' rotation order: yaw about y, pitch about x, roll about z
+    """
+    roll, pitch = np.radians(gx), np.radians(gy)
+    x = np.sin(roll)
+    y = np.cos(roll) * np.cos(pitch)
+    z = np.cos(roll) * np.sin(pitch)
+    if gz is not None:
+        yaw = np.radians(gz)
+        x, z = x * np.cos(yaw) + z * np.sin(yaw), z * np.cos(yaw) - x * np.sin(yaw)
+    return np.stack(np.broadcast_arrays(x, y, z), axis=-1)
+
+
+def fade_ramp(texels=FADE_TEXELS):
+    """White RGBA texels with alpha rising from 0 (oldest) to 1 (newest)"""
+    ramp = np.full((texels, 4), 255, dtype=np.uint8)
+    ramp[:, 3] = np.rint(255 * np.linspace(0.0, 1.0, texels) ** 2)
+    return ramp
+
+
+def great_circles(radius=SPHERE_RADIUS, segments=64):
+    """Equator and two meridians as (3, segments, 3) line loop vertices"""
+    a = np.linspace(0.0, 2 * np.pi, segments, endpoint=False)
+    c, s, zero = radius * np.cos(a), radius * np.sin(a), np.zeros(segments)
+    return np.ascontiguousarray(np.stack([np.stack([c, zero, s], axis=1),
+                                          np.stack([c, s, zero], axis=1),
+                                          np.stack([zero, s, c], axis=1)]), dtype=np.float32)
+
+
+def upload_ranges(uploaded, written, capacity):
+    """
+    [start, end) ring slots written since the last upload, given the sample
+    counts then and now; the spare copy of slot 0 goes with slot 0
+    """
+    new = written - uploaded
+    if new >= capacity:
+        return [(0, capacity + 1)]
+    if new <= 0:
+        return []
+    start, end = uploaded % capacity, written % capacity
+    ranges = [(start, end)] if start < end else [(start, capacity), (0, end)]
+    ranges = [(first, last) for first, last in ranges if last > first]
+    if ranges[-1][0] == 0:
+        ranges.append((capacity, capacity + 1))
+    return ranges
+
+
+class Trail:
+    def __init__(self, capacity=DEFAULT_CAPACITY, span=DEFAULT_SPAN, radius=SPHERE_RADIUS,
+                 color=TRAIL_COLOR, yaw=False):
+        self.capacity = capacity
+        self.span = span
+        self.radius = radius
+        self.color = color
+        self.yaw = yaw  # follow gz too, like the clients' yaw mode
+        # One spare slot repeats slot 0, so the older part of a wrapped ring
+        # runs on into the newer one without a missing segment
+        self.vertices = np.zeros((capacity + 1, STRIDE), dtype=np.float32)
+        self.circles = great_circles(radius)
+        self.written = 0   # samples ever written, the head is written % capacity
+        self.uploaded = 0  # self.written at the last upload
+        self.origin = None  # time of the first sample, keeps t small for float32
+        self.newest = 0.0
+        self.buffer = None
+        self.texture = None
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def set_yaw(self, yaw):
+        """Follow yaw or not; the old path was drawn the other way, so drop it"""
+        if yaw != self.yaw:
+            self.yaw = yaw
+            self.clear()
+
+    def clear(self):
+        self.written = 0
+        self.uploaded = 0
+        self.origin = None
+        self.newest = 0.0
+
+    def push(self, batch):
+        """Add a SAMPLE_DTYPE batch; frames without device time use the arrival time"""
+        if not len(batch):
+            return
+        t = batch['t']
+        if np.isnan(t).any():
+            t = np.where(np.isnan(t), time.monotonic(), t)
+        self._write(up_vectors(batch['gx'], batch['gy'], batch['gz'] if self.yaw else None), t)
+
+    def append(self, sample):
+        """Add one Sample"""
+        t = sample.t if not math.isnan(sample.t) else time.monotonic()
+        self._write(up_vectors([sample.gx], [sample.gy], [sample.gz] if self.yaw else None), np.array([t]))
+
+    def _write(self, directions, t):
+        if self.origin is None or t[0] < self.origin + self.newest:
+            self.clear()  # first sample, or the clock went back (board reset, replay seek)
+            self.origin = float(t[0])
+        n = min(len(t), self.capacity)
+        slots = (self.written + len(t) - n + np.arange(n)) % self.capacity
+        self.vertices[slots, :3] = directions[-n:] * self.radius
+        self.vertices[slots, 3] = t[-n:] - self.origin
+        self.vertices[self.capacity] = self.vertices[0]
+        self.written += len(t)
+        self.newest = float(t[-1] - self.origin)
+
+    def upload(self):
+        """Create the buffer and fade texture on first use, then send only the new slots"""
+        if self.buffer is None:
+            self.buffer = int(glGenBuffers(1))
+            glBindBuffer(GL_ARRAY_BUFFER, self.buffer)
+            glBufferData(GL_ARRAY_BUFFER, self.vertices.nbytes, None, GL_DYNAMIC_DRAW)
+            self.uploaded = max(0, self.written - self.capacity)  # everything held is new
+            self.texture = int(glGenTextures(1))
+            glBindTexture(GL_TEXTURE_1D, self.texture)
+            glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+            glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+            glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+            glTexImage1D(GL_TEXTURE_1D, 0, GL_RGBA, FADE_TEXELS, 0, GL_RGBA, GL_UNSIGNED_BYTE, fade_ramp())
+        else:
+            glBindBuffer(GL_ARRAY_BUFFER, self.buffer)
+        ranges = upload_ranges(self.uploaded, self.written, self.capacity)
+        item = STRIDE * 4
+        for start, end in ranges:
+            glBufferSubData(GL_ARRAY_BUFFER, start * item, (end - start) * item, self.vertices[start:end])
+        self.uploaded = self.written
+        return sum(end - start for start, end in ranges)
+
+    def strips(self):
+        """(first, count) vertex ranges of the visible trail, oldest first"""
+        filled = len(self)
+        oldest = self.written % self.capacity if self.written > self.capacity else 0
+        # Times rise around the ring from the oldest slot: skip what has faded out
+        cutoff = np.float32(self.newest - self.span)
+        older = self.vertices[oldest:filled, 3]
+        skip = int(np.searchsorted(older, cutoff))
+        if skip == len(older) and oldest:
+            skip += int(np.searchsorted(self.vertices[:oldest, 3], cutoff))
+        first, count = (oldest + skip) % self.capacity, filled - skip
+        if first + count <= self.capacity:
+            return [(first, count)]
+        # Wrapped: on to the spare copy of slot 0, then from slot 0
+        return [(first, self.capacity + 1 - first), (0, first + count - self.capacity)]
+
+    def reset(self):
+        """Forget the GL objects, for a window that opens a new GL context"""
+        self.buffer = None
+        self.texture = None
+
+    def draw(self):
+        """Draw the sphere guide and the trail around the current origin"""
+        glPushAttrib(GL_ENABLE_BIT | GL_CURRENT_BIT | GL_DEPTH_BUFFER_BIT | GL_COLOR_BUFFER_BIT
+                     | GL_TEXTURE_BIT | GL_LINE_BIT | GL_POINT_BIT)
+        glDisable(GL_LIGHTING)
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        glDepthMask(GL_FALSE)  # translucent, test against the body but do not hide each other
+        glEnableClientState(GL_VERTEX_ARRAY)
+
+        glColor3f(*SPHERE_COLOR)
+        glVertexPointer(3, GL_FLOAT, 0, self.circles)
+        for i in range(len(self.circles)):
+            glDrawArrays(GL_LINE_LOOP, i * self.circles.shape[1], self.circles.shape[1])
+
+        if self.written:
+            self.upload()
+            glEnable(GL_TEXTURE_1D)
+            glBindTexture(GL_TEXTURE_1D, self.texture)
+            glTexEnvi(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_MODULATE)
+            # Texture coordinate t - origin -> 0..1 over the last span seconds
+            glMatrixMode(GL_TEXTURE)
+            glPushMatrix()
+            glLoadIdentity()
+            glScalef(1.0 / self.span, 1.0, 1.0)
+            glTranslatef(self.span - self.newest, 0.0, 0.0)
+            glMatrixMode(GL_MODELVIEW)
+
+            glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+            glVertexPointer(3, GL_FLOAT, STRIDE * 4, ctypes.c_void_p(0))
+            glTexCoordPointer(1, GL_FLOAT, STRIDE * 4, ctypes.c_void_p(12))
+            glColor3f(*self.color)
+            glLineWidth(2.0)
+            for first, count in self.strips():
+                glDrawArrays(GL_LINE_STRIP, first, count)
+            glPointSize(6.0)
+            glDrawArrays(GL_POINTS, (self.written - 1) % self.capacity, 1)  # where it points now
+            glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+            glMatrixMode(GL_TEXTURE)
+            glPopMatrix()
+            glMatrixMode(GL_MODELVIEW)
+
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glPopAttrib()
+
+
+if __name__ == '__main__':
+    # Check the ring against a plain list of samples, then benchmark with a
+    # display: 1 kHz samples at 60 fps into trails of rising length. The ring
+    # uploads ~17 samples per frame; re-sending the whole trail grows with it.
+    from sample import SAMPLE_DTYPE
+
+    rate, fps, frames = 1000, 60, 240
+    per_frame = rate // fps
+
+    def samples(n):
+        data = np.zeros(n, dtype=SAMPLE_DTYPE)
+        data['t'] = 100.0 + np.arange(n) / rate
+        data['gx'] = 20 * np.sin(2 * np.pi * 0.7 * data['t'])
+        data['gy'] = 15 * np.sin(2 * np.pi * 1.1 * data['t'])
+        return data
+
+    rng = np.random.default_rng(1)
+    data = samples(5000)
+    trail = Trail(1000, span=0.7)
+    pos = 0
+    while pos < len(data):
+        step = int(rng.integers(1, 1500))
+        trail.push(data[pos:pos + step])
+        pos = min(pos + step, len(data))
+        parts = [trail.vertices[first:first + count] for first, count in trail.strips()]
+        shown = np.concatenate([parts[0][:-1], parts[1]]) if len(parts) == 2 else parts[0]  # joint drawn twice
+        held = data[max(0, pos - 1000):pos]
+        expected = held[(held['t'] - data['t'][0]).astype(np.float32) >= np.float32(trail.newest - trail.span)]
+        assert len(shown) == len(expected), (len(shown), len(expected))
+        assert np.allclose(shown[:, 3], expected['t'] - data['t'][0], atol=1e-4), "strips out of order"
+    print("ring check passed")
+
+    import pygame
+    from pygame.locals import DOUBLEBUF, OPENGL
+    from OpenGL.GLU import gluPerspective
+    try:
+        pygame.init()
+        pygame.display.set_mode((640, 480), DOUBLEBUF | OPENGL)
+    except pygame.error as e:
+        print(f"No OpenGL display ({e}), skipping the benchmark")
+        sys.exit()
+    glMatrixMode(GL_PROJECTION)
+    gluPerspective(45, 640 / 480, 0.1, 100.0)
+    glMatrixMode(GL_MODELVIEW)
+    glEnable(GL_DEPTH_TEST)
+    glLoadIdentity()
+    glTranslatef(0.0, 0.0, -7.0)
+
+    print(f"{'points':>7} {'span':>6} {'ring upload':>12} {'full upload':>12} {'frame':>8}")
+    for capacity, span in ((1000, 1.0), (10000, 10.0), (100000, 10.0), (100000, 100.0)):
+        data = samples(capacity + frames * per_frame)  # start full, so the ring wraps while timing
+        trail = Trail(capacity, span=span)
+        trail.push(data[:capacity])
+        trail.draw()
+        glFinish()
+
+        upload = full = frame = 0.0
+        for i in range(frames):
+            trail.push(data[capacity + i * per_frame:capacity + (i + 1) * per_frame])
+            start = time.perf_counter()
+            trail.upload()
+            upload += time.perf_counter() - start
+            start = time.perf_counter()
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            trail.draw()
+            pygame.display.flip()
+            glFinish()
+            frame += time.perf_counter() - start
+            start = time.perf_counter()
+            glBindBuffer(GL_ARRAY_BUFFER, trail.buffer)
+            glBufferSubData(GL_ARRAY_BUFFER, 0, trail.vertices.nbytes, trail.vertices)  # naive
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+            glFinish()
+            full += time.perf_counter() - start
+
+        # The buffer must hold exactly the host ring after all the wrapped uploads
+        glBindBuffer(GL_ARRAY_BUFFER, trail.buffer)
+        gpu = np.frombuffer(glGetBufferSubData(GL_ARRAY_BUFFER, 0, trail.vertices.nbytes),
+                            np.float32).reshape(trail.vertices.shape)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        assert np.array_equal(gpu, trail.vertices), "buffer out of step with the ring"
+        print(f"{capacity:>7} {span:>5g}s {upload / frames * 1e6:>10.0f}us {full / frames * 1e6:>10.0f}us "
+              f"{frame / frames * 1e3:>6.2f}ms")
+    pygame.quit()
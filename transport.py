@@ -0,0 +1,634 @@
+import asyncio
+import collections
+import concurrent.futures
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+import metrics
+
+"""
+Unified transport layer for all host clients
+
+Every client talks to the ESP32 through a URL:
+    serial:COM8?baud=921600         pyserial port
+    tcp:esp32.local:12345           WiFi firmware socket
+    replay:session.log?speed=1&start=0  recorded session (replay.py), N x speed
+    pty:                            emulated device on a pseudo terminal (POSIX)
+    emulator:?rate=50&speed=1       emulated device in-process (no OS port),
+                                    device clock running speed x real time
+
+The backends are asyncio Transports with a common interface
+(open / lines / send_command / close). Line framing, buffering and
+reconnection with backoff are handled once in the Transport base class.
+
+GUI code is not async, so clients use a Link: it runs the transport on a
+background event loop and exposes non-blocking read_lines(), blocking
+get_line() and send(). Data polls go through a Poll, which keeps one
+request outstanding at a time so the board's receive buffer never backs up.
+
+Commands that change the board go through Link.command(): each is sent as
+'#<id> <command>' and the firmware answers 'ack:<id>[:data]' or
+'err:<id>:<reason>'. Acks are matched by id on the background loop and never
+reach read_lines(), so any number of commands can be in flight alongside
+the telemetry polls.
+
+Link health is exported through metrics.py, labelled with the link name.
+"""
+
+DEFAULT_SERIAL_URL = 'serial:COM8?baud=921600'
+DEFAULT_TCP_URL = 'tcp:esp32.local:12345'
+
+
+class TransportError(Exception):
+    pass
+
+
+class LineFramer:
+    """Splits a byte stream into text lines, keeping partial lines buffered"""
+
+    def __init__(self, max_line=4096):
+        self.buffer = bytearray()
+        self.max_line = max_line
+        self.overflows = 0
+
+    def feed(self, data):
+        self.buffer += data
+        if b'\n' not in data:
+            if len(self.buffer) > self.max_line:
+                # Garbage without newlines (wrong baud rate etc.), drop it
+                self.buffer.clear()
+                self.overflows += 1
+            return []
+        *complete, rest = self.buffer.split(b'\n')
+        self.buffer = bytearray(rest)
+        lines = []
+        for raw in complete:
+            line = raw.decode(errors='replace').strip()
+            if line:
+                lines.append(line)
+        return lines
+
+    def reset(self):
+        self.buffer.clear()
+
+
+class Transport:
+    """Base class: subclasses implement _open, _read, _write and _close"""
+
+    read_size = 1024
+
+    def __init__(self, reconnect=True, retry_delay=0.5, max_retry_delay=5.0, name='device'):
+        self.reconnect = reconnect
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.name = name
+        self.framer = LineFramer()
+        self.is_open = False
+        self.closing = False
+        self.write_lock = asyncio.Lock()  # one command line on the wire at a time
+        self.on_open = None  # optional coroutine function run after every (re)connect
+        self.bytes_in = metrics.counter('link_bytes_total', 'Bytes received', link=name)
+        self.lines_in = metrics.counter('link_lines_total', 'Lines received from the device', link=name)
+        self.reconnects = metrics.counter('link_reconnects_total', 'Transport reconnections', link=name)
+
+    async def open(self):
+        await self._open()
+        self.is_open = True
+        self.framer.reset()
+        if self.on_open:
+            await self.on_open()
+
+    async def close(self):
+        self.closing = True
+        if self.is_open:
+            self.is_open = False
+            await self._close()
+
+    async def send_command(self, command):
+        """Send one command line (newline added)"""
+        if not self.is_open:
+            raise TransportError("Transport not open")
+        data = (command + "\n").encode()
+        async with self.write_lock:
+            await self._write(data)
+
+    async def lines(self):
+        """Async generator of received lines, reconnecting on errors"""
+        delay = self.retry_delay
+        while not self.closing:
+            if not self.is_open:
+                try:
+                    await self.open()
+                    delay = self.retry_delay
+                except Exception as e:
+                    if not self.reconnect:
+                        raise TransportError(f"Open failed: {e}") from e
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_retry_delay)
+                    continue
+            try:
+                data = await self._read()
+                if not data:
+                    if not self.reconnect:
+                        break  # end of replay file, or peer closed
+                    raise TransportError("Connection closed")
+            except Exception as e:
+                if self.closing:
+                    break
+                self.is_open = False
+                try:
+                    await self._close()
+                except Exception:
+                    pass
+                if not self.reconnect:
+                    raise TransportError(str(e)) from e
+                self.reconnects.inc()
+                print(f"Transport error ({e}), reconnecting...")
+                continue
+            self.bytes_in.inc(len(data))
+            for line in self.framer.feed(data):
+                self.lines_in.inc()
+                yield line
+
+
+class SerialTransport(Transport):
+    def __init__(self, port='COM8', baudrate=921600, **kwargs):
+        super().__init__(**kwargs)
+        self.port = port
+        self.baudrate = baudrate
+        self.ser = None
+
+    async def _open(self):
+        import serial
+        self.ser = await asyncio.to_thread(serial.Serial, self.port, self.baudrate, timeout=0.1)
+
+    async def _read(self):
+        ser = self.ser
+        while not self.closing:
+            # pyserial is blocking, wait for data in a worker thread
+            data = await asyncio.to_thread(lambda: ser.read(ser.in_waiting or 1))
+            if data:
+                return data
+        return b''
+
+    async def _write(self, data):
+        await asyncio.to_thread(self.ser.write, data)
+
+    async def _close(self):
+        if self.ser:
+            self.ser.close()
+            self.ser = None
+
+
+class TcpTransport(Transport):
+    def __init__(self, host='esp32.local', port=12345, timeout=3.0, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = self.writer = None
+
+    async def _open(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+
+    async def _read(self):
+        return await self.reader.read(self.read_size)
+
+    async def _write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def _close(self):
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+            self.reader = self.writer = None
+
+
+class ReplayTransport(Transport):
+    """
+    Plays a recorded session (see replay.py) back as if it were the device.
+    speed scales the recorded timing (1 = real time, 0 = as fast as possible).
+    Parameter queries are answered from the last params seen in the session.
+    """
+
+    max_chunk = 256  # lines per read when running behind or unpaced
+
+    def __init__(self, path, speed=1.0, start=0.0, loop=False, interval=0.02, **kwargs):
+        kwargs.setdefault('reconnect', False)
+        super().__init__(**kwargs)
+        self.path = path
+        self.speed = speed
+        self.start = start
+        self.loop = loop
+        self.interval = interval
+        self.reader = None
+        self.pending_seek = None
+        self.next_item = None
+        self.anchor = None  # (wall time, session time) pacing reference
+        self.params = [0.3, 0.08, 0.7]
+        self.replies = []
+
+    async def _open(self):
+        from replay import open_reader
+        self.reader = await asyncio.to_thread(open_reader, self.path, self.interval)
+        self.reader.seek(self.start)
+        self.next_item = self.reader.read()
+        self.anchor = None
+
+    def seek(self, t):
+        """Jump to session time t (thread-safe, applied on the next read)"""
+        self.pending_seek = t
+
+    @property
+    def position(self):
+        return self.next_item[0] if self.next_item else self.reader.duration
+
+    async def _read(self):
+        if self.pending_seek is not None:
+            self.reader.seek(self.pending_seek)
+            self.pending_seek = None
+            self.next_item = self.reader.read()
+            self.anchor = None
+
+        chunk = []
+        if self.replies:
+            chunk, self.replies = self.replies, []
+        while len(chunk) < self.max_chunk:
+            if self.next_item is None:
+                if not self.loop:
+                    break
+                self.reader.seek(0)
+                self.next_item = self.reader.read()
+                self.anchor = None
+                if self.next_item is None:
+                    break
+            t, text = self.next_item
+            if self.speed > 0:
+                now = time.monotonic()
+                if self.anchor is None:
+                    self.anchor = (now, t)
+                due = self.anchor[0] + (t - self.anchor[1]) / self.speed
+                if due > now:
+                    if chunk:
+                        break  # deliver what is due, pace the rest
+                    await asyncio.sleep(due - now)
+            if text.startswith('params:'):
+                self.params = text[7:].split(',')
+            chunk.append(text)
+            self.next_item = self.reader.read()
+        if not chunk:
+            return b''
+        if self.speed <= 0:
+            await asyncio.sleep(0)  # let other tasks run between chunks
+        return ('\n'.join(chunk) + '\n').encode()
+
+    async def _write(self, data):
+        # Commands cannot change a recording, but answer the queries
+        for command in data.decode(errors='replace').split('\n'):
+            command = command.strip()
+            if command.startswith('#'):
+                cid, _, command = command[1:].partition(' ')
+                data = ':' + ','.join(self.params) if command == '?' else ''
+                self.replies.append(f"ack:{cid}{data}")
+            elif command == '?':
+                self.replies.append('params:' + ','.join(self.params))
+            elif command == 'get':
+                self.replies.append(','.join(self.params))
+            elif command.startswith('set') or command == 'save':
+                self.replies.append('OK')
+
+    async def _close(self):
+        if self.reader:
+            self.reader.close()
+            self.reader = None
+
+
+class EmulatorTransport(Transport):
+    """In-process emulated device (see device_emulator.py)"""
+
+    def __init__(self, rate=50.0, emulator=None, speed=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.rate = rate
+        self.speed = speed
+        self.emulator = emulator
+
+    async def _open(self):
+        if self.emulator is None:
+            from device_emulator import DeviceEmulator, scaled_clock
+            self.emulator = DeviceEmulator(rate=self.rate, clock=scaled_clock(self.speed))
+
+    async def _read(self):
+        while not self.closing:
+            data = self.emulator.read()
+            if data:
+                return data
+            await asyncio.sleep(1.0 / self.emulator.rate)
+        return b''
+
+    async def _write(self, data):
+        self.emulator.write(data)
+
+    async def _close(self):
+        pass
+
+
+class PtyTransport(SerialTransport):
+    """Emulated device behind a real pseudo terminal, read through pyserial"""
+
+    def __init__(self, rate=50.0, **kwargs):
+        super().__init__(port=None, **kwargs)
+        self.rate = rate
+        self.stop_event = threading.Event()
+
+    async def _open(self):
+        if self.port is None:
+            from device_emulator import DeviceEmulator, run_pty
+            self.port, _ = run_pty(DeviceEmulator(rate=self.rate), self.stop_event)
+        await super()._open()
+
+    async def close(self):
+        await super().close()
+        self.stop_event.set()
+
+
+def make_transport(url, **kwargs):
+    """Create a Transport from a URL like 'serial:COM8?baud=921600'"""
+    parts = urlsplit(url)
+    scheme = parts.scheme
+    target = parts.path or parts.netloc
+    query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+
+    if scheme == 'serial':
+        return SerialTransport(target, int(query.get('baud', 921600)), **kwargs)
+    if scheme == 'tcp':
+        host, _, port = target.lstrip('/').rpartition(':')
+        return TcpTransport(host, int(port), **kwargs)
+    if scheme == 'replay':
+        return ReplayTransport(target, float(query.get('speed', 1.0)), float(query.get('start', 0.0)),
+                               query.get('loop') == '1', float(query.get('interval', 0.02)), **kwargs)
+    if scheme == 'emulator':
+        return EmulatorTransport(float(query.get('rate', 50.0)), speed=float(query.get('speed', 1.0)), **kwargs)
+    if scheme == 'pty':
+        return PtyTransport(float(query.get('rate', 50.0)), **kwargs)
+    raise ValueError(f"Unknown transport: {url}")
+
+
+class Link:
+    """
+    Thread-safe, blocking-free wrapper used by the GUIs.
+    Received lines are buffered in a bounded queue (oldest dropped first).
+    record is a session file path (see replay.open_recorder) or a recorder.
+    A recorder passed in is left open on close(), so one recording can span
+    several links (reconnects); a path is opened and closed by the link.
+    opens counts (re)connects: a reconnected board may have lost its stream
+    settings, so clients restart their streams when it changes.
+    """
+
+    def __init__(self, transport, max_lines=1024, record=None):
+        self.transport = transport
+        self.lines = collections.deque(maxlen=max_lines)
+        self.recorder = None
+        self.owns_recorder = isinstance(record, str)
+        if self.owns_recorder:
+            from replay import open_recorder
+            self.recorder = open_recorder(record)
+        elif record:
+            self.recorder = record
+        self.dropped = metrics.counter('link_dropped_lines_total',
+                                       'Lines dropped because the client fell behind',
+                                       link=transport.name)
+        self.rtt = metrics.summary('command_rtt_seconds', 'Request to reply round trip time',
+                                   link=transport.name)
+        self.command_errors = metrics.counter('command_errors_total',
+                                              'Commands answered with err or not acknowledged',
+                                              link=transport.name)
+        self.opens = 0
+        self.open_hook = transport.on_open  # e.g. start commands, still run first
+        transport.on_open = self._opened
+        self.pending = {}  # command id -> future, only touched on the loop thread
+        self.next_id = 0
+        self.error = None
+        self.cond = threading.Condition()
+        self.loop = asyncio.new_event_loop()
+        self.task = None
+        self.thread = threading.Thread(target=self._run, name=f'link-{transport.name}', daemon=True)
+        self.opened = threading.Event()
+
+    @property
+    def connected(self):
+        return self.transport.is_open
+
+    @property
+    def alive(self):
+        """False once the link has been closed or failed for good"""
+        return self.thread.is_alive()
+
+    def start(self, timeout=3.0):
+        """Start the background loop, raises if the first open fails or takes over timeout s"""
+        self.task = self.loop.create_task(self._pump())
+        self.thread.start()
+        if not self.opened.wait(timeout):
+            # Give up on the open (a port that hangs, an unreachable host) and stop the loop
+            self.transport.closing = True
+            self.loop.call_soon_threadsafe(self.task.cancel)
+            self.thread.join(2.0)
+            self._close_recorder()
+            raise TransportError(f"Open timed out after {timeout} s")
+        if self.error is not None:
+            self._close_recorder()
+            raise TransportError(f"Open failed: {self.error}") from self.error
+        return self
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            # Fail commands still waiting for an ack
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            if self.transport.is_open:
+                try:
+                    self.loop.run_until_complete(self.transport.close())
+                except Exception:
+                    pass
+            self.opened.set()
+            with self.cond:
+                self.cond.notify_all()
+
+    async def _opened(self):
+        if self.open_hook:
+            await self.open_hook()
+        self.opens += 1
+
+    async def _pump(self):
+        transport = self.transport
+        # Fail fast on the first open, later drops reconnect in lines()
+        await transport.open()
+        self.opened.set()
+        recorder = self.recorder
+        async for line in transport.lines():
+            if recorder:
+                recorder.write(line)
+            if line.startswith(('ack:', 'err:')) and self._resolve(line):
+                continue  # command replies never reach the telemetry queue
+            with self.cond:
+                if len(self.lines) == self.lines.maxlen:
+                    self.dropped.inc()
+                self.lines.append(line)
+                self.cond.notify()
+
+    def _resolve(self, line):
+        """Complete the command waiting for this ack/err line"""
+        kind, _, rest = line.partition(':')
+        id_text, _, data = rest.partition(':')
+        try:
+            future = self.pending.pop(int(id_text))
+        except (ValueError, KeyError):
+            return id_text.isdigit()  # late reply to a command that timed out
+        if future.done():
+            return True
+        if kind == 'ack':
+            future.set_result(data)
+        else:
+            future.set_exception(TransportError(f"Device error: {data or 'unknown'}"))
+        return True
+
+    async def _command(self, command, timeout):
+        self.next_id = self.next_id % 99999 + 1
+        cid = self.next_id
+        future = self.loop.create_future()
+        self.pending[cid] = future
+        start = time.perf_counter()
+        try:
+            await self.transport.send_command(f"#{cid} {command}")
+            result = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.command_errors.inc()
+            raise TransportError(f"No ack for '{command}' after {timeout} s") from None
+        except asyncio.CancelledError:
+            raise TransportError("Link closed") from None
+        except TransportError:
+            self.command_errors.inc()
+            raise
+        finally:
+            self.pending.pop(cid, None)
+        self.rtt.observe(time.perf_counter() - start)
+        return result
+
+    def command(self, command, timeout=1.0):
+        """
+        Send an acknowledged command, never blocks the caller.
+        Returns a concurrent.futures.Future with the ack data ('' if none);
+        it fails with TransportError on an err reply, a timeout or a closed link.
+        Commands are pipelined and acked in the order they were sent.
+        """
+        if not self.loop.is_running() or not self.transport.is_open:
+            future = concurrent.futures.Future()
+            future.set_exception(TransportError("Not connected"))
+            return future
+        return asyncio.run_coroutine_threadsafe(self._command(command, timeout), self.loop)
+
+    def send(self, command):
+        """Queue a command for sending, never blocks the caller"""
+        if not self.loop.is_running() or not self.transport.is_open:
+            return False
+        future = asyncio.run_coroutine_threadsafe(self.transport.send_command(command), self.loop)
+        future.add_done_callback(lambda f: f.exception())  # errors are handled by the reader
+        return True
+
+    def read_lines(self):
+        """All lines received since the last call"""
+        with self.cond:
+            lines = list(self.lines)
+            self.lines.clear()
+        return lines
+
+    def get_line(self, timeout=1.0):
+        """Next received line, or None after timeout"""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while not self.lines:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.thread.is_alive():
+                    return None
+                self.cond.wait(remaining)
+            return self.lines.popleft()
+
+    def request(self, command, timeout=1.0):
+        """Send a command and return the next line received (legacy protocols)"""
+        self.read_lines()
+        start = time.perf_counter()
+        if not self.send(command):
+            return None
+        line = self.get_line(timeout)
+        if line is not None:
+            self.rtt.observe(time.perf_counter() - start)
+        return line
+
+    def close(self):
+        if self.loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(self.transport.close(), self.loop)
+            try:
+                future.result(2.0)
+            except Exception:
+                pass
+        self.thread.join(2.0)
+        self._close_recorder()
+
+    def _close_recorder(self):
+        if self.recorder and self.owns_recorder:
+            self.recorder.close()
+
+
+class Poll:
+    """
+    Data requests ('.', 'r') with at most one outstanding. The firmware
+    answers them from its sample loop, so a request every frame regardless
+    would pile up in its receive buffer and the replies would lag further
+    and further behind. The next request goes out after the reply
+    (answered()) or after timeout seconds.
+    """
+
+    def __init__(self, link, timeout=0.25):
+        self.link = link
+        self.timeout = timeout
+        self.sent = None  # time of the unanswered request
+        self.rtt = metrics.summary('command_rtt_seconds', 'Request to reply round trip time',
+                                   link=f'{link.transport.name}_poll')
+        self.timeouts = metrics.counter('poll_timeouts_total', 'Data requests that got no reply in time',
+                                        link=link.transport.name)
+
+    def send(self, command):
+        """Send the request unless one is still outstanding, True if it was sent"""
+        now = time.perf_counter()
+        if self.sent is not None:
+            if now - self.sent < self.timeout:
+                return False
+            self.timeouts.inc()
+        if not self.link.send(command):
+            return False
+        self.sent = now
+        return True
+
+    def answered(self):
+        """Call for every reply line, the next request may go out"""
+        if self.sent is not None:
+            self.rtt.observe(time.perf_counter() - self.sent)
+            self.sent = None
+
+
+def open_link(url, record=None, **kwargs):
+    """Create and start a Link for a transport URL, optionally recording a session"""
+    return Link(make_transport(url, **kwargs), record=record).start()